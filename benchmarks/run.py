@@ -0,0 +1,251 @@
+"""Benchmarks of opening COGs and reading tiles.
+
+Generates a synthetic COG with the test helpers of tests/synthetic.py and measures, for each
+backend, the time and requests to open it, the latency and throughput of
+get_tile and the memory allocated. Remote backends are local stand-ins with
+injectable latency, so results are reproducible without network access.
+
+    python benchmarks/run.py --backend file --backend http --latency 20 \
+        --output results.json
+    python benchmarks/run.py --compare results.json
+
+With --compare the run fails if a timing got slower than the baseline by
+more than --tolerance.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from cogdumper import __version__ as cogdumper_version
+from cogdumper.cog_tiles import COGTiff
+
+# the synthetic COGs and backend stand-ins are those of the tests
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                                'tests'))
+
+from synthetic import FakeS3Client, make_cog, overview_levels, serve_files  # noqa: E402
+
+BACKENDS = ('file', 'mmap', 'http', 's3')
+
+# timings compared against a baseline, as (section, statistic)
+COMPARED = (('open', 'p50_ms'), ('get_tile', 'p50_ms'), ('concurrent', 'seconds'))
+
+
+def percentiles(samples):
+    """Summary of timings in seconds, in milliseconds."""
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'mean_ms': statistics.mean(ordered) * 1000,
+        'p50_ms': ordered[len(ordered) // 2] * 1000,
+        'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        'max_ms': ordered[-1] * 1000
+    }
+
+
+class Backend:
+    """Creates readers of the synthetic COG for one backend."""
+
+    def __init__(self, name, data, directory, latency):
+        self.name = name
+        self._closers = []
+        if name in ('file', 'mmap'):
+            self.path = os.path.join(directory, 'cog.tif')
+            with open(self.path, 'wb') as dst:
+                dst.write(data)
+        elif name == 'http':
+            self.server = serve_files({'/data/cog.tif': data}, latency=latency)
+        elif name == 's3':
+            self.client = FakeS3Client({('bench', 'cog.tif'): data}, latency=latency)
+        else:
+            raise ValueError(f'Unknown backend {name}')
+
+    def reader(self):
+        if self.name == 'file':
+            from cogdumper.filedumper import Reader
+            handle = open(self.path, 'rb')
+            self._closers.append(handle.close)
+            return Reader(handle)
+        elif self.name == 'mmap':
+            from cogdumper.filedumper import MMapReader
+            reader = MMapReader.open(self.path)
+            self._closers.append(reader.close)
+            return reader
+        elif self.name == 'http':
+            from cogdumper.httpdumper import Reader
+            return Reader(self.server.url, 'data', 'cog.tif')
+        else:
+            from cogdumper.s3dumper import Reader
+            return Reader('bench', 'cog.tif', client=self.client)
+
+    def close(self):
+        for close in self._closers:
+            try:
+                close()
+            except BufferError:
+                pass
+        if self.name == 'http':
+            self.server.shutdown()
+            self.server.server_close()
+
+
+def bench_backend(backend, tiles, args):
+    """Run the benchmarks of one backend."""
+    open_times = []
+    for _ in range(args.repeat):
+        reader = backend.reader()
+        start = time.perf_counter()
+        cog = COGTiff(reader.read)
+        open_times.append(time.perf_counter() - start)
+    header = cog.header_stats
+
+    tile_times = []
+    size = 0
+    for x, y, z in tiles:
+        start = time.perf_counter()
+        _, tile = cog.get_tile(x, y, z)
+        tile_times.append(time.perf_counter() - start)
+        size += len(tile)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        list(executor.map(lambda t: cog.get_tile(*t), tiles))
+    concurrent = time.perf_counter() - start
+
+    tracemalloc.start()
+    reader = backend.reader()
+    cog = COGTiff(reader.read)
+    open_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    for x, y, z in tiles[:args.workers]:
+        cog.get_tile(x, y, z)
+    tile_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'backend': backend.name,
+        'open': dict(percentiles(open_times), **header),
+        'get_tile': dict(
+            percentiles(tile_times),
+            tiles_per_second=len(tiles) / sum(tile_times),
+            bytes=size
+        ),
+        'concurrent': {
+            'workers': args.workers,
+            'seconds': concurrent,
+            'tiles_per_second': len(tiles) / concurrent
+        },
+        'memory': {
+            'open_peak_bytes': open_peak,
+            'get_tile_peak_bytes': tile_peak
+        }
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Timings that got slower than the baseline by more than tolerance."""
+    previous = {r['backend']: r for r in baseline['results']}
+    regressions = []
+    for result in results['results']:
+        before = previous.get(result['backend'])
+        if before is None:
+            continue
+        for section, statistic in COMPARED:
+            old = before[section][statistic]
+            new = result[section][statistic]
+            if old > 0 and new > old * tolerance:
+                regressions.append(
+                    f'{result["backend"]} {section} {statistic}: '
+                    f'{old:.3f} -> {new:.3f}'
+                )
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--backend', action='append', choices=BACKENDS,
+                        help='backend to measure, may be repeated, all by default')
+    parser.add_argument('--width', type=int, default=16384)
+    parser.add_argument('--height', type=int, default=16384)
+    parser.add_argument('--tile-size', type=int, default=256,
+                        help='tile width and height in pixels')
+    parser.add_argument('--tile-bytes', type=int, default=4096,
+                        help='approximate size of each tile')
+    parser.add_argument('--overviews', type=int, default=5)
+    parser.add_argument('--bigtiff', action='store_true')
+    parser.add_argument('--endian', choices=('<', '>'), default='<')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='milliseconds added to each HTTP and S3 request')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='number of times the COG is opened')
+    parser.add_argument('--tiles', type=int, default=200,
+                        help='number of tiles read')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='threads reading tiles concurrently')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON results of a baseline run')
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help='slowdown relative to the baseline that fails the run')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    levels = overview_levels(args.width, args.height, args.overviews)
+    data = make_cog(levels, tile_size=args.tile_size, endian=args.endian,
+                    bigtiff=args.bigtiff, tile_bytes=args.tile_bytes)
+
+    rng = random.Random(args.seed)
+    nx = -(-args.width // args.tile_size)
+    ny = -(-args.height // args.tile_size)
+    tiles = [(rng.randrange(nx), rng.randrange(ny), 0) for _ in range(args.tiles)]
+
+    results = {
+        'config': {
+            k: v for k, v in vars(args).items()
+            if k not in ('output', 'compare', 'tolerance')
+        },
+        'file_size': len(data),
+        'levels': len(levels),
+        'cogdumper': cogdumper_version,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': []
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        for name in args.backend or BACKENDS:
+            backend = Backend(name, data, directory, args.latency / 1000)
+            try:
+                results['results'].append(bench_backend(backend, tiles, args))
+            finally:
+                backend.close()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as dst:
+            dst.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as src:
+            regressions = compare(results, json.load(src), args.tolerance)
+        for regression in regressions:
+            print(f'Regression: {regression}', file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""Asyncio support for extracting tiff tiles.
+
+asyncio is imported by the coroutines that use it, so that importing a
+backend for its synchronous reader does not import asyncio.
+"""
+
+from abc import abstractmethod
+
+from cogdumper.cog_tiles import COGTiff, merge_gap
+from cogdumper.ranges import coalesce
+
+
+class AbstractAsyncReader:  # pragma: no cover
+    @abstractmethod
+    async def read(self, offset, length):
+        pass
+
+    async def close(self):
+        pass
+
+
+class _NeedBytes(Exception):
+    """Raised when parsing reaches a byte range that was not fetched yet."""
+
+    def __init__(self, offset, length):
+        self.offset = offset
+        self.length = length
+
+
+class AsyncCOGTiff:
+    """Cloud Optimised GeoTIFF read through an asyncio reader.
+
+    The header is parsed by cogdumper.cog_tiles.COGTiff against the ranges
+    fetched so far. Whenever parsing needs a range that has not been fetched
+    it is abandoned, the range is awaited and parsing starts over, which
+    costs little as headers are only a handful of reads.
+    """
+
+    def __init__(self, reader):
+        """Use AsyncCOGTiff.open to create instances.
+        Parameters
+        ----------
+        reader:
+            coroutine function with the signature of
+            cogdumper.aio.AbstractAsyncReader.read
+        """
+        self.read = reader
+        self._fetched = {}
+        self._cog = None
+
+    @classmethod
+    async def open(cls, reader, index=None):
+        """Open a COG and parse its header.
+        Parameters
+        ----------
+        reader:
+            coroutine function with the signature of
+            cogdumper.aio.AbstractAsyncReader.read
+        index:
+            Optional tile index previously produced by COGTiff.to_index
+        Returns
+        -------
+        AsyncCOGTiff
+        """
+        cog = cls(reader)
+        cog._cog = await cog._resolve(COGTiff, cog._read_fetched, index=index)
+        return cog
+
+    def _read_fetched(self, offset, length):
+        try:
+            return self._fetched[(offset, length)]
+        except KeyError:
+            raise _NeedBytes(offset, length)
+
+    async def _resolve(self, func, *args, **kwargs):
+        """Call a parsing function, fetching the ranges it needs.
+
+        The ranges are only kept until the call returns, what it parsed is
+        held by the COGTiff.
+        """
+        fetched = []
+        try:
+            while True:
+                try:
+                    return func(*args, **kwargs)
+                except _NeedBytes as e:
+                    key = (e.offset, e.length)
+                    self._fetched[key] = await self.read(e.offset, e.length)
+                    fetched.append(key)
+        finally:
+            for key in fetched:
+                self._fetched.pop(key, None)
+
+    async def get_tile(self, x, y, z, segments=False):
+        """Read tile data, fetching the image and mask concurrently, or at once
+        when the mask is interleaved with the image.
+
+        See cogdumper.cog_tiles.COGTiff.get_tile.
+        """
+        import asyncio
+        image_ifd, ranges = await self._resolve(self._cog._tile_ranges, x, y, z)
+        merged = self._cog._tile_reads(ranges)
+        results = await asyncio.gather(
+            *[self.read(start, length) for start, length, _ in merged]
+        )
+        located = [(image_ifd, 0, len(ranges))]
+        return self._cog._assemble_tiles(located, ranges, merged, results, segments)[0]
+
+    async def get_tiles(self, tiles, max_gap=None, segments=False):
+        """Read many tiles, see cogdumper.cog_tiles.COGTiff.get_tiles."""
+        import asyncio
+        located, ranges = await self._resolve(self._cog._locate_tiles, tiles)
+        merged = coalesce(self._cog._block_ranges(ranges), merge_gap(max_gap))
+        results = await asyncio.gather(
+            *[self.read(start, length) for start, length, _ in merged]
+        )
+        return self._cog._assemble_tiles(located, ranges, merged, results, segments)
+
+    def to_index(self):
+        return self._cog.to_index()
+
+    @property
+    def version(self):
+        return self._cog.version
@@ -0,0 +1,175 @@
+"""Batch reading of tiles listed on a stream.
+
+Tiles are listed one per line, either as "x y z" or as JSON, and written in
+the order they are listed, to a directory tree or as frames on a stream.
+A frame is the tile coordinates as three unsigned 32 bit integers, the
+length of the mime type as an unsigned 16 bit integer followed by the mime
+type, and the length of the tile as an unsigned 64 bit integer followed by
+the tile, all in network byte order.
+"""
+
+import json
+import logging
+import struct
+import time
+
+from cogdumper.pipeline import bounded_imap
+
+logger = logging.getLogger(__name__)
+
+FRAME_XYZ = struct.Struct('!III')
+FRAME_MIME_LENGTH = struct.Struct('!H')
+FRAME_TILE_LENGTH = struct.Struct('!Q')
+
+
+def parse_tile(line):
+    """Tile coordinates of a line.
+    Parameters
+    ----------
+    line:
+        "x y z", a JSON list [x, y, z] or a JSON object {"x": x, "y": y, "z": z}
+    Returns
+    -------
+    tuple: (x, y, z), or None for a blank line
+    """
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        if line[0] in '[{':
+            value = json.loads(line)
+            if isinstance(value, dict):
+                value = (value['x'], value['y'], value['z'])
+        else:
+            value = line.replace(',', ' ').split()
+        x, y, z = (int(v) for v in value)
+    except (ValueError, KeyError, TypeError):
+        raise ValueError(f'Invalid tile {line!r}, expected "x y z" or JSON')
+    if x < 0 or y < 0 or z < 0:
+        raise ValueError(f'Invalid tile {line!r}, coordinates must not be negative')
+    return x, y, z
+
+
+def parse_tiles(lines):
+    """Tile coordinates of lines, skipping blank lines.
+
+    An invalid line is yielded as its ValueError, which run_batch reports
+    like a tile that fails to read, so that one bad line does not stop
+    the batch.
+    """
+    for line in lines:
+        try:
+            tile = parse_tile(line)
+        except ValueError as e:
+            yield e
+            continue
+        if tile is not None:
+            yield tile
+
+
+def read_frames(stream):
+    """Read the frames written by FrameWriter.
+    Yield
+    --------
+    tuple: (x, y, z, mime_type, tile)
+    """
+    while True:
+        header = stream.read(FRAME_XYZ.size)
+        if not header:
+            return
+        x, y, z = FRAME_XYZ.unpack(header)
+        length, = FRAME_MIME_LENGTH.unpack(stream.read(FRAME_MIME_LENGTH.size))
+        mime_type = stream.read(length).decode('ascii')
+        length, = FRAME_TILE_LENGTH.unpack(stream.read(FRAME_TILE_LENGTH.size))
+        yield x, y, z, mime_type, stream.read(length)
+
+
+class FrameWriter:
+    """Writes tiles as length prefixed frames to a binary stream."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def begin(self, cog):
+        pass
+
+    def write(self, x, y, z, mime_type, tile):
+        mime_type = mime_type.encode('ascii')
+        self.stream.write(b''.join((
+            FRAME_XYZ.pack(x, y, z),
+            FRAME_MIME_LENGTH.pack(len(mime_type)),
+            mime_type,
+            FRAME_TILE_LENGTH.pack(len(tile))
+        )))
+        self.stream.write(tile)
+        # a consumer on the other end of a pipe may be waiting for it
+        self.stream.flush()
+
+    def close(self):
+        self.stream.flush()
+
+
+def run_batch(cog, tiles, writer, workers=8, queue_size=64):
+    """Read tiles and write them in order.
+
+    Tiles are read on a pool of worker threads while the calling thread
+    writes them, so fetching the next tiles overlaps writing the current
+    one. Tiles that cannot be read, such as tiles that do not exist or
+    reads that fail, and invalid lines yielded by parse_tiles, are logged
+    and skipped.
+    Parameters
+    ----------
+    cog:
+        cogdumper.cog_tiles.COGTiff
+    tiles:
+        iterable of (x, y, z) or ValueError, consumed lazily
+    writer:
+        FrameWriter, cogdumper.export.DirectoryWriter or an object with the
+        same methods
+    workers:
+        number of threads reading tiles
+    queue_size:
+        number of tiles read ahead of the writer
+    Returns
+    -------
+    dict: number of tiles and bytes written, of tiles that failed and the
+    seconds taken
+    """
+    def fetch(tile):
+        if isinstance(tile, ValueError):
+            return tile, None, tile
+        try:
+            return tile, cog.get_tile(*tile), None
+        except Exception as e:
+            # tiles that cannot be read, for any reason, do not stop the others
+            return tile, None, e
+
+    start = time.monotonic()
+    count = 0
+    size = 0
+    errors = 0
+    writer.begin(cog)
+    try:
+        for tile, result, error in bounded_imap(fetch, tiles, workers, queue_size):
+            if isinstance(error, ValueError):
+                logger.error(str(error))
+                errors += 1
+                continue
+            x, y, z = tile
+            if error is not None:
+                logger.error(f'Tile {x} {y} {z}: {getattr(error, "message", error)}')
+                errors += 1
+                continue
+            mime_type, tile = result
+            writer.write(x, y, z, mime_type, tile)
+            count += 1
+            size += len(tile)
+    finally:
+        writer.close()
+
+    return {
+        'tiles': count,
+        'bytes': size,
+        'errors': errors,
+        'seconds': time.monotonic() - start
+    }
@@ -0,0 +1,150 @@
+"""Block aligned LRU cache for readers."""
+
+import os
+import threading
+from collections import OrderedDict
+
+from cogdumper.cog_tiles import AbstractReader
+
+
+class BlockCache(AbstractReader):
+    """Caches the data of a reader in fixed size, aligned blocks.
+
+    Every read is widened to whole blocks, so repeated and overlapping
+    ranges, such as header re-reads and hot tiles, are served from memory,
+    and the ranges sent to the backend are aligned and therefore cacheable
+    by a CDN. Blocks are evicted least recently used first once the cached
+    bytes exceed the budget.
+    """
+
+    def __init__(self, reader, block_size=None, max_bytes=None, read_many=None):
+        """Init cache.
+        Parameters
+        ----------
+        reader:
+            A reader that implements the cogdumper.cog_tiles.AbstractReader methods
+        block_size:
+            number, size of the cached blocks, defaults to COG_CACHE_BLOCK_SIZE
+            or 65536
+        max_bytes:
+            number, budget for the cached blocks, defaults to
+            COG_CACHE_MAX_BYTES or 64 MB
+        read_many:
+            Optional callable to read many ranges at once, defaults to the
+            read_many method of the reader that reader is bound to
+        """
+        if block_size is None:
+            block_size = int(os.environ.get('COG_CACHE_BLOCK_SIZE', '65536'))
+        if max_bytes is None:
+            max_bytes = int(os.environ.get('COG_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+        self._read = reader
+        self._source = getattr(reader, '__self__', None)
+        if read_many is None:
+            read_many = getattr(self._source, 'read_many', None)
+        self._read_many = read_many
+        self.block_size = block_size
+        self.max_bytes = max_bytes
+        self._blocks = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stat(self):
+        if self._source is not None:
+            return self._source.stat()
+        return None
+
+    @property
+    def stats(self):
+        """Counters in blocks and the number of cached bytes."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'blocks': len(self._blocks),
+                'bytes': self._size
+            }
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self._size = 0
+
+    def read(self, offset, length):
+        return self.read_many([(offset, length)])[0]
+
+    def read_many(self, ranges):
+        """Read (offset, length) ranges, fetching all missing blocks together."""
+        bs = self.block_size
+        found = {}
+        missing = set()
+        with self._lock:
+            for offset, length in ranges:
+                if length <= 0:
+                    continue
+                for block in range(offset // bs, (offset + length - 1) // bs + 1):
+                    if block in found or block in missing:
+                        continue
+                    data = self._blocks.get(block)
+                    if data is None:
+                        self.misses += 1
+                        missing.add(block)
+                    else:
+                        self.hits += 1
+                        self._blocks.move_to_end(block)
+                        found[block] = data
+
+        if missing:
+            found.update(self._fetch(sorted(missing)))
+
+        results = []
+        for offset, length in ranges:
+            if length <= 0:
+                results.append(b'')
+                continue
+            first = offset // bs
+            last = (offset + length - 1) // bs
+            start = offset - first * bs
+            if first == last:
+                results.append(found[first][start:start + length])
+            else:
+                data = b''.join(found[b] for b in range(first, last + 1))
+                results.append(data[start:start + length])
+        return results
+
+    def _fetch(self, blocks):
+        """Read runs of consecutive blocks, one request per run."""
+        bs = self.block_size
+        runs = []
+        for block in blocks:
+            if runs and runs[-1][1] == block:
+                runs[-1][1] = block + 1
+            else:
+                runs.append([block, block + 1])
+
+        ranges = [(first * bs, (last - first) * bs) for first, last in runs]
+        if self._read_many is not None and len(ranges) > 1:
+            results = self._read_many(ranges)
+        else:
+            results = [self._read(offset, length) for offset, length in ranges]
+
+        fetched = {}
+        for (first, last), data in zip(runs, results):
+            data = bytes(data)
+            for block in range(first, last):
+                fetched[block] = data[(block - first) * bs:(block - first + 1) * bs]
+
+        with self._lock:
+            for block, data in fetched.items():
+                if block not in self._blocks:
+                    self._size += len(data)
+                self._blocks[block] = data
+                self._blocks.move_to_end(block)
+            while self._size > self.max_bytes and self._blocks:
+                _, data = self._blocks.popitem(last=False)
+                self._size -= len(data)
+                self.evictions += 1
+        return fetched
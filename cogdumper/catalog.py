@@ -0,0 +1,285 @@
+"""A catalog of many COGs, opened lazily and kept within a memory budget."""
+
+import contextlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from cogdumper.header import HeaderSizeHints
+from cogdumper.sources import open_reader
+
+logger = logging.getLogger(__name__)
+
+
+def catalog_budget():
+    """Memory budget of open headers, COG_CATALOG_MAX_BYTES or 256 MB."""
+    return int(os.environ.get('COG_CATALOG_MAX_BYTES', str(256 * 1024 * 1024)))
+
+
+def _close(reader):
+    close = getattr(reader, 'close', None)
+    if close is not None:
+        close()
+
+
+class _Entry:
+    __slots__ = ('reader', 'cog', 'nbytes', 'leases', 'retired')
+
+    def __init__(self, reader, cog):
+        self.reader = reader
+        self.cog = cog
+        self.nbytes = cog.nbytes
+        # readers of entries dropped while leased are closed by the last lease
+        self.leases = 0
+        self.retired = False
+
+
+class Catalog:
+    """Maps dataset names or URLs to lazily opened COGs.
+
+    COGs are opened on first use and kept open until the memory held by
+    their headers, the header buffers and tile offset tables, exceeds
+    max_bytes, when the least recently used ones are dropped. Concurrent
+    requests for a dataset that is being opened wait for that open rather
+    than parsing the header again. Readers share their sessions per backend,
+    see cogdumper.sources.
+
+    COGs used from several threads are leased with open, the reader of a
+    dropped COG is closed once its last lease is released.
+    """
+
+    def __init__(self, datasets=None, max_bytes=None, max_open=None,
+                 index_store=None, opener=None):
+        """Init catalog.
+        Parameters
+        ----------
+        datasets:
+            Optional dict of dataset name to source URL, see
+            cogdumper.sources.open_reader, without it names are source URLs
+        max_bytes:
+            number, budget for the open headers, defaults to
+            COG_CATALOG_MAX_BYTES or 256 MB
+        max_open:
+            Optional number, most COGs kept open
+        index_store:
+            Optional cogdumper.index.IndexStore used to open COGs
+        opener:
+            Optional callable returning a reader for a source URL, defaults
+            to cogdumper.sources.open_reader
+        """
+        if max_bytes is None:
+            max_bytes = catalog_budget()
+        self.datasets = datasets
+        self.max_bytes = max_bytes
+        self.max_open = max_open
+        self.index_store = index_store
+        self.opener = opener or open_reader
+        self.hints = HeaderSizeHints()
+        self._open = OrderedDict()
+        self._opening = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def url(self, name):
+        """The source URL of a dataset, raises KeyError for unknown datasets."""
+        if self.datasets is None:
+            return name
+        return self.datasets[name]
+
+    def register(self, name, url):
+        """Add a dataset, or point it to a new source."""
+        if self.datasets is None:
+            raise ValueError('Catalog without datasets maps URLs only')
+        self.datasets[name] = url
+        self.discard(name)
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._open
+
+    def __len__(self):
+        with self._lock:
+            return len(self._open)
+
+    @property
+    def nbytes(self):
+        """Memory held by the open headers, as last measured."""
+        with self._lock:
+            return self._size
+
+    @property
+    def stats(self):
+        """Counters of lookups and the number of open COGs and bytes."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'open': len(self._open),
+                'bytes': self._size
+            }
+
+    def _open_cog(self, url):
+        reader = self.opener(url)
+        try:
+            if self.index_store is not None:
+                cog = self.index_store.open(reader)
+            else:
+                cog = self.hints.open(reader, url)
+        except BaseException:
+            _close(reader)
+            raise
+        return _Entry(reader, cog)
+
+    def get(self, name):
+        """The open COG of a dataset.
+
+        The COG is not leased, it may be closed by any later call that
+        drops it, use open when the catalog is shared between threads.
+        Parameters
+        ----------
+        name:
+            dataset name, or source URL for a catalog without datasets
+        Returns
+        -------
+        cogdumper.cog_tiles.COGTiff
+        """
+        return self._acquire(name, 0).cog
+
+    @contextlib.contextmanager
+    def open(self, name):
+        """Lease the open COG of a dataset for the duration of the block.
+
+        Its reader is not closed while the lease is held, even if the COG
+        is dropped from the catalog.
+        Parameters
+        ----------
+        name:
+            dataset name, or source URL for a catalog without datasets
+        Returns
+        -------
+        context manager of a cogdumper.cog_tiles.COGTiff
+        """
+        entry = self._acquire(name, 1)
+        try:
+            yield entry.cog
+        finally:
+            with self._lock:
+                entry.leases -= 1
+                close = entry.retired and entry.leases == 0
+            if close:
+                _close(entry.reader)
+
+    def _acquire(self, name, leases):
+        url = self.url(name)
+        while True:
+            with self._lock:
+                entry = self._open.get(name)
+                if entry is not None:
+                    self.hits += 1
+                    entry.leases += leases
+                    self._open.move_to_end(name)
+                    # overview arrays are parsed on first use, so headers grow
+                    size = entry.cog.nbytes
+                    self._size += size - entry.nbytes
+                    entry.nbytes = size
+                    evicted = self._evict()
+                else:
+                    self.misses += 1
+                    future = self._opening.get(name)
+                    owner = future is None
+                    if owner:
+                        future = self._opening[name] = Future()
+            if entry is not None:
+                self._close_all(evicted)
+                return entry
+            if owner:
+                break
+            opened = future.result()
+            with self._lock:
+                # the COG opened by another caller may be dropped before it
+                # is leased here, then it is looked up again
+                if self._open.get(name) is opened:
+                    opened.leases += leases
+                    return opened
+
+        try:
+            entry = self._open_cog(url)
+        except BaseException as e:
+            with self._lock:
+                del self._opening[name]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._opening[name]
+            entry.leases += leases
+            self._open[name] = entry
+            self._size += entry.nbytes
+            evicted = self._evict()
+        future.set_result(entry)
+        self._close_all(evicted)
+        return entry
+
+    def _evict(self):
+        """Drop least recently used entries over budget, the newest is kept.
+
+        Called with the lock held, returns the entries to close.
+        """
+        evicted = []
+        while len(self._open) > 1 and (
+                self._size > self.max_bytes or
+                (self.max_open is not None and len(self._open) > self.max_open)):
+            name, entry = self._open.popitem(last=False)
+            self._size -= entry.nbytes
+            self.evictions += 1
+            evicted.append(entry)
+            logger.debug(f'Evicted {name} ({entry.nbytes} bytes)')
+        return self._retire(evicted)
+
+    @staticmethod
+    def _retire(entries):
+        """Mark dropped entries, called with the lock held.
+        Returns
+        -------
+        list of the entries that are not leased, to close
+        """
+        unleased = []
+        for entry in entries:
+            entry.retired = True
+            if entry.leases == 0:
+                unleased.append(entry)
+        return unleased
+
+    @staticmethod
+    def _close_all(entries):
+        for entry in entries:
+            _close(entry.reader)
+
+    def discard(self, name):
+        """Close a dataset if it is open."""
+        with self._lock:
+            entry = self._open.pop(name, None)
+            if entry is None:
+                return
+            self._size -= entry.nbytes
+            entries = self._retire([entry])
+        self._close_all(entries)
+
+    def close(self):
+        """Drop all COGs, leased ones are closed when their lease ends."""
+        with self._lock:
+            entries = self._retire(list(self._open.values()))
+            self._open.clear()
+            self._size = 0
+        self._close_all(entries)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -1,23 +1,292 @@
 """Function for extracting tiff tiles."""
 
+import base64
 import os
+import sys
 
 from abc import abstractmethod
+from array import array
 from math import ceil
 import struct
+import threading
 
-from cogdumper.errors import TIFFError
-from cogdumper.jpegreader import insert_tables
+from cogdumper import hedging, metrics
+from cogdumper.errors import TIFFError, TileNotFoundError
+from cogdumper.header import (
+    STRUCTURAL_METADATA_LINE,
+    STRUCTURAL_METADATA_PREFIX,
+    HeaderBuffer,
+    estimate_header_end,
+    max_prefetch,
+    parse_structural_metadata
+)
+from cogdumper.jpegreader import table_body, table_segments
+from cogdumper.ranges import coalesce
 from cogdumper.tifftags import compression as CompressionType
+from cogdumper.tifftags import layout as LayoutTags
 from cogdumper.tifftags import sizes as TIFFSizes
 from cogdumper.tifftags import tags as TIFFTags
 
 
+def merge_gap(max_gap=None):
+    """Largest gap between byte ranges that are read together."""
+    if max_gap is None:
+        max_gap = int(os.environ.get('COG_MAX_MERGE_GAP_BYTES', '16384'))
+    return max_gap
+
+
+def stream_chunk_size(chunk_size=None):
+    """Size of the chunks tiles are streamed in."""
+    if chunk_size is None:
+        chunk_size = int(os.environ.get('COG_STREAM_CHUNK_BYTES', '65536'))
+    return chunk_size
+
+
+def _attributed(kind, chunks):
+    """Iterate chunks, attributing the reads made for each to kind.
+
+    The purpose is only set while a chunk is read, not while it is used by
+    the code iterating, which may make reads of its own.
+    """
+    chunks = iter(chunks)
+    try:
+        while True:
+            with metrics.purpose(kind):
+                chunk = next(chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        # readers record a stream that is not read to its end when closed
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            with metrics.purpose(kind):
+                close()
+
+
 class AbstractReader:  # pragma: no cover
+    # name of the backend in metrics
+    backend = 'reader'
+    # Optional cogdumper.metrics.Metrics for the requests of this reader,
+    # the active registry otherwise
+    metrics = None
+
     @abstractmethod
     def read(offset, len):
         pass
 
+    def read_many(self, ranges):
+        """Read a sequence of (offset, length) ranges, in order."""
+        return [self.read(offset, length) for offset, length in ranges]
+
+    def stream(self, offset, length, chunk_size=None):
+        """Read a range as chunks of about chunk_size bytes, as they arrive.
+
+        Readers that cannot stream yield the whole range at once.
+        """
+        yield self.read(offset, length)
+
+    def stat(self):
+        """Identity and validators of the underlying object.
+
+        Returns
+        -------
+        dict with the source ``url`` and any of ``etag``, ``mtime`` and
+        ``size`` that the backend can report, used to detect stale
+        tile indexes (see cogdumper.index).
+        """
+        return None
+
+
+# array typecodes by item size for decoding tile offsets and byte counts
+ARRAY_TYPECODES = {
+    1: 'B',
+    2: 'H',
+    4: 'I' if array('I').itemsize == 4 else 'L',
+    8: 'Q'
+}
+
+NATIVE_ENDIAN = '<' if sys.byteorder == 'little' else '>'
+
+
+class IFD:
+    """An Image File Directory.
+
+    The tile offsets and byte counts are held as compact arrays. They and
+    the JPEG tables are decoded on first access, so that opening a COG does
+    not read the tile arrays of overviews that are never used, after which
+    the raw tag data is dropped. For compatibility fields can also be read
+    with ifd['name'].
+
+    Sparse tiles, with a byte count of 0, are answered without any I/O.
+    """
+
+    __slots__ = (
+        'tags', 'next_offset', 'image_width', 'image_height', 'compression',
+        'compression_code', 'layout', 'tile_width', 'tile_height', 'nx_tiles', 'ny_tiles',
+        '_offsets', '_byte_counts', '_jpeg_tables', '_table_body',
+        '_empty_tiles', '_cog', '_pending', '_lock'
+    )
+
+    FIELDS = (
+        'tags', 'next_offset', 'image_width', 'image_height', 'compression',
+        'compression_code', 'layout', 'tile_width', 'tile_height', 'nx_tiles', 'ny_tiles',
+        'offsets', 'byte_counts', 'jpeg_tables'
+    )
+    LAZY_FIELDS = ('offsets', 'byte_counts', 'jpeg_tables')
+
+    def __init__(self, tags=(), next_offset=0, cog=None, pending=None):
+        """Init IFD.
+        Parameters
+        ----------
+        tags:
+            tuple of the codes of the recognised tags in the directory
+        next_offset:
+            number, offset of the next IFD or 0
+        cog:
+            COGTiff the directory belongs to, used to read pending tags
+        pending:
+            Optional dict of tag code to the parsed TileOffsets,
+            TileByteCounts and JPEGTables tags that are not decoded yet
+        """
+        self.tags = tags
+        self.next_offset = next_offset
+        self.image_width = 0
+        self.image_height = 0
+        self.compression = 'image/jpeg'
+        # TIFF compression code and the pixel layout tags, by name in
+        # cogdumper.tifftags.layout, used to decode tiles
+        self.compression_code = None
+        self.layout = {}
+        self.tile_width = 0
+        self.tile_height = 0
+        self.nx_tiles = 0
+        self.ny_tiles = 0
+        self._offsets = None
+        self._byte_counts = None
+        self._jpeg_tables = None
+        self._table_body = None
+        self._empty_tiles = 0
+        self._cog = cog
+        self._pending = pending
+        # pending tags are decoded once, by the first thread to use them
+        self._lock = threading.Lock() if pending is not None else None
+
+    @property
+    def offsets(self):
+        if self._pending is not None:
+            self.load()
+        return self._offsets
+
+    @property
+    def byte_counts(self):
+        if self._pending is not None:
+            self.load()
+        return self._byte_counts
+
+    @property
+    def jpeg_tables(self):
+        if self._pending is not None:
+            self.load()
+        return self._jpeg_tables
+
+    @property
+    def table_body(self):
+        """The JPEG tables without their SOI and EOI, as inserted into tiles."""
+        if self._pending is not None:
+            self.load()
+        return self._table_body
+
+    @property
+    def empty_tiles(self):
+        """Number of sparse tiles."""
+        if self._pending is not None:
+            self.load()
+        return self._empty_tiles
+
+    def is_empty(self, idx):
+        """True if the tile at row major index idx is sparse."""
+        if self._pending is not None:
+            self.load()
+        # the byte counts are held anyway, a lookup is as cheap as a bitmap
+        return self._empty_tiles > 0 and self._byte_counts[idx] == 0
+
+    def set_arrays(self, offsets, byte_counts, jpeg_tables=None):
+        """Set the decoded tile arrays and JPEG tables.
+
+        Counts the sparse tiles and slices the JPEG tables once for all
+        tiles.
+        """
+        self._offsets = offsets
+        self._byte_counts = byte_counts
+        self._jpeg_tables = jpeg_tables
+        self._table_body = table_body(jpeg_tables)
+        self._empty_tiles = byte_counts.count(0)
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        if key in self.LAZY_FIELDS:
+            return self._pending is None
+        return key in self.FIELDS
+
+    @property
+    def nbytes(self):
+        """Approximate memory held by the tile arrays, tables and raw tags."""
+        if self._pending is not None:
+            return sum(
+                len(t['data']) for t in self._pending.values() if t['data'] is not None
+            )
+        size = 0
+        for values in (self._offsets, self._byte_counts):
+            size += len(values) * values.itemsize
+        for data in (self._jpeg_tables, self._table_body):
+            if data is not None:
+                size += len(data)
+        return size
+
+    def is_buffered(self, buffer):
+        """True if the pending tags are held by a header buffer."""
+        return all(
+            t['data'] is not None or buffer.has(t['data_offset'], t['data_length'])
+            for t in self._pending.values()
+        )
+
+    def load(self):
+        """Decode the tile arrays and JPEG tables."""
+        if self._pending is None:
+            return
+        with self._lock:
+            pending = self._pending
+            if pending is None:
+                # loaded by another thread meanwhile
+                return
+            with metrics.purpose('header'):
+                self._load(pending, self._cog)
+            # the arrays are set before the tags are dropped, so that
+            # readers that see no pending tags see the arrays
+            self._pending = None
+            self._cog = None
+
+    def _load(self, pending, cog):
+        offsets = array(ARRAY_TYPECODES[8])
+        byte_counts = array(ARRAY_TYPECODES[8])
+        jpeg_tables = None
+        if 324 in pending:
+            # tile offsets
+            offsets = cog._tag_array(pending[324])
+        if 325 in pending:
+            # tile byte counts
+            byte_counts = cog._tag_array(pending[325])
+        if 347 in pending:
+            # JPEG Tables, copied so as not to hold a reader's buffer
+            jpeg_tables = bytes(cog._tag_data(pending[347]))
+
+        self.set_arrays(offsets, byte_counts, jpeg_tables)
+
 
 class COGTiff:
     """
@@ -36,296 +305,329 @@ class COGTiff:
         Optional: tile content of first overview level
         Tile content of full resolution image.
     """
-    def __init__(self, reader):
+    def __init__(self, reader, index=None, read_many=None, header_size=None,
+                 empty_tile=b'', stream=None):
         """Parses a (Big)TIFF for image tiles.
         Parameters
         ----------
         reader:
             A reader that implements the cogdumper.cog_tiles.AbstractReader methods
+        index:
+            Optional tile index previously produced by COGTiff.to_index, when
+            given the header is not read from the reader
+        read_many:
+            Optional callable to read many ranges at once, defaults to the
+            read_many method of the reader that reader is bound to
+        header_size:
+            Optional size of the first read, defaults to
+            COG_INGESTED_BYTES_AT_OPEN or 16384
+        empty_tile:
+            bytes returned without any I/O for sparse tiles, which have a
+            byte count of 0, e.g. an encoded transparent or nodata tile
+        stream:
+            Optional callable to read a range in chunks, defaults to the
+            stream method of the reader that reader is bound to
         """
         self._endian = '<'
         self._version = 42
         self.read = reader
+        if read_many is None:
+            read_many = getattr(getattr(reader, '__self__', None), 'read_many', None)
+        self.read_many = read_many or self._read_serially
+        if stream is None:
+            stream = getattr(getattr(reader, '__self__', None), 'stream', None)
+        self.stream = stream or self._read_whole
         self._big_tiff = False
-        self.header = ''
+        self._buffer = HeaderBuffer(reader)
         self._offset = 0
+        self.header_size = header_size
+        self.empty_tile = empty_tile
         self._image_ifds = []
         self._mask_ifds = []
+        self._set_structural_metadata({})
 
-        self.read_header()
+        if index is None:
+            with metrics.purpose('header'):
+                self.read_header()
+        else:
+            self._load_index(index)
 
-    def _ifds(self):
-        """Reads TIFF image file directories from a COG recursively.
-        Parameters
-        -----------
-        offset:
-            number, offset into the tiff stream to read from, this is only
-            required for the first image file directory
-        overview:
-            number, an identifier that is the overview level in the COG
-            image pyramid
-        Yield
-        --------
-        dict: Image File Directory for the next IFD
+    def _set_structural_metadata(self, metadata):
+        """Take the tile layout from GDAL structural metadata.
+
+        Layout hints of a file that was edited after GDAL wrote it, marked
+        KNOWN_INCOMPATIBLE_EDITION=YES, are ignored.
         """
-        while self._offset != 0:
-            next_offset = 0
-            pos = 0
-            tags = []
+        self.structural_metadata = metadata
+        if metadata.get('KNOWN_INCOMPATIBLE_EDITION') == 'YES':
+            metadata = {}
+        # bytes before and after the data of each tile
+        self._block_leader = 4 if metadata.get('BLOCK_LEADER') == 'SIZE_AS_UINT4' else 0
+        self._block_trailer = \
+            4 if metadata.get('BLOCK_TRAILER') == 'LAST_4_BYTES_REPEATED' else 0
+        self._mask_interleaved = metadata.get('MASK_INTERLEAVED_WITH_IMAGERY') == 'YES'
 
-            fallback_size = 4096 if self._big_tiff else 1024
-            if self._offset > len(self.header):
-                byte_starts = len(self.header)
-                byte_ends = byte_starts + self._offset + fallback_size
-                self.header += self.read(byte_starts, byte_ends)
+    def _read_structural_metadata(self, offset):
+        """GDAL structural metadata at offset, or an empty dict if there is none."""
+        line = bytes(self._buffer.get(offset, STRUCTURAL_METADATA_LINE))
+        if not line.startswith(STRUCTURAL_METADATA_PREFIX):
+            return {}
+        size = line[len(STRUCTURAL_METADATA_PREFIX):].split(b' ', 1)[0]
+        if not size.isdigit():
+            return {}
+        return parse_structural_metadata(
+            self._buffer.get(offset + STRUCTURAL_METADATA_LINE, int(size))
+        )
 
-            if self._big_tiff:
-                bytes = self.header[self._offset: self._offset + 8]
-                num_tags = struct.unpack(f'{self._endian}Q', bytes)[0]
+    def _read_serially(self, ranges):
+        return [self.read(offset, length) for offset, length in ranges]
 
-                byte_starts = self._offset + 8
-                byte_ends = (num_tags * 20) + 8 + byte_starts
-                if byte_ends > len(self.header):
-                    s = len(self.header)
-                    self.header += self.read(s, byte_ends)
+    def _read_whole(self, offset, length, chunk_size=None):
+        yield self.read(offset, length)
 
-                bytes = self.header[byte_starts: byte_ends]
+    @property
+    def header(self):
+        """The start of the file held by the header buffer.
 
-                for t in range(0, num_tags):
-                    code = struct.unpack(
-                        f'{self._endian}H',
-                        bytes[pos: pos + 2]
-                    )[0]
+        The buffer is released once the header is parsed.
+        """
+        return self._buffer.data
 
-                    if code in TIFFTags:
-                        dtype = struct.unpack(
-                            f'{self._endian}H',
-                            bytes[pos + 2: pos + 4]
-                        )[0]
-
-                        if dtype not in TIFFSizes:  # pragma: no cover
-                            raise TIFFError(f'Unrecognised data type {dtype}')
-
-                        num_values = struct.unpack(
-                            f'{self._endian}Q',
-                            bytes[pos + 4: pos + 12]
-                        )[0]
-                        tag_len = num_values * TIFFSizes[dtype]['size']
-                        if tag_len <= 8:
-                            data = bytes[pos + 12: pos + 12 + tag_len]
-                        else:  # pragma: no cover
-                            data_offset = struct.unpack(
-                                f'{self._endian}Q',
-                                bytes[pos + 12: pos + 20]
-                            )[0]
-
-                            byte_starts = data_offset
-                            byte_ends = byte_starts + tag_len
-                            if byte_ends > len(self.header):
-                                s = len(self.header)
-                                self.header += self.read(s, byte_ends)
-
-                            data = self.header[byte_starts: byte_ends]
-
-                        tags.append(
-                            {
-                                'code': code,
-                                'dtype': TIFFSizes[dtype],
-                                'num_values': num_values,
-                                'data': data
-                            }
-                        )
+    @property
+    def nbytes(self):
+        """Approximate memory held by the parsed header.
 
-                    pos = pos + 20
+        Counts the header buffer and the tile arrays and JPEG tables of each
+        IFD, which grows as the arrays of overviews are read on first use.
+        """
+        return self._buffer.nbytes + sum(
+            ifd.nbytes for ifd in self._image_ifds + self._mask_ifds
+        )
 
-                self._offset = self._offset + 8 + pos
-                next_offset = struct.unpack(
-                    f'{self._endian}Q',
-                    self.header[self._offset: self._offset + 8]
-                )[0]
-            else:
-                bytes = self.header[self._offset: self._offset + 2]
-                num_tags = struct.unpack(f'{self._endian}H', bytes)[0]
+    @property
+    def header_stats(self):
+        """Number of requests and bytes read for the header.
 
-                byte_starts = self._offset + 2
-                byte_ends = (num_tags * 12) + 2 + byte_starts
-                if byte_ends > len(self.header):
-                    s = len(self.header)
-                    self.header += self.read(s, byte_ends)
+        Includes the tile arrays of overviews that were read on first use.
+        """
+        return {
+            'requests': self._buffer.requests,
+            'bytes': self._buffer.bytes
+        }
 
-                bytes = self.header[byte_starts: byte_ends]
+    def _tag_data(self, tag):
+        """Raw bytes of a parsed tag, reading them if they are out of line."""
+        if tag['data'] is None:
+            return self._buffer.get(tag['data_offset'], tag['data_length'])
+        return tag['data']
 
-                for t in range(0, num_tags):
-                    code = struct.unpack(
-                        f'{self._endian}H',
-                        bytes[pos: pos + 2]
-                    )[0]
+    def _tag_value(self, tag):
+        """First decoded value of a parsed tag."""
+        fmt = tag['dtype']['format']
+        return struct.unpack_from(f'{self._endian}{fmt}', self._tag_data(tag))[0]
 
-                    if code in TIFFTags:
-                        dtype = struct.unpack(
-                            f'{self._endian}H',
-                            bytes[pos + 2: pos + 4]
-                        )[0]
-
-                        if dtype not in TIFFSizes:  # pragma: no cover
-                            raise TIFFError(f'Unrecognised data type {dtype}')
-
-                        num_values = struct.unpack(
-                            f'{self._endian}L',
-                            bytes[pos + 4: pos + 8]
-                        )[0]
-                        tag_len = num_values * TIFFSizes[dtype]['size']
-                        if tag_len <= 4:
-                            data = bytes[pos + 8: pos + 8 + tag_len]
-                        else:
-                            data_offset = struct.unpack(
-                                f'{self._endian}L',
-                                bytes[pos + 8: pos + 12]
-                            )[0]
-
-                            byte_starts = data_offset
-                            byte_ends = byte_starts + tag_len
-                            if byte_ends > len(self.header):
-                                s = len(self.header)
-                                self.header += self.read(s, byte_ends)
-                            data = self.header[byte_starts: byte_ends]
-
-                        tags.append(
-                            {
-                                'code': code,
-                                'dtype': TIFFSizes[dtype],
-                                'num_values': num_values,
-                                'data': data
-                            }
-                        )
+    def _tag_array(self, tag):
+        """Decoded values of a parsed integer tag as an array."""
+        typecode = ARRAY_TYPECODES[tag['dtype']['size']]
+        values = array(typecode)
+        values.frombytes(self._tag_data(tag))
+        if self._endian != NATIVE_ENDIAN:
+            values.byteswap()
+        return values
 
-                    pos = pos + 12
+    def _ifds(self):
+        """Reads TIFF image file directories from a COG.
 
-                self._offset = self._offset + 2 + pos
-                next_offset = struct.unpack(
-                    f'{self._endian}L',
-                    self.header[self._offset: self._offset + 4]
+        Only the directory entries are read, the position of tag values that
+        do not fit inline is recorded so that they can be read on first use.
+        Yield
+        --------
+        dict: Image File Directory for the next IFD, with the offset it
+        starts at and the end of its entries and out of line tag values
+        """
+        if self._big_tiff:
+            count_fmt, entry_size, value_fmt = 'Q', 20, 'Q'
+        else:
+            count_fmt, entry_size, value_fmt = 'H', 12, 'L'
+        count_size = struct.calcsize(f'{self._endian}{count_fmt}')
+        value_size = struct.calcsize(f'{self._endian}{value_fmt}')
+        fallback_size = 4096 if self._big_tiff else 1024
+
+        while self._offset != 0:
+            num_tags = struct.unpack(
+                f'{self._endian}{count_fmt}',
+                self._buffer.get(self._offset, count_size, fallback_size)
+            )[0]
+
+            directory_size = count_size + (num_tags * entry_size) + value_size
+            entries = self._buffer.get(
+                self._offset,
+                directory_size,
+                fallback_size
+            )[count_size:]
+
+            tags = []
+            for pos in range(0, num_tags * entry_size, entry_size):
+                code, dtype = struct.unpack(
+                    f'{self._endian}HH',
+                    entries[pos: pos + 4]
+                )
+                if code not in TIFFTags and code not in LayoutTags:
+                    continue
+                if dtype not in TIFFSizes:  # pragma: no cover
+                    raise TIFFError(f'Unrecognised data type {dtype}')
+
+                num_values = struct.unpack(
+                    f'{self._endian}{value_fmt}',
+                    entries[pos + 4: pos + 4 + value_size]
                 )[0]
+                tag_len = num_values * TIFFSizes[dtype]['size']
+                value = entries[pos + 4 + value_size: pos + 4 + 2 * value_size]
+                if tag_len <= value_size:
+                    data = value[:tag_len]
+                    data_offset = None
+                else:
+                    data = None
+                    data_offset = struct.unpack(
+                        f'{self._endian}{value_fmt}',
+                        value
+                    )[0]
+
+                tags.append(
+                    {
+                        'code': code,
+                        'dtype': TIFFSizes[dtype],
+                        'num_values': num_values,
+                        'data': data,
+                        'data_offset': data_offset,
+                        'data_length': tag_len
+                    }
+                )
 
+            next_offset = struct.unpack(
+                f'{self._endian}{value_fmt}',
+                entries[-value_size:]
+            )[0]
+            start = self._offset
+            end = max(
+                [start + directory_size] +
+                [t['data_offset'] + t['data_length']
+                 for t in tags if t['data_offset'] is not None]
+            )
             self._offset = next_offset
 
             yield {
                 'tags': tags,
-                'next_offset': next_offset
+                'next_offset': next_offset,
+                'start': start,
+                'end': end
             }
 
     def read_header(self):
-        """Read and parse COG header."""
-        buff_size = int(os.environ.get('COG_INGESTED_BYTES_AT_OPEN', '16384'))
-        self.header = self.read(0, buff_size)
+        """Read and parse COG header.
+
+        The IFD chain is walked up front but the tile offsets, byte counts
+        and JPEG tables of each IFD are only read when first used.
+
+        The first read is header_size bytes. If the first IFD and its tag
+        values fit in it, their extent gives an estimate of the size of the
+        whole header, which is then read with one more request, so that
+        the header of a COG usually takes one or two requests. Afterwards
+        header_size is the actual size of the header.
+        """
+        buff_size = self.header_size
+        if buff_size is None:
+            buff_size = int(os.environ.get('COG_INGESTED_BYTES_AT_OPEN', '16384'))
+        self._buffer.prefetch(buff_size)
+        signature = self._buffer.get(0, 16)
 
         # read first 4 bytes to determine tiff or bigtiff and byte order
-        if self.header[:2] == b'MM':
+        if signature[:2] == b'MM':
             self._endian = '>'
 
-        self._version = struct.unpack(f'{self._endian}H', self.header[2:4])[0]
+        self._version = struct.unpack(f'{self._endian}H', signature[2:4])[0]
 
         if self._version == 42:
             # TIFF
             self._big_tiff = False
             # read offset to first IFD
-            self._offset = struct.unpack(f'{self._endian}L', self.header[4:8])[0]
+            self._offset = struct.unpack(f'{self._endian}L', signature[4:8])[0]
         elif self._version == 43:
             # BIGTIFF
             self._big_tiff = True
-            bytes = self.header[4:16]
-            bytesize = struct.unpack(f'{self._endian}H', bytes[0:2])[0]
-            w = struct.unpack(f'{self._endian}H', bytes[2:4])[0]
-            self._offset = struct.unpack(f'{self._endian}Q', bytes[4:])[0]
+            bytesize = struct.unpack(f'{self._endian}H', signature[4:6])[0]
+            w = struct.unpack(f'{self._endian}H', signature[6:8])[0]
+            self._offset = struct.unpack(f'{self._endian}Q', signature[8:16])[0]
             if bytesize != 8 or w != 0:  # pragma: no cover
                 raise TIFFError(f"Invalid BigTIFF with bytesize {bytesize} and word {w}")
         else:  # pragma: no cover
             raise TIFFError(f"Invalid version {self._version} for TIFF file")
 
         self._init = True
+        # GDAL writes its structural metadata right after the file header
+        self._set_structural_metadata(
+            self._read_structural_metadata(16 if self._big_tiff else 8)
+        )
 
-        # for JPEG we need to read all IFDs, they are at the front of the file
-        for ifd in self._ifds():
-            mime_type = 'image/jpeg'
+        header_end = 0
+        for z, directory in enumerate(self._ifds()):
+            prefix_size = self._buffer.prefix_size
+            if z == 0 and directory['start'] < prefix_size:
+                slack = 4096 if self._big_tiff else 1024
+                estimate = estimate_header_end(
+                    directory['start'],
+                    directory['end'],
+                    slack
+                )
+                # a first read that was close enough is not topped up
+                if estimate - slack > prefix_size and \
+                        estimate - prefix_size <= max_prefetch():
+                    self._buffer.extend(estimate)
+            header_end = max(header_end, directory['end'])
+
+            tags = directory['tags']
+            codes = tuple(t['code'] for t in tags if t['code'] in TIFFTags)
             # tile offsets are an extension but if they aren't in the file then
             # you can't get a tile back!
-            offsets = []
-            byte_counts = []
-            image_width = 0
-            image_height = 0
-            tile_width = 0
-            tile_height = 0
-            jpeg_tables = None
-
-            for t in ifd['tags']:
+            if 324 not in codes:
+                raise TIFFError(f'TIFF Tiles are not found in IFD {z}')
+
+            ifd = IFD(
+                codes,
+                directory['next_offset'],
+                self,
+                {t['code']: t for t in tags if t['code'] in (324, 325, 347)}
+            )
+            for t in tags:
                 code = t['code']
-                fmt = t['dtype']['format']
                 if code == 256:
                     # image width
-                    image_width = struct.unpack(
-                        f'{self._endian}{fmt}',
-                        t['data']
-                    )[0]
+                    ifd.image_width = self._tag_value(t)
                 elif code == 257:
                     # image height
-                    image_height = struct.unpack(
-                        f'{self._endian}{fmt}',
-                        t['data']
-                    )[0]
+                    ifd.image_height = self._tag_value(t)
                 elif code == 259:
                     # compression
-                    val = struct.unpack(
-                        f'{self._endian}{fmt}',
-                        t['data']
-                    )[0]
+                    val = self._tag_value(t)
+                    ifd.compression_code = val
                     if val in CompressionType:
-                        mime_type = CompressionType[val]
+                        ifd.compression = CompressionType[val]
                     else:
-                        mime_type = 'application/octet-stream'
+                        ifd.compression = 'application/octet-stream'
                 elif code == 322:
                     # tile width
-                    tile_width = struct.unpack(
-                        f'{self._endian}{fmt}',
-                        t['data']
-                    )[0]
+                    ifd.tile_width = self._tag_value(t)
                 elif code == 323:
                     # tile height
-                    tile_height = struct.unpack(
-                        f'{self._endian}{fmt}',
-                        t['data']
-                    )[0]
-                elif code == 324:
-                    # tile offsets
-                    offsets = struct.unpack(
-                        f'{self._endian}{t["num_values"]}{fmt}',
-                        t['data']
-                    )
-                elif code == 325:
-                    # tile byte counts
-                    byte_counts = struct.unpack(
-                        f'{self._endian}{t["num_values"]}{fmt}',
-                        t['data']
-                    )
-                elif code == 347:
-                    # JPEG Tables
-                    jpeg_tables = t['data']
-
-            if len(offsets) == 0:
-                raise TIFFError('TIFF Tiles are not found in IFD {z}')
-
-            ifd['image_width'] = image_width
-            ifd['image_height'] = image_height
-            ifd['compression'] = mime_type
-            ifd['tile_width'] = tile_width
-            ifd['tile_height'] = tile_height
-            ifd['offsets'] = offsets
-            ifd['byte_counts'] = byte_counts
-            ifd['jpeg_tables'] = jpeg_tables
-
-            ifd['nx_tiles'] = ceil(image_width / float(tile_width))
-            ifd['ny_tiles'] = ceil(image_height / float(tile_height))
-
-            if (ifd['compression'] == 'deflate'):
+                    ifd.tile_height = self._tag_value(t)
+                elif code in LayoutTags:
+                    # the first value, samples share their format
+                    ifd.layout[LayoutTags[code]] = self._tag_value(t)
+
+            ifd.nx_tiles = ceil(ifd.image_width / float(ifd.tile_width))
+            ifd.ny_tiles = ceil(ifd.image_height / float(ifd.tile_height))
+
+            if (ifd.compression == 'deflate'):
                 self._mask_ifds.append(ifd)
             else:
                 self._image_ifds.append(ifd)
@@ -334,35 +636,431 @@ class COGTiff:
             self._image_ifds = self._mask_ifds
             self._mask_ifds = []
 
-    def get_tile(self, x, y, z):
-        """Read tile data."""
-        if z < len(self._image_ifds):
+        self.header_size = header_end
+
+        # decode what was read with the header and release the buffer, tile
+        # arrays that were not read are read on their own when first used
+        for ifd in self._image_ifds + self._mask_ifds:
+            if ifd.is_buffered(self._buffer):
+                ifd.load()
+        self._buffer.release()
+
+    def _tile_ranges(self, x, y, z):
+        """Locate the byte ranges of a tile.
+        Returns
+        -------
+        tuple: the image IFD and a list with the (offset, length) of the
+        image tile followed by that of its mask tile, if any, the list is
+        empty for a sparse tile
+        """
+        if 0 <= z < len(self._image_ifds):
             image_ifd = self._image_ifds[z]
-            idx = (y * image_ifd['ny_tiles']) + x
-            if idx > len(image_ifd['offsets']):
-                raise TIFFError(f'Tile {x} {y} {z} does not exist')
-            else:
-                offset = image_ifd['offsets'][idx]
-                byte_count = image_ifd['byte_counts'][idx]
-                tile = self.read(offset, byte_count)
-                if image_ifd['compression'] == 'image/jpeg':
-                    # fix up jpeg tile with missing quantization tables
-                    tile = insert_tables(tile, image_ifd['jpeg_tables'])
-                    # look for a bit mask file
-                    if z < len(self._mask_ifds):
-                        mask_ifd = self._mask_ifds[z]
-                        mask_offset = mask_ifd['offsets'][idx]
-                        mask_byte_count = mask_ifd['byte_counts'][idx]
-                        mask_tile = self.read(
-                            mask_offset,
-                            mask_byte_count
-                            )
-                        tile = tile + mask_tile
-                    return image_ifd['compression'], tile
+            idx = (y * image_ifd.nx_tiles) + x
+            # negative coordinates would wrap around the arrays
+            if not (0 <= x < image_ifd.nx_tiles and 0 <= y < image_ifd.ny_tiles) or \
+                    idx >= len(image_ifd.offsets):
+                raise TileNotFoundError(f'Tile {x} {y} {z} does not exist')
+            if image_ifd.is_empty(idx):
+                return image_ifd, []
+            ranges = [(image_ifd.offsets[idx], image_ifd.byte_counts[idx])]
+            if image_ifd.compression == 'image/jpeg':
+                # look for a bit mask file
+                if z < len(self._mask_ifds):
+                    mask_ifd = self._mask_ifds[z]
+                    if not mask_ifd.is_empty(idx):
+                        ranges.append(
+                            (mask_ifd.offsets[idx], mask_ifd.byte_counts[idx])
+                        )
+            return image_ifd, ranges
+        else:
+            raise TileNotFoundError(f'Overview {z} is out of bounds.')
+
+    def _assemble_tile(self, image_ifd, parts, segments=False):
+        """Build a tile from its image and optional mask data.
+
+        With segments the tile is returned as a list of buffers, the JPEG
+        SOI marker, tables and rest of the tile and the mask, rather than
+        joined into one.
+        """
+        if not parts:
+            # sparse tile
+            tile = [self.empty_tile]
+        elif image_ifd.compression == 'image/jpeg':
+            # fix up jpeg tile with missing quantization tables
+            tile = list(table_segments(parts[0], image_ifd.table_body))
+            tile.extend(parts[1:])
+        else:
+            tile = [parts[0]]
+        if segments:
+            return image_ifd.compression, tile
+        if len(tile) == 1:
+            return image_ifd.compression, tile[0]
+        return image_ifd.compression, b''.join(tile)
+
+    def get_tile(self, x, y, z, segments=False, decode=False, deadline=None):
+        """Read tile data, sparse tiles are empty_tile and need no I/O.
+        Parameters
+        ----------
+        x, y, z:
+            numbers, the tile coordinates where z is the overview level
+        segments:
+            bool, return the tile as a list of buffers to write in order,
+            see cogdumper.segments, instead of copying them into one
+        decode:
+            bool, return the tile as a numpy array of shape (tile_height,
+            tile_width, samples), see cogdumper.decode, a numpy masked
+            array if the tile has a mask or is sparse
+        deadline:
+            Optional number, seconds the reads of the tile may take, see
+            cogdumper.hedging, readers that honour deadlines raise
+            cogdumper.errors.DeadlineExceededError once it has passed
+        Returns
+        -------
+        tuple: (mime_type, tile)
+        """
+        with hedging.deadline(deadline):
+            image_ifd, ranges = self._tile_ranges(x, y, z)
+            merged = self._tile_reads(ranges)
+            kinds = {
+                (start, length): 'mask' for start, length, members in merged if 0 not in members
+            }
+            with metrics.purpose('tile', kinds):
+                if merged:
+                    hedging.check()
+                if len(merged) > 1:
+                    results = self.read_many([(start, length) for start, length, _ in merged])
+                elif merged:
+                    results = [self.read(*merged[0][:2])]
                 else:
-                    return image_ifd['compression'], tile
+                    results = []
+        located = [(image_ifd, 0, len(ranges))]
+        return self._assemble_tiles(located, ranges, merged, results, segments, decode)[0]
+
+    def stream_tile(self, x, y, z, chunk_size=None):
+        """Read tile data as chunks, as they arrive from the reader.
+
+        The JPEG tables are inserted into and the mask appended to the
+        stream, so that a tile is never held in memory as a whole. Nothing
+        is read until the chunks are iterated.
+        Parameters
+        ----------
+        x, y, z:
+            numbers, the tile coordinates where z is the overview level
+        chunk_size:
+            number, size of the chunks asked of the reader, defaults to
+            COG_STREAM_CHUNK_BYTES or 65536
+        Returns
+        -------
+        tuple: (mime_type, size, chunks) where size is the number of bytes
+        of the tile and chunks an iterator of buffers
+        """
+        image_ifd, ranges = self._tile_ranges(x, y, z)
+        chunk_size = stream_chunk_size(chunk_size)
+        body = None
+        if image_ifd.compression == 'image/jpeg':
+            body = image_ifd.table_body
+        if not ranges:
+            size = len(self.empty_tile)
         else:
-            raise TIFFError(f'Overview {z} is out of bounds.')
+            size = sum(length for _, length in ranges)
+            if body is not None:
+                size += len(body)
+
+        def chunks():
+            if not ranges:
+                yield self.empty_tile
+                return
+            image = _attributed('tile', self.stream(*ranges[0], chunk_size))
+            if body is not None:
+                # the tables go after the SOI marker at the start of the tile,
+                # which is checked before anything is yielded
+                head = b''
+                for chunk in image:
+                    head += bytes(chunk)
+                    if len(head) >= 2:
+                        break
+                if len(head) < 2:
+                    raise TIFFError(f'Tile {x} {y} {z} is truncated')
+                for segment in table_segments(head, body):
+                    if len(segment):
+                        yield segment
+            yield from image
+            for offset, length in ranges[1:]:
+                yield from _attributed('mask', self.stream(offset, length, chunk_size))
+
+        return image_ifd.compression, size, chunks()
+
+    def get_tiles(self, tiles, max_gap=None, segments=False, decode=False,
+                  deadline=None):
+        """Read many tiles, merging nearby byte ranges into few reads.
+        Parameters
+        ----------
+        tiles:
+            sequence of (x, y, z) tile coordinates
+        max_gap:
+            number, largest count of unused bytes to read between two tiles
+            to fetch them together, defaults to COG_MAX_MERGE_GAP_BYTES or 16384
+        segments:
+            bool, see get_tile
+        decode:
+            bool, see get_tile, tiles are decoded in parallel on the
+            cogdumper.decode pool
+        deadline:
+            Optional number, seconds the reads of all the tiles may take,
+            see get_tile
+        Returns
+        -------
+        list of (mime_type, tile) in the order of tiles
+        """
+        with hedging.deadline(deadline):
+            located, ranges = self._locate_tiles(tiles)
+            merged = coalesce(self._block_ranges(ranges), merge_gap(max_gap))
+            # reads of nothing but mask tiles count as mask reads
+            masks = set()
+            for _, first, count in located:
+                masks.update(range(first + 1, first + count))
+            kinds = {
+                (start, length): 'mask'
+                for start, length, members in merged if masks.issuperset(members)
+            }
+            results = []
+            if merged:
+                hedging.check()
+                with metrics.purpose('tile', kinds):
+                    results = self.read_many([(start, length) for start, length, _ in merged])
+        return self._assemble_tiles(located, ranges, merged, results, segments, decode)
+
+    def _locate_tiles(self, tiles):
+        """Locate the byte ranges of many tiles.
+        Returns
+        -------
+        tuple: a list of (image IFD, first range, number of ranges) for each
+        tile and the list of all (offset, length) ranges
+        """
+        located = []
+        ranges = []
+        for x, y, z in tiles:
+            image_ifd, tile_ranges = self._tile_ranges(x, y, z)
+            located.append((image_ifd, len(ranges), len(tile_ranges)))
+            ranges.extend(tile_ranges)
+        return located, ranges
+
+    def _tile_reads(self, ranges):
+        """The reads of the image and mask of one tile, as coalesce returns them."""
+        blocks = self._block_ranges(ranges)
+        if self._mask_interleaved:
+            # the mask follows its image tile, both are read at once
+            return coalesce(blocks, self._block_leader + self._block_trailer)
+        return [(offset, length, [i]) for i, (offset, length) in enumerate(blocks)]
+
+    def _block_ranges(self, ranges):
+        """Tile ranges widened to take in their GDAL block leader and trailer."""
+        leader, trailer = self._block_leader, self._block_trailer
+        if not (leader or trailer):
+            return ranges
+        return [(offset - leader, length + leader + trailer) for offset, length in ranges]
+
+    def _check_block(self, data, pos, length):
+        """Check a tile against its GDAL block leader and trailer.
+
+        A mismatch means the offsets or the data read are wrong, e.g. the
+        file changed since its header was parsed.
+        """
+        leader, trailer = self._block_leader, self._block_trailer
+        if pos < leader or len(data) < pos + length + trailer:
+            raise TIFFError(f'Tile at {pos} of a read of {len(data)} bytes is truncated')
+        if leader:
+            size = struct.unpack_from('<I', data, pos - leader)[0]
+            if size != length:
+                raise TIFFError(
+                    f'Tile of {length} bytes has a block leader of {size} bytes'
+                )
+        if trailer and length >= trailer:
+            end = pos + length
+            if bytes(data[end - trailer:end]) != bytes(data[end:end + trailer]):
+                raise TIFFError(f'Tile of {length} bytes has a mismatched block trailer')
+
+    def _assemble_tiles(self, located, ranges, merged, results, segments=False,
+                        decode=False):
+        """Slice tiles out of the data read for coalesced ranges.
+
+        The ranges read include the GDAL block leader and trailer of each
+        tile, if the file has them, which are checked.
+        """
+        check = self._block_leader or self._block_trailer
+        parts = [None] * len(ranges)
+        for (start, length, members), data in zip(merged, results):
+            for i in members:
+                offset, byte_count = ranges[i]
+                if check:
+                    self._check_block(data, offset - start, byte_count)
+                parts[i] = data[offset - start: offset - start + byte_count]
+
+        if decode:
+            tiles = [(image_ifd, parts[first:first + count]) for image_ifd, first, count in located]
+            if len(tiles) > 1:
+                from cogdumper.decode import decode_pool
+                return list(decode_pool().map(lambda t: self._decode_tile(*t), tiles))
+            return [self._decode_tile(*t) for t in tiles]
+        return [
+            self._assemble_tile(image_ifd, parts[first:first + count], segments)
+            for image_ifd, first, count in located
+        ]
+
+    def _decode_tile(self, image_ifd, parts):
+        """Decode a tile and its mask, see cogdumper.decode."""
+        from cogdumper import decode
+        if not parts:
+            return image_ifd.compression, decode.empty_tile(image_ifd, self._endian)
+        mime_type, data = self._assemble_tile(image_ifd, parts[:1])
+        image = decode.decode_tile(image_ifd, data, self._endian)
+        if len(parts) > 1:
+            mask_ifd = self._mask_ifds[self._image_ifds.index(image_ifd)]
+            mask = decode.decode_tile(mask_ifd, parts[1], self._endian)
+            image = decode.apply_mask(image, mask)
+        return mime_type, image
+
+    def to_index(self):
+        """Serializable tile index of the parsed header.
+        Returns
+        -------
+        dict: endianness, TIFF version, GDAL structural metadata and the image
+        and mask IFDs with their tile offsets, byte counts and JPEG tables
+        """
+        def dump_array(values):
+            if sys.byteorder != 'little':
+                values = array(values.typecode, values)
+                values.byteswap()
+            return {
+                'itemsize': values.itemsize,
+                'data': base64.b64encode(values.tobytes()).decode('ascii')
+            }
+
+        def dump_ifd(ifd):
+            jpeg_tables = ifd.jpeg_tables
+            if jpeg_tables is not None:
+                jpeg_tables = base64.b64encode(jpeg_tables).decode('ascii')
+            return {
+                'tags': list(ifd.tags),
+                'next_offset': ifd.next_offset,
+                'image_width': ifd.image_width,
+                'image_height': ifd.image_height,
+                'compression': ifd.compression,
+                'compression_code': ifd.compression_code,
+                'layout': ifd.layout,
+                'tile_width': ifd.tile_width,
+                'tile_height': ifd.tile_height,
+                'nx_tiles': ifd.nx_tiles,
+                'ny_tiles': ifd.ny_tiles,
+                'offsets': dump_array(ifd.offsets),
+                'byte_counts': dump_array(ifd.byte_counts),
+                'jpeg_tables': jpeg_tables
+            }
+
+        return {
+            'endian': self._endian,
+            'tiff_version': self._version,
+            'structural_metadata': self.structural_metadata,
+            'image_ifds': [dump_ifd(ifd) for ifd in self._image_ifds],
+            'mask_ifds': [dump_ifd(ifd) for ifd in self._mask_ifds]
+        }
+
+    def _load_index(self, index):
+        """Restores the parsed header from a tile index."""
+        def load_array(data):
+            values = array(ARRAY_TYPECODES[data['itemsize']])
+            values.frombytes(base64.b64decode(data['data']))
+            if sys.byteorder != 'little':
+                values.byteswap()
+            return values
+
+        def load_ifd(data):
+            ifd = IFD(tuple(data['tags']), data['next_offset'])
+            ifd.image_width = data['image_width']
+            ifd.image_height = data['image_height']
+            ifd.compression = data['compression']
+            ifd.compression_code = data.get('compression_code')
+            ifd.layout = data.get('layout', {})
+            ifd.tile_width = data['tile_width']
+            ifd.tile_height = data['tile_height']
+            ifd.nx_tiles = data['nx_tiles']
+            ifd.ny_tiles = data['ny_tiles']
+            jpeg_tables = data['jpeg_tables']
+            if jpeg_tables is not None:
+                jpeg_tables = base64.b64decode(jpeg_tables)
+            ifd.set_arrays(
+                load_array(data['offsets']),
+                load_array(data['byte_counts']),
+                jpeg_tables
+            )
+            return ifd
+
+        self._endian = index['endian']
+        self._version = index['tiff_version']
+        self._big_tiff = self._version == 43
+        self._set_structural_metadata(index.get('structural_metadata', {}))
+        self._image_ifds = [load_ifd(ifd) for ifd in index['image_ifds']]
+        self._mask_ifds = [load_ifd(ifd) for ifd in index['mask_ifds']]
+
+    @property
+    def levels(self):
+        """Number of image levels, the full resolution image and its overviews."""
+        return len(self._image_ifds)
+
+    def level_info(self, z):
+        """Size and tiling of an image level.
+        Returns
+        -------
+        dict: image_width, image_height, tile_width, tile_height, nx_tiles,
+        ny_tiles and compression of level z
+        """
+        if not 0 <= z < len(self._image_ifds):
+            raise TileNotFoundError(f'Overview {z} is out of bounds.')
+        ifd = self._image_ifds[z]
+        return {
+            'image_width': ifd.image_width,
+            'image_height': ifd.image_height,
+            'tile_width': ifd.tile_width,
+            'tile_height': ifd.tile_height,
+            'nx_tiles': ifd.nx_tiles,
+            'ny_tiles': ifd.ny_tiles,
+            'compression': ifd.compression
+        }
+
+    def level_summary(self, z):
+        """Tile counts and data size of an image level.
+        Returns
+        -------
+        dict: number of tiles, of sparse tiles and bytes of tile data of
+        level z, masks excluded
+        """
+        if not 0 <= z < len(self._image_ifds):
+            raise TileNotFoundError(f'Overview {z} is out of bounds.')
+        ifd = self._image_ifds[z]
+        return {
+            'tiles': len(ifd.byte_counts),
+            'empty_tiles': ifd.empty_tiles,
+            'bytes': sum(ifd.byte_counts)
+        }
+
+    def is_empty(self, x, y, z):
+        """True if a tile is sparse and get_tile returns empty_tile."""
+        image_ifd, ranges = self._tile_ranges(x, y, z)
+        return not ranges
+
+    def iter_tiles(self, z):
+        """Coordinates of the tiles of a level that are not sparse.
+        Yield
+        --------
+        tuple: (x, y, z) in row major order
+        """
+        if not 0 <= z < len(self._image_ifds):
+            raise TileNotFoundError(f'Overview {z} is out of bounds.')
+        ifd = self._image_ifds[z]
+        nx_tiles = ifd.nx_tiles
+        for idx in range(len(ifd.byte_counts)):
+            if not ifd.is_empty(idx):
+                yield idx % nx_tiles, idx // nx_tiles, z
 
     @property
     def version(self):
@@ -0,0 +1,241 @@
+"""Decoding of tiles to NumPy arrays.
+
+Needs numpy, and Pillow for JPEG tiles (pip install cogdumper[decode]).
+Deflate and JPEG decompression and the vectorised undoing of predictors
+release the GIL, so batches of tiles are decoded in parallel on a pool of
+threads. LZW is decoded in Python and does not.
+"""
+
+import io
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from cogdumper.errors import TIFFError
+
+JPEG_CODES = (6, 7)
+DEFLATE_CODES = (8, 32946)
+LZW_CODE = 5
+
+_lock = threading.Lock()
+_executor = None
+
+
+def decode_workers():
+    """Threads decoding tiles, COG_DECODE_WORKERS or the number of CPUs."""
+    return int(os.environ.get('COG_DECODE_WORKERS', str(os.cpu_count() or 1)))
+
+
+def decode_pool():
+    """The process wide decoding executor, created on first use."""
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=decode_workers(),
+                thread_name_prefix='cogdumper-decode'
+            )
+        return _executor
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:  # pragma: no cover
+        raise TIFFError('Decoding tiles needs numpy, pip install cogdumper[decode]')
+    return numpy
+
+
+def lzw_decode(data):
+    """Decompress TIFF LZW data, codes are MSB first with early change.
+
+    Raises TIFFError for invalid codes, data cut short decodes to fewer
+    bytes than the tile holds.
+    """
+    clear, eoi = 256, 257
+    table = [bytes((i,)) for i in range(256)] + [b'', b'']
+    out = bytearray()
+    data = bytes(data) + b'\0\0'
+    size = (len(data) - 2) * 8
+    pos = 0
+    bits = 9
+    previous = None
+    while pos + bits <= size:
+        chunk = int.from_bytes(data[pos >> 3:(pos >> 3) + 3], 'big')
+        code = (chunk >> (24 - (pos & 7) - bits)) & ((1 << bits) - 1)
+        pos += bits
+        if code == clear:
+            del table[258:]
+            bits = 9
+            previous = None
+            continue
+        if code == eoi:
+            break
+        # corrupt or truncated data can hold codes not yet in the table
+        if code < len(table):
+            entry = table[code]
+            if previous is not None:
+                table.append(previous + entry[:1])
+        elif code == len(table) and previous is not None:
+            entry = previous + previous[:1]
+            table.append(entry)
+        else:
+            raise TIFFError(f'Invalid LZW code {code}')
+        out += entry
+        previous = entry
+        # the code width grows one code before the table needs it
+        if len(table) >= (1 << bits) - 1 and bits < 12:
+            bits += 1
+    return bytes(out)
+
+
+def decompress(code, data):
+    """Decompress the data of a tile that is not JPEG.
+    Parameters
+    ----------
+    code:
+        number, TIFF compression code of the tile
+    data:
+        the tile data as stored in the file
+    """
+    if code in (None, 1):
+        return data
+    if code in DEFLATE_CODES:
+        try:
+            return zlib.decompress(data)
+        except zlib.error as e:
+            raise TIFFError(f'Invalid deflate data: {e}')
+    if code == LZW_CODE:
+        return lzw_decode(data)
+    raise TIFFError(f'Cannot decode tiles with compression {code}')
+
+
+def sample_dtype(layout, endian='<'):
+    """The NumPy dtype of the samples of a tile, None for 1 bit samples."""
+    numpy = _numpy()
+    bits = layout.get('bits_per_sample', 1)
+    if bits == 1:
+        return None
+    kind = {1: 'u', 2: 'i', 3: 'f'}.get(layout.get('sample_format', 1))
+    if kind is None or bits % 8:
+        raise TIFFError(
+            f'Cannot decode {bits} bit samples of format {layout.get("sample_format")}'
+        )
+    return numpy.dtype(f'{endian}{kind}{bits // 8}')
+
+
+def tile_shape(ifd):
+    """Shape of the decoded tiles of an IFD, (tile_height, tile_width, samples)."""
+    layout = ifd.layout
+    # separate planes hold one sample per tile
+    samples = 1 if layout.get('planar_configuration', 1) == 2 else \
+        layout.get('samples_per_pixel', 1)
+    return ifd.tile_height, ifd.tile_width, samples
+
+
+def _decode_jpeg(data, shape):
+    numpy = _numpy()
+    try:
+        from PIL import Image
+    except ImportError:
+        raise TIFFError('Decoding JPEG tiles needs Pillow, pip install cogdumper[decode]')
+    image = Image.open(io.BytesIO(bytes(data)))
+    image.load()
+    array = numpy.asarray(image)
+    if array.ndim == 2:
+        array = array[:, :, numpy.newaxis]
+    if array.shape != shape:
+        raise TIFFError(f'JPEG tile of shape {array.shape}, expected {shape}')
+    return array
+
+
+def _undo_float_predictor(raw, dtype, shape):
+    """Undo the TIFF floating point predictor, 3.
+
+    Each row holds the bytes of its samples split into planes, most
+    significant byte first, and differenced.
+    """
+    numpy = _numpy()
+    height, width, samples = shape
+    size = dtype.itemsize
+    planes = numpy.frombuffer(raw, numpy.uint8, count=height * width * samples * size)
+    planes = numpy.cumsum(planes.reshape(height, -1), axis=1, dtype=numpy.uint8)
+    values = planes.reshape(height, size, width * samples).transpose(0, 2, 1)
+    return numpy.ascontiguousarray(values).view(dtype.newbyteorder('>')) \
+        .reshape(shape).astype(dtype.newbyteorder('='))
+
+
+def decode_tile(ifd, data, endian='<'):
+    """Decode the data of a tile.
+    Parameters
+    ----------
+    ifd:
+        cogdumper.cog_tiles.IFD of the tile
+    data:
+        the tile data, with the JPEG tables inserted for JPEG tiles
+    endian:
+        '<' or '>', byte order of the file
+    Returns
+    -------
+    numpy.ndarray of shape (tile_height, tile_width, samples) in native
+    byte order, the whole tile including the padding of tiles at the edge
+    of the image, bool for 1 bit samples such as masks
+    """
+    numpy = _numpy()
+    shape = tile_shape(ifd)
+    code = ifd.compression_code
+    if code in JPEG_CODES:
+        return _decode_jpeg(data, shape)
+
+    raw = decompress(code, data)
+    layout = ifd.layout
+    height, width, samples = shape
+    dtype = sample_dtype(layout, endian)
+    if dtype is None:
+        # rows of bits are padded to whole bytes
+        row = (width * samples + 7) // 8
+        if len(raw) < height * row:
+            raise TIFFError(f'Tile of {len(raw)} bytes, expected {height * row}')
+        bits = numpy.unpackbits(
+            numpy.frombuffer(raw, numpy.uint8, count=height * row).reshape(height, row),
+            axis=1
+        )
+        return bits[:, :width * samples].reshape(shape).astype(bool)
+
+    expected = height * width * samples * dtype.itemsize
+    if len(raw) < expected:
+        raise TIFFError(f'Tile of {len(raw)} bytes, expected {expected}')
+    predictor = layout.get('predictor', 1)
+    if predictor == 3:
+        return _undo_float_predictor(raw, dtype, shape)
+    array = numpy.frombuffer(raw, dtype, count=height * width * samples).reshape(shape)
+    native = dtype.newbyteorder('=')
+    if predictor == 2:
+        # horizontal differencing, wraps around as the encoder did
+        return numpy.cumsum(array, axis=1, dtype=native)
+    if dtype != native:
+        array = array.astype(native)
+    return array
+
+
+def empty_tile(ifd, endian='<'):
+    """A fully masked tile of zeros, for sparse tiles."""
+    numpy = _numpy()
+    shape = tile_shape(ifd)
+    if ifd.compression_code in JPEG_CODES:
+        dtype = numpy.uint8
+    else:
+        dtype = sample_dtype(ifd.layout, endian)
+        dtype = bool if dtype is None else dtype.newbyteorder('=')
+    return numpy.ma.masked_all(shape, dtype)
+
+
+def apply_mask(image, mask):
+    """A masked array of an image tile and its decoded mask tile.
+
+    Pixels whose mask bit is 0 are masked.
+    """
+    numpy = _numpy()
+    valid = mask[:image.shape[0], :image.shape[1], :1]
+    return numpy.ma.masked_array(image, mask=numpy.broadcast_to(~valid, image.shape))
@@ -6,6 +6,14 @@ class TIFFError(Exception):
     def __init__(self, message):
         self.message = message
 
+class TileNotFoundError(TIFFError):
+    """The tile or overview asked for is outside of the image."""
+
+
+class DeadlineExceededError(TIFFError):
+    """A read did not complete before its deadline."""
+
+
 class JPEGError(Exception):
     exit_code = 1
 
@@ -0,0 +1,232 @@
+"""Bulk export of COG tiles to a directory tree or an MBTiles file."""
+
+import logging
+import mimetypes
+import os
+import time
+
+from cogdumper.pipeline import bounded_imap
+
+logger = logging.getLogger(__name__)
+
+
+def tile_extension(mime_type):
+    """File extension for a tile mime type."""
+    ext = mimetypes.guess_extension(mime_type) or ''
+    # work around a bug with mimetypes
+    if ext == '.jpe':
+        ext = '.jpg'
+    return ext
+
+
+def level_tiles(cog, z, bbox=None):
+    """Tile coordinates of a level, in row major order.
+    Parameters
+    ----------
+    cog:
+        cogdumper.cog_tiles.COGTiff
+    z:
+        number, the level
+    bbox:
+        Optional (xmin, ymin, xmax, ymax) in pixels of the full resolution
+        image, only tiles intersecting it are listed
+    Yield
+    --------
+    tuple: (x, y, z)
+    """
+    info = cog.level_info(z)
+    x_range = range(info['nx_tiles'])
+    y_range = range(info['ny_tiles'])
+    if bbox is not None:
+        full = cog.level_info(0)
+        scale_x = full['image_width'] / info['image_width']
+        scale_y = full['image_height'] / info['image_height']
+        xmin, ymin, xmax, ymax = bbox
+        x_range = range(
+            max(0, int(xmin / scale_x // info['tile_width'])),
+            min(info['nx_tiles'], int((xmax - 1) / scale_x // info['tile_width']) + 1)
+        )
+        y_range = range(
+            max(0, int(ymin / scale_y // info['tile_height'])),
+            min(info['ny_tiles'], int((ymax - 1) / scale_y // info['tile_height']) + 1)
+        )
+    for y in y_range:
+        for x in x_range:
+            yield x, y, z
+
+
+def _batches(tiles, batch_size):
+    batch = []
+    for tile in tiles:
+        batch.append(tile)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class DirectoryWriter:
+    """Writes tiles to {root}/{z}/{x}/{y}.{ext}."""
+
+    def __init__(self, root):
+        self.root = root
+        self._dirs = set()
+
+    def begin(self, cog):
+        os.makedirs(self.root, exist_ok=True)
+
+    def write(self, x, y, z, mime_type, tile):
+        directory = os.path.join(self.root, str(z), str(x))
+        if directory not in self._dirs:
+            os.makedirs(directory, exist_ok=True)
+            self._dirs.add(directory)
+        path = os.path.join(directory, f'{y}{tile_extension(mime_type)}')
+        with open(path, 'wb') as dst:
+            dst.write(tile)
+
+    def close(self):
+        pass
+
+
+class MBTilesWriter:
+    """Writes tiles to an MBTiles (SQLite) file in batched transactions.
+
+    MBTiles zoom levels increase with resolution and rows count from the
+    bottom, so COG level z is written at zoom level (levels - 1 - z) and
+    tile row (ny_tiles - 1 - y).
+    """
+
+    def __init__(self, path, name=None, batch_size=500):
+        """Init writer.
+        Parameters
+        ----------
+        path:
+            the MBTiles file, created if it does not exist
+        name:
+            Optional name for the metadata, the file name otherwise
+        batch_size:
+            number of tiles written per transaction
+        """
+        self.path = path
+        self.name = name or os.path.splitext(os.path.basename(path))[0]
+        self.batch_size = batch_size
+        self._batch = []
+        self._db = None
+        self._levels = 0
+        self._rows = []
+        self._format = None
+        self._zooms = set()
+
+    def begin(self, cog):
+        self._levels = cog.levels
+        self._rows = [cog.level_info(z)['ny_tiles'] for z in range(cog.levels)]
+        # imported here so that exporting to a directory does not load sqlite
+        import sqlite3
+        self._db = sqlite3.connect(self.path)
+        self._db.executescript(
+            'CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT);'
+            'CREATE UNIQUE INDEX IF NOT EXISTS metadata_name ON metadata (name);'
+            'CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, '
+            'tile_column INTEGER, tile_row INTEGER, tile_data BLOB);'
+            'CREATE UNIQUE INDEX IF NOT EXISTS tile_index '
+            'ON tiles (zoom_level, tile_column, tile_row);'
+        )
+
+    def write(self, x, y, z, mime_type, tile):
+        if self._format is None:
+            self._format = tile_extension(mime_type).lstrip('.')
+        zoom = self._levels - 1 - z
+        self._zooms.add(zoom)
+        self._batch.append((zoom, x, self._rows[z] - 1 - y, tile))
+        if len(self._batch) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        with self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO tiles '
+                '(zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)',
+                self._batch
+            )
+        self._batch = []
+
+    def close(self):
+        if self._db is None:
+            return
+        self._flush()
+        metadata = {'name': self.name, 'format': self._format or ''}
+        if self._zooms:
+            metadata['minzoom'] = str(min(self._zooms))
+            metadata['maxzoom'] = str(max(self._zooms))
+        with self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)',
+                metadata.items()
+            )
+        self._db.close()
+        self._db = None
+
+
+def export_tiles(cog, writer, levels=None, bbox=None, workers=8,
+                 batch_size=16, queue_size=64, max_gap=None, skip_empty=True):
+    """Export the tiles of a COG.
+
+    Tiles are read in row major batches with COGTiff.get_tiles, so that
+    neighbouring tiles share requests, on a pool of worker threads while
+    the calling thread writes finished batches in order. At most queue_size
+    batches are held in memory.
+    Parameters
+    ----------
+    cog:
+        cogdumper.cog_tiles.COGTiff
+    writer:
+        DirectoryWriter, MBTilesWriter or an object with the same methods
+    levels:
+        Optional sequence of levels, all levels otherwise
+    bbox:
+        Optional (xmin, ymin, xmax, ymax) in pixels of the full resolution
+        image
+    workers:
+        number of threads reading tiles
+    batch_size:
+        number of tiles read together
+    queue_size:
+        number of batches read ahead of the writer
+    max_gap:
+        see cogdumper.cog_tiles.COGTiff.get_tiles
+    skip_empty:
+        bool, leave out sparse tiles rather than writing empty_tile
+    Returns
+    -------
+    dict: number of tiles and bytes written and the seconds taken
+    """
+    if levels is None:
+        levels = range(cog.levels)
+
+    def tiles():
+        for z in levels:
+            for x, y, z in level_tiles(cog, z, bbox):
+                if not (skip_empty and cog.is_empty(x, y, z)):
+                    yield x, y, z
+
+    def fetch(batch):
+        return batch, cog.get_tiles(batch, max_gap=max_gap)
+
+    start = time.monotonic()
+    count = 0
+    size = 0
+    writer.begin(cog)
+    try:
+        batches = _batches(tiles(), batch_size)
+        for batch, results in bounded_imap(fetch, batches, workers, queue_size):
+            for (x, y, z), (mime_type, tile) in zip(batch, results):
+                writer.write(x, y, z, mime_type, tile)
+                count += 1
+                size += len(tile)
+    finally:
+        writer.close()
+
+    elapsed = time.monotonic() - start
+    logger.info(f'Exported {count} tiles, {size} bytes in {elapsed:.1f}s')
+    return {'tiles': count, 'bytes': size, 'seconds': elapsed}
@@ -1,20 +1,144 @@
 """A utility to dump tiles directly from a local tiff file."""
 
 import logging
-from cogdumper.cog_tiles import AbstractReader
+import mmap
+import os
+import time
+
+from cogdumper import metrics
+from cogdumper.aio import AbstractAsyncReader
+from cogdumper.cog_tiles import AbstractReader, stream_chunk_size
 
 logger = logging.getLogger(__name__)
 
 
+def _stat(handle):
+    st = os.fstat(handle.fileno())
+    return {
+        'url': 'file://' + os.path.realpath(handle.name),
+        'etag': None,
+        'mtime': st.st_mtime_ns,
+        'size': st.st_size
+    }
+
+
 class Reader(AbstractReader):
     """Wraps the remote COG."""
 
+    backend = 'file'
+
     def __init__(self, handle):
         self._handle = handle
 
+    def stat(self):
+        return _stat(self._handle)
+
     def read(self, offset, length):
         start = offset
         stop = offset + length - 1
         logger.info(f'Reading bytes: {start} to {stop}')
+        started = time.perf_counter()
         self._handle.seek(offset)
-        return self._handle.read(length)
+        data = self._handle.read(length)
+        metrics.observe(self, offset, length, len(data), started)
+        return data
+
+    def stream(self, offset, length, chunk_size=None):
+        chunk_size = stream_chunk_size(chunk_size)
+        started = time.perf_counter()
+        nbytes = 0
+        end = offset + length
+        for start in range(offset, end, chunk_size):
+            # seek for every chunk, other reads may come in between
+            self._handle.seek(start)
+            chunk = self._handle.read(min(chunk_size, end - start))
+            if not chunk:
+                break
+            nbytes += len(chunk)
+            yield chunk
+        metrics.observe(self, offset, length, nbytes, started)
+
+
+class MMapReader(AbstractReader):
+    """Memory maps the local COG.
+
+    Reads return memoryview slices of the mapping without copying and, as
+    there is no file position, the reader can be shared between threads.
+    """
+
+    backend = 'mmap'
+
+    def __init__(self, handle):
+        self._handle = handle
+        self._owns_handle = False
+        self._mmap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+
+    @classmethod
+    def open(cls, path):
+        """Map a file by path, the file is closed with the reader."""
+        reader = cls(open(path, 'rb'))
+        reader._owns_handle = True
+        return reader
+
+    def stat(self):
+        return _stat(self._handle)
+
+    def read(self, offset, length):
+        start = offset
+        stop = offset + length - 1
+        logger.info(f'Reading bytes: {start} to {stop}')
+        started = time.perf_counter()
+        data = self._view[offset:offset + length]
+        metrics.observe(self, offset, length, len(data), started)
+        return data
+
+    def stream(self, offset, length, chunk_size=None):
+        chunk_size = stream_chunk_size(chunk_size)
+        started = time.perf_counter()
+        end = min(offset + length, len(self._view))
+        for start in range(offset, end, chunk_size):
+            yield self._view[start:min(start + chunk_size, end)]
+        metrics.observe(self, offset, length, max(end - offset, 0), started)
+
+    def close(self):
+        """Close the reader.
+
+        The file is unmapped once the memoryviews returned by read are
+        released, which may be after the reader is closed.
+        """
+        try:
+            self._view.release()
+            try:
+                self._mmap.close()
+            except BufferError:
+                # views still refer to the mapping, which is unmapped when
+                # the last of them is garbage collected
+                pass
+            self._mmap = None
+        finally:
+            if self._owns_handle:
+                self._handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class AsyncReader(AbstractAsyncReader):
+    """Wraps the local COG for asyncio, reading on the default executor."""
+
+    def __init__(self, handle):
+        self._handle = handle
+
+    async def read(self, offset, length):
+        start = offset
+        stop = offset + length - 1
+        logger.info(f'Reading bytes: {start} to {stop}')
+        import asyncio
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, os.pread, self._handle.fileno(), length, offset
+        )
@@ -0,0 +1,261 @@
+"""Header buffering and prefetch sizing for COGs."""
+
+import os
+import threading
+from bisect import bisect_right
+
+
+def max_prefetch():
+    """Largest single read made to prefetch a header, COG_MAX_HEADER_PREFETCH_BYTES or 1 MB."""
+    return int(os.environ.get('COG_MAX_HEADER_PREFETCH_BYTES', str(1024 * 1024)))
+
+
+# start of the structural metadata GDAL writes after the TIFF file header,
+# the first line is GDAL_STRUCTURAL_METADATA_SIZE=XXXXXX bytes
+STRUCTURAL_METADATA_PREFIX = b'GDAL_STRUCTURAL_METADATA_SIZE='
+STRUCTURAL_METADATA_LINE = len(STRUCTURAL_METADATA_PREFIX) + 13
+
+
+def parse_structural_metadata(data):
+    """Parse the KEY=VALUE lines of GDAL structural metadata.
+    Parameters
+    ----------
+    data:
+        bytes following the GDAL_STRUCTURAL_METADATA_SIZE line
+    Returns
+    -------
+    dict of str to str
+    """
+    metadata = {}
+    for line in bytes(data).decode('ascii', 'replace').split('\n'):
+        key, sep, value = line.partition('=')
+        if sep and key.strip():
+            metadata[key.strip()] = value.strip()
+    return metadata
+
+
+def estimate_header_end(ifd_offset, ifd_end, slack):
+    """Estimate where the header of a COG ends from its first IFD.
+
+    In a COG the full resolution IFD and its tag values are followed by the
+    IFDs of the overviews, each a quarter of the size of the previous one,
+    so together they take about a third of the space of the first, plus
+    the fixed size of their directories.
+    Parameters
+    ----------
+    ifd_offset:
+        number, offset of the first IFD
+    ifd_end:
+        number, end of the first IFD and all of its out of line tag values
+    slack:
+        number, bytes added to cover the directories of the overviews
+    """
+    return ifd_end + (ifd_end - ifd_offset) // 3 + slack
+
+
+class HeaderBuffer:
+    """The byte ranges of a COG header read so far.
+
+    Ranges are kept as separate segments rather than one contiguous buffer,
+    so that growing the buffer does not copy what was already read and
+    parts of the file that are not needed are never read. Slices spanning
+    several segments are joined. Keeps count of the requests and bytes it
+    takes to read the header. Safe to use from several threads, reads are
+    made without holding the lock.
+    """
+
+    def __init__(self, read):
+        """Init header buffer.
+        Parameters
+        ----------
+        read:
+            callable with the signature of cogdumper.cog_tiles.AbstractReader.read
+        """
+        self.read = read
+        self.requests = 0
+        self.bytes = 0
+        # sorted, non overlapping segments and their start offsets
+        self._starts = []
+        self._segments = []
+        # size of the file, once a read came back short
+        self._size = None
+        # once released, reads are passed through and not kept
+        self._released = False
+        self._lock = threading.Lock()
+
+    @property
+    def eof(self):
+        """True once a read reached the end of the file."""
+        return self._size is not None
+
+    @property
+    def prefix_size(self):
+        """Number of bytes held contiguously from the start of the file."""
+        end = 0
+        with self._lock:
+            for start, segment in zip(self._starts, self._segments):
+                if start != end:
+                    break
+                end += len(segment)
+        return end
+
+    @property
+    def data(self):
+        """The bytes held contiguously from the start of the file."""
+        return self.get(0, self.prefix_size)
+
+    @property
+    def nbytes(self):
+        """Number of bytes held."""
+        with self._lock:
+            return sum(len(segment) for segment in self._segments)
+
+    def _fetch(self, offset, length):
+        data = self.read(offset, length)
+        with self._lock:
+            self.requests += 1
+            self.bytes += len(data)
+            if len(data) < length:
+                self._size = offset + len(data)
+            if len(data) and not self._released:
+                i = bisect_right(self._starts, offset)
+                # another thread may have read part of the range meanwhile,
+                # segments are kept apart and the gap is read again
+                overlaps = (
+                    (i > 0 and self._starts[i - 1] + len(self._segments[i - 1]) > offset) or
+                    (i < len(self._starts) and self._starts[i] < offset + len(data))
+                )
+                if not overlaps:
+                    self._starts.insert(i, offset)
+                    self._segments.insert(i, data)
+        return data
+
+    def _locate(self, pos):
+        """The segment holding pos.
+        Returns
+        -------
+        tuple: (start, segment, next start) where start and segment are None
+        if pos is not held, and next start, of the following segment, is
+        None after the last segment
+        """
+        with self._lock:
+            i = bisect_right(self._starts, pos) - 1
+            next_start = self._starts[i + 1] if i + 1 < len(self._starts) else None
+            if i >= 0:
+                start = self._starts[i]
+                segment = self._segments[i]
+                if pos < start + len(segment):
+                    return start, segment, next_start
+            return None, None, next_start
+
+    def prefetch(self, length):
+        """Read the start of the file."""
+        self._fetch(0, length)
+
+    def extend(self, end):
+        """Read up to end after the start of the file held, in one request."""
+        start = self.prefix_size
+        if self.eof or end <= start:
+            return
+        self._fetch(start, end - start)
+
+    def has(self, offset, length):
+        """True if the range is held, or lies beyond the end of the file."""
+        end = offset + length
+        if self._size is not None:
+            end = min(end, self._size)
+        pos = offset
+        while pos < end:
+            start, segment, _ = self._locate(pos)
+            if start is None:
+                return False
+            pos = start + len(segment)
+        return True
+
+    def get(self, offset, length, lookahead=0):
+        """Bytes of the header at offset, reading the parts not held.
+        Parameters
+        ----------
+        offset, length:
+            numbers, the byte range
+        lookahead:
+            number, minimum size of a read if one is needed, reads never
+            overlap segments that are already held
+        """
+        if self._released:
+            return self._fetch(offset, length)
+        end = offset + length
+        pieces = []
+        pos = offset
+        while pos < end and (self._size is None or pos < self._size):
+            start, segment, next_start = self._locate(pos)
+            if start is not None:
+                stop = min(end, start + len(segment))
+                pieces.append(segment[pos - start:stop - start])
+                pos = stop
+                continue
+            # read the gap up to the next segment
+            size = max(end - pos, lookahead)
+            if next_start is not None:
+                size = min(size, next_start - pos)
+            self._fetch(pos, size)
+
+        if len(pieces) == 1:
+            return pieces[0]
+        return b''.join(pieces)
+
+    def release(self):
+        """Drop all segments, later reads go to the reader and are not kept.
+
+        Tags read after the header is parsed, such as the tile arrays of
+        overviews read on first use, are decoded once and not needed raw.
+        """
+        with self._lock:
+            self._starts = []
+            self._segments = []
+            self._released = True
+
+
+class HeaderSizeHints:
+    """Learns typical header sizes per location.
+
+    COGs under the same bucket prefix or directory are usually produced
+    alike and have similar header sizes, so the header size of the last COG
+    opened under a prefix is a good first read size for the next.
+    """
+
+    def __init__(self):
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def prefix(key):
+        """The location of a source, its URL or key up to the last /."""
+        return key.rsplit('/', 1)[0]
+
+    def size_for(self, key):
+        """First read size for a source, or None if nothing was learned."""
+        with self._lock:
+            return self._sizes.get(self.prefix(key))
+
+    def record(self, key, size):
+        """Learn the header size of a source, with headroom for its siblings."""
+        with self._lock:
+            self._sizes[self.prefix(key)] = min(size + size // 8, max_prefetch())
+
+    def open(self, reader, key):
+        """Open a COG with a learned first read size.
+        Parameters
+        ----------
+        reader:
+            A reader that implements the cogdumper.cog_tiles.AbstractReader methods
+        key:
+            the source URL or key, COGs with the same prefix share a hint
+        Returns
+        -------
+        cogdumper.cog_tiles.COGTiff
+        """
+        from cogdumper.cog_tiles import COGTiff
+        cog = COGTiff(reader.read, header_size=self.size_for(key))
+        self.record(key, cog.header_size)
+        return cog
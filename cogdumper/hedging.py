@@ -0,0 +1,319 @@
+"""Hedged and deadline-aware reads, for the long tail of remote latency.
+
+A Hedger runs each read on its own threads and, when the read has not
+returned after a delay, issues the same read again and takes whichever
+response arrives first. The delay is a percentile of the latencies of
+recent reads, so that only the slowest few are duplicated. Deadlines are
+held in a context variable, like the purpose of cogdumper.metrics, so that
+they reach the reads run on the cogdumper.pool threads.
+
+    from cogdumper import hedging
+    from cogdumper.s3dumper import Reader
+
+    reader = Reader(bucket, key, hedger=hedging.Hedger())
+    cog = COGTiff(reader.read)
+    cog.get_tile(0, 0, 0, deadline=0.5)
+    reader.hedger.stats
+"""
+
+import contextlib
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from cogdumper import pool
+from cogdumper.errors import DeadlineExceededError
+
+_deadline = contextvars.ContextVar('cogdumper_deadline', default=None)
+
+_lock = threading.Lock()
+_executor = None
+_hedgers = {}
+
+
+def hedging_enabled():
+    """Whether readers of source URLs hedge their reads, COG_HEDGE=YES."""
+    return os.environ.get('COG_HEDGE', 'NO').upper() in ('YES', 'TRUE', '1')
+
+
+def hedge_percentile():
+    """Percentile of recent latencies a read waits before it is hedged,
+    COG_HEDGE_PERCENTILE or 95."""
+    return float(os.environ.get('COG_HEDGE_PERCENTILE', '95'))
+
+
+def hedge_delay():
+    """Delay in seconds before hedging while too few latencies are known,
+    COG_HEDGE_DELAY_MS or 100 ms."""
+    return float(os.environ.get('COG_HEDGE_DELAY_MS', '100')) / 1000
+
+
+def hedge_min_delay():
+    """Least delay in seconds before hedging, COG_HEDGE_MIN_DELAY_MS or 5 ms."""
+    return float(os.environ.get('COG_HEDGE_MIN_DELAY_MS', '5')) / 1000
+
+
+def hedge_workers():
+    """Threads running hedged reads, COG_HEDGE_WORKERS or four times
+    cogdumper.pool.max_workers()."""
+    return int(os.environ.get('COG_HEDGE_WORKERS', str(4 * pool.max_workers())))
+
+
+def hedge_executor():
+    """The process wide executor of hedged reads, created on first use.
+
+    Reads that are waited on hold a thread of the caller, or of the
+    cogdumper.pool executor, so they run on threads of their own.
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=hedge_workers(),
+                thread_name_prefix='cogdumper-hedge'
+            )
+        return _executor
+
+
+def backend_hedger(backend):
+    """The Hedger shared by the readers of a backend when hedging_enabled(),
+    None otherwise."""
+    if not hedging_enabled():
+        return None
+    with _lock:
+        hedger = _hedgers.get(backend)
+        if hedger is None:
+            hedger = _hedgers[backend] = Hedger()
+        return hedger
+
+
+@contextlib.contextmanager
+def deadline(seconds):
+    """Reads in the block raise DeadlineExceededError after seconds.
+
+    A deadline never extends the deadline of an enclosing block.
+    Parameters
+    ----------
+    seconds:
+        number, or None for no deadline
+    """
+    if seconds is None:
+        yield
+        return
+    at = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        at = min(at, current)
+    token = _deadline.set(at)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """Seconds left before the deadline, None without a deadline."""
+    at = _deadline.get()
+    if at is None:
+        return None
+    return at - time.monotonic()
+
+
+def check():
+    """Raise DeadlineExceededError if the deadline has passed."""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceededError('Read deadline exceeded')
+
+
+def _submit(func, args, done=None):
+    started = time.monotonic()
+
+    def timed():
+        try:
+            return func(*args)
+        finally:
+            if done is not None:
+                done(time.monotonic() - started)
+
+    # the attempt runs in a copy of the caller's context, which holds the
+    # deadline and the purpose of the read for cogdumper.metrics
+    return hedge_executor().submit(contextvars.copy_context().run, timed)
+
+
+def call(hedger, func, *args, timeout=None, discard=None):
+    """Call a read, hedged and within the deadline.
+
+    Without a hedger the read is made in the calling thread, readers bound
+    their requests by remaining() and a read that returns after the
+    deadline raises.
+    Parameters
+    ----------
+    hedger:
+        Optional Hedger
+    func:
+        callable making the read
+    args:
+        arguments of func
+    timeout:
+        Optional number, seconds the call may take, on top of the deadline
+        of the context
+    discard:
+        Optional callable releasing a result that is not returned, such as
+        an open response of an attempt that lost
+    Returns
+    -------
+    the result of func
+    """
+    with deadline(timeout):
+        if hedger is not None:
+            return hedger.call(func, *args, discard=discard)
+        check()
+        result = func(*args)
+        try:
+            check()
+        except DeadlineExceededError:
+            if discard is not None:
+                discard(result)
+            raise
+        return result
+
+
+def _discard_results(futures, discard):
+    """Release the results of attempts that are not returned, once done."""
+    if discard is None:
+        return
+
+    def done(future):
+        if future.exception() is None:
+            discard(future.result())
+
+    for future in futures:
+        future.add_done_callback(done)
+
+
+class Hedger:
+    """Issues a second read when the first is slow, the first to return wins.
+
+    Latencies are those of every attempt, including the ones that lose,
+    so that the delay follows the latency of the backend. A read that fails
+    while its hedge is outstanding waits for the hedge. Attempts that lose,
+    or outlive a deadline, complete in the background and are discarded.
+    """
+
+    def __init__(self, percentile=None, delay=None, min_delay=None,
+                 window=1000, min_samples=20):
+        """Init hedger.
+        Parameters
+        ----------
+        percentile:
+            number, percentile of recent latencies a read waits for before
+            it is hedged, defaults to COG_HEDGE_PERCENTILE or 95
+        delay:
+            number, seconds to wait while fewer than min_samples latencies
+            are known, defaults to COG_HEDGE_DELAY_MS or 100 ms
+        min_delay:
+            number, least seconds to wait, defaults to
+            COG_HEDGE_MIN_DELAY_MS or 5 ms
+        window:
+            number, recent latencies kept
+        min_samples:
+            number, latencies needed before the percentile is used
+        """
+        self.percentile = hedge_percentile() if percentile is None else percentile
+        self.initial_delay = hedge_delay() if delay is None else delay
+        self.min_delay = hedge_min_delay() if min_delay is None else min_delay
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self._delay = None
+        self._observed = 0
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.fired = 0
+        self.won = 0
+
+    def _observe(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+            self._observed += 1
+            # sorting is amortised over a few reads
+            if len(self._latencies) >= self.min_samples and \
+                    (self._delay is None or self._observed % 16 == 0):
+                ordered = sorted(self._latencies)
+                rank = round(self.percentile / 100 * (len(ordered) - 1))
+                self._delay = ordered[min(max(rank, 0), len(ordered) - 1)]
+
+    def delay(self):
+        """Seconds a read waits before it is hedged."""
+        with self._lock:
+            delay = self.initial_delay if self._delay is None else self._delay
+        return max(delay, self.min_delay)
+
+    @property
+    def stats(self):
+        """Counts of reads, hedges fired and hedges that returned first."""
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'fired': self.fired,
+                'won': self.won,
+                'delay_ms': (self._delay if self._delay is not None
+                             else self.initial_delay) * 1000
+            }
+
+    def call(self, func, *args, discard=None):
+        """Call func(*args), hedged, within the deadline of the context.
+        Parameters
+        ----------
+        func:
+            callable making the read
+        args:
+            arguments of func
+        discard:
+            Optional callable releasing the result of an attempt that lost
+        """
+        check()
+        with self._lock:
+            self.calls += 1
+        first = _submit(func, args, self._observe)
+        wait_for = self.delay()
+        left = remaining()
+        if left is not None:
+            wait_for = min(wait_for, max(left, 0))
+        done, _ = wait([first], timeout=wait_for)
+        if done:
+            return first.result()
+        try:
+            check()
+        except DeadlineExceededError:
+            _discard_results([first], discard)
+            raise
+
+        with self._lock:
+            self.fired += 1
+        hedge = _submit(func, args, self._observe)
+        pending = {first, hedge}
+        error = None
+        while pending:
+            left = remaining()
+            done, pending = wait(
+                pending,
+                timeout=None if left is None else max(left, 0),
+                return_when=FIRST_COMPLETED
+            )
+            if not done:
+                _discard_results(pending, discard)
+                raise DeadlineExceededError('Read deadline exceeded')
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.won += 1
+                    _discard_results([f for f in (first, hedge) if f is not future], discard)
+                    return future.result()
+                if error is None or future is first:
+                    error = future.exception()
+        raise error
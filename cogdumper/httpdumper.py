@@ -1,20 +1,86 @@
 """A utility to dump tiles directly from a tiff file on a http server."""
 
+import contextvars
 import logging
+import os
+import time
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 
-from cogdumper.errors import TIFFError
-from cogdumper.cog_tiles import AbstractReader
+from cogdumper import hedging, metrics, pool
+from cogdumper.aio import AbstractAsyncReader
+from cogdumper.errors import DeadlineExceededError, TIFFError
+from cogdumper.cog_tiles import AbstractReader, stream_chunk_size
+from cogdumper.ranges import parse_byteranges, parse_content_range, slice_ranges
 
 logger = logging.getLogger(__name__)
 
 
+def create_session(max_connections=None):
+    """A requests.Session with a connection pool sized for read_many.
+    Parameters
+    ----------
+    max_connections:
+        number of connections kept per host, defaults to
+        cogdumper.pool.max_connections()
+    """
+    if max_connections is None:
+        max_connections = pool.max_connections()
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=max_connections,
+        pool_maxsize=max_connections
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def max_ranges():
+    """Most byte ranges sent in one request, COG_HTTP_MAX_RANGES or 32."""
+    return int(os.environ.get('COG_HTTP_MAX_RANGES', '32'))
+
+
 class Reader(AbstractReader):
-    """Wraps the remote COG."""
+    """Wraps the remote COG.
 
-    def __init__(self, server, path, resource, user=None, password=None):
+    No request is made until the first read, whose response tells whether
+    the resource exists and carries its validators. read_many asks for many
+    ranges in one multi-range request and falls back to single range
+    requests for servers that only honour one range. Reads are hedged by
+    the hedger, if any, and requests time out at the deadline of the
+    context, see cogdumper.hedging.
+    """
+
+    backend = 'http'
+
+    def __init__(self, server, path, resource, user=None, password=None,
+                 session=None, executor=None, hedger=None, deadline=None):
+        """Init reader object.
+        Parameters
+        ----------
+        server:
+            server e.g. http://localhost:8080
+        path:
+            server path
+        resource:
+            server resource
+        user, password:
+            Optional HTTP basic auth credentials
+        session:
+            Optional requests.Session to share connections between readers,
+            see cogdumper.httpdumper.create_session
+        executor:
+            Optional concurrent.futures.Executor for read_many, the shared
+            cogdumper.pool executor otherwise
+        hedger:
+            Optional cogdumper.hedging.Hedger duplicating slow reads
+        deadline:
+            Optional number, seconds each read may take before it raises
+            cogdumper.errors.DeadlineExceededError
+        """
         self.server = server
         self.path = path
         self.resource = resource
@@ -27,25 +93,239 @@ class Reader(AbstractReader):
         else:
             self.auth = None
 
-        self._resource_exists = True
+        # unknown until the first response
+        self._resource_exists = None
+        self._stat = None
+        self._multi_range = True
 
-        self.session = requests.Session()
-        r = self.session.head(self.url, auth=self.auth)
-        if r.status_code != requests.codes.ok:
-            self._resource_exists = False
+        self.session = session or create_session()
+        self.executor = executor
+        self.hedger = hedger
+        self.deadline = deadline
 
     @property
     def resource_exists(self):
+        if self._resource_exists is None:
+            self._head()
         return self._resource_exists
 
+    def _head(self):
+        r = self.session.head(self.url, auth=self.auth)
+        self._resource_exists = r.status_code == requests.codes.ok
+        if self._resource_exists:
+            size = r.headers.get('Content-Length')
+            self._record(r.headers, int(size) if size is not None else None)
+
+    def _record(self, headers, size):
+        if self._stat is None:
+            self._stat = {
+                'url': self.url,
+                'etag': headers.get('ETag'),
+                'mtime': headers.get('Last-Modified'),
+                'size': size
+            }
+
+    def stat(self):
+        if self._stat is None:
+            self._head()
+        if self._stat is None:
+            return {'url': self.url, 'etag': None, 'mtime': None, 'size': None}
+        return self._stat
+
+    def _get(self, byte_ranges, stream=False, multi=False):
+        """GET the resource with a Range header of byte_ranges.
+
+        A response with the whole resource raises TIFFError, unless multi is
+        set for a multi-range request, which the caller then reads again with
+        single ranges.
+        """
+        headers = {'Range': f'bytes={byte_ranges}'}
+        # a request that outlives its deadline is abandoned, not left to hang
+        timeout = hedging.remaining()
+        try:
+            r = self.session.get(
+                self.url, auth=self.auth, headers=headers, stream=stream,
+                timeout=None if timeout is None else max(timeout, 0.001)
+            )
+        except requests.exceptions.Timeout:
+            if timeout is None:
+                raise
+            raise DeadlineExceededError(f'HTTP byte range {byte_ranges} '
+                                        f'deadline exceeded')
+        if r.status_code == requests.codes.not_found:
+            self._resource_exists = False
+        if r.status_code == requests.codes.partial_content:
+            content_range = parse_content_range(r.headers.get('Content-Range'))
+            size = content_range[2] if content_range is not None else None
+        elif r.status_code == requests.codes.ok and multi:
+            size = r.headers.get('Content-Length')
+            size = int(size) if size is not None else None
+        else:
+            r.close()
+            raise TIFFError(f'HTTP byte range {byte_ranges} '
+                            f'not available. HTTP code {r.status_code}')
+        self._resource_exists = True
+        self._record(r.headers, size)
+        return r
+
     def read(self, offset, length):
+        if length <= 0:
+            return b''
+        return hedging.call(self.hedger, self._read, offset, length,
+                            timeout=self.deadline)
+
+    def _read(self, offset, length):
         start = offset
         stop = offset + length - 1
         logger.info(f'Reading bytes: {start} to {stop}')
-        headers = {'Range': f'bytes={start}-{stop}'}
-        r = self.session.get(self.url, auth=self.auth, headers=headers)
-        if r.status_code != requests.codes.partial_content:
-            raise TIFFError(f'HTTP byte range {offset}-{length} '
-                            'not available. HTTP code {r.status_code}')
+        started = time.perf_counter()
+        data = self._get(f'{start}-{stop}').content
+        metrics.observe(self, offset, length, len(data), started)
+        return data
+
+    def stream(self, offset, length, chunk_size=None):
+        """Read a range as chunks, as they arrive."""
+        if length <= 0:
+            return
+        start = offset
+        stop = offset + length - 1
+        logger.info(f'Streaming bytes: {start} to {stop}')
+        started = time.perf_counter()
+        nbytes = 0
+        # the wait for the first byte is hedged, the body is not
+        r = hedging.call(self.hedger, self._get, f'{start}-{stop}', True,
+                         timeout=self.deadline, discard=requests.Response.close)
+        try:
+            for chunk in r.iter_content(stream_chunk_size(chunk_size)):
+                nbytes += len(chunk)
+                yield chunk
+        finally:
+            r.close()
+            metrics.observe(self, offset, length, nbytes, started)
+
+    def _read_multi(self, ranges):
+        """Read ranges with one multi-range request.
+
+        Ranges that the server does not return are None, for read_many to
+        read with single range requests.
+        """
+        byte_ranges = ','.join(
+            f'{offset}-{offset + length - 1}' for offset, length in ranges
+        )
+        logger.info(f'Reading bytes: {byte_ranges}')
+        started = time.perf_counter()
+        # the body is only read once it is known not to be the whole resource
+        r = self._get(byte_ranges, stream=True, multi=True)
+        if r.status_code == requests.codes.ok:
+            r.close()
+            metrics.observe(self, ranges[0][0], sum(length for _, length in ranges),
+                            0, started)
+            logger.info(f'{self.url} does not serve multiple byte ranges')
+            self._multi_range = False
+            return [None] * len(ranges)
+        metrics.observe(self, ranges[0][0], sum(length for _, length in ranges),
+                        len(r.content), started)
+        content_type = r.headers.get('Content-Type', '')
+        if content_type.startswith('multipart/byteranges'):
+            try:
+                parts = parse_byteranges(content_type, r.content)
+            except ValueError as e:
+                raise TIFFError(f'Invalid multipart response from {self.url}: {e}')
         else:
-            return r.content
+            # a single range, either the requested ranges merged or only
+            # the first of them
+            content_range = parse_content_range(r.headers.get('Content-Range'))
+            if content_range is None:
+                raise TIFFError(f'HTTP byte range {byte_ranges} '
+                                f'has no Content-Range')
+            parts = [(content_range[0], r.content)]
+
+        results = slice_ranges(ranges, parts)
+        if len(parts) == 1 and any(data is None for data in results):
+            logger.info(f'{self.url} only serves single byte ranges')
+            self._multi_range = False
+        return results
+
+    def _hedged_read_multi(self, ranges):
+        return hedging.call(self.hedger, self._read_multi, ranges,
+                            timeout=self.deadline)
+
+    def read_many(self, ranges):
+        """Read (offset, length) ranges in few multi-range requests.
+
+        Requests of up to max_ranges() ranges are made concurrently. When the
+        server only honours single ranges they, and the ranges it did not
+        return, are read concurrently.
+        """
+        wanted = [i for i, (_, length) in enumerate(ranges) if length > 0]
+        if len(wanted) <= 1 or not self._multi_range:
+            return pool.read_many(self.read, ranges, self.executor)
+
+        size = max_ranges()
+        batches = [
+            [ranges[i] for i in wanted[n:n + size]]
+            for n in range(0, len(wanted), size)
+        ]
+        if len(batches) == 1:
+            batch_results = [self._hedged_read_multi(batches[0])]
+        else:
+            executor = self.executor or pool.shared_executor()
+            futures = [
+                executor.submit(contextvars.copy_context().run, self._hedged_read_multi, b)
+                for b in batches
+            ]
+            batch_results = [f.result() for f in futures]
+
+        results = [b''] * len(ranges)
+        for i, data in zip(wanted, (d for batch in batch_results for d in batch)):
+            results[i] = data
+        missing = [i for i in wanted if results[i] is None]
+        if missing:
+            reads = pool.read_many(self.read, [ranges[i] for i in missing], self.executor)
+            for i, data in zip(missing, reads):
+                results[i] = data
+        return results
+
+
+class AsyncReader(AbstractAsyncReader):
+    """Wraps the remote COG for asyncio, requires aiohttp."""
+
+    def __init__(self, server, path, resource, user=None, password=None,
+                 session=None):
+        self.server = server
+        self.path = path
+        self.resource = resource
+        if path:
+            self.url = f'{server}/{path}/{resource}'
+        else:
+            self.url = f'{server}/{resource}'
+        self._user = user
+        self._password = password
+        self._session = session
+        self._owns_session = session is None
+
+    def _get_session(self):
+        if self._session is None:
+            import aiohttp
+            if self._user:
+                auth = aiohttp.BasicAuth(self._user, self._password)
+            else:
+                auth = None
+            self._session = aiohttp.ClientSession(auth=auth)
+        return self._session
+
+    async def read(self, offset, length):
+        start = offset
+        stop = offset + length - 1
+        logger.info(f'Reading bytes: {start} to {stop}')
+        headers = {'Range': f'bytes={start}-{stop}'}
+        async with self._get_session().get(self.url, headers=headers) as r:
+            if r.status != requests.codes.partial_content:
+                raise TIFFError(f'HTTP byte range {offset}-{length} '
+                                f'not available. HTTP code {r.status}')
+            return await r.read()
+
+    async def close(self):
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
@@ -0,0 +1,115 @@
+"""Persistent sidecar tile indexes for COGs.
+
+Parsing a COG header costs at least one range request plus a walk of every
+IFD. An index stores the result of that parse on local disk, keyed by the
+source URL, so that reopening an unchanged COG needs no header I/O at all.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from cogdumper.cog_tiles import COGTiff
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 3
+VALIDATORS = ('etag', 'mtime', 'size')
+
+
+def _cacheable(stat):
+    return stat is not None and stat.get('url') and \
+        any(stat.get(v) is not None for v in VALIDATORS)
+
+
+class IndexStore:
+    """A directory of tile indexes."""
+
+    def __init__(self, directory):
+        """Init index store.
+        Parameters
+        ----------
+        directory:
+            local directory that holds the index files, created on demand
+        """
+        self.directory = directory
+
+    def path(self, url):
+        """Path of the index file for a source URL."""
+        name = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f'{name}.json')
+
+    def load(self, stat):
+        """Load the index for a source.
+        Parameters
+        ----------
+        stat:
+            dict as returned by cogdumper.cog_tiles.AbstractReader.stat
+        Returns
+        -------
+        dict: the tile index, or None if it is missing, was written by a
+        different index version or its validators do not match the source
+        """
+        if not _cacheable(stat):
+            return None
+        try:
+            with open(self.path(stat['url'])) as src:
+                index = json.load(src)
+        except (OSError, ValueError):
+            return None
+
+        if index.get('version') != INDEX_VERSION:
+            logger.info(f'Index for {stat["url"]} has version '
+                        f'{index.get("version")}, ignoring')
+            return None
+        source = index.get('source', {})
+        for v in VALIDATORS:
+            if source.get(v) != stat.get(v):
+                logger.info(f'Index for {stat["url"]} is stale ({v} changed)')
+                return None
+        return index
+
+    def save(self, stat, cog):
+        """Save the index of a parsed COG.
+        Parameters
+        ----------
+        stat:
+            dict as returned by cogdumper.cog_tiles.AbstractReader.stat
+        cog:
+            cogdumper.cog_tiles.COGTiff parsed from the same source
+        """
+        if not _cacheable(stat):
+            return
+        index = cog.to_index()
+        index['version'] = INDEX_VERSION
+        index['source'] = {k: stat.get(k) for k in ('url',) + VALIDATORS}
+
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as dst:
+                json.dump(index, dst)
+            os.replace(tmp, self.path(stat['url']))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def open(self, reader):
+        """Open a COG, using and refreshing the stored index.
+        Parameters
+        ----------
+        reader:
+            A reader that implements the cogdumper.cog_tiles.AbstractReader methods
+        Returns
+        -------
+        cogdumper.cog_tiles.COGTiff
+        """
+        stat = reader.stat()
+        index = self.load(stat)
+        if index is not None:
+            return COGTiff(reader.read, index=index)
+        cog = COGTiff(reader.read)
+        self.save(stat, cog)
+        return cog
@@ -5,13 +5,40 @@ from cogdumper.errors import JPEGError
 
 SOI = 0xd8
 
+def table_body(tables):
+    """The JPEG tables without their SOI and EOI markers, or None."""
+    if tables:
+        return bytes(tables[2:-2])
+    return None
+
+
+def table_segments(data, body):
+    """Segments of a tile with JPEG tables inserted, without copying the tile.
+    Parameters
+    ----------
+    data:
+        the tile, any buffer object
+    body:
+        the tables as returned by table_body
+    Returns
+    -------
+    tuple of buffers: the SOI marker, the tables and the rest of the tile,
+    or just the tile if there are no tables
+    """
+    if body is None:
+        # no-op as per the spec, segment contains all of the JPEG data required
+        return (data,)
+    if len(data) >= 2 and data[0] == 0xFF and data[1] == SOI:
+        view = memoryview(data)
+        return (view[0:2], body, view[2:])
+    else:
+        raise JPEGError('Missing SOI marker for JPEG tile')
+
+
 def insert_tables(data, tables):
+    """Insert JPEG tables into a tile, data and tables may be any buffer object."""
     if tables:
-        if data[0] == 0xFF and data[1] == SOI:
-            # insert tables, first removing the SOI and EOI
-            return data[0:2] + tables[2:-2] + data[2:]
-        else:
-            raise JPEGError('Missing SOI marker for JPEG tile')
+        # insert tables, first removing the SOI and EOI
+        return b''.join(table_segments(data, table_body(tables)))
     else:
-        # no-op as per the spec, segment contains all of the JPEG data required
         return data
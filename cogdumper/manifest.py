@@ -0,0 +1,279 @@
+"""Extraction of tiles from many COGs listed in a manifest.
+
+A manifest lists one tile per line, as "source x y z", "source,x,y,z" or
+JSON {"source": source, "x": x, "y": y, "z": z}, where source is a URL as
+taken by cogdumper.sources.open_reader. Entries are grouped by source and
+the groups spread over a pool of processes, each of which reads several
+sources at once on its own threads. Each header is parsed once, by the
+process that reads all of the tiles of its source, and the readers of a
+process share their sessions.
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from urllib.parse import urlparse
+
+from cogdumper.errors import TIFFError
+from cogdumper.export import DirectoryWriter
+from cogdumper.pipeline import bounded_imap
+
+logger = logging.getLogger(__name__)
+
+# state of a worker process, set by _init_worker
+_worker = None
+
+
+def parse_entry(line):
+    """Source and tile coordinates of a manifest line.
+    Returns
+    -------
+    tuple: (source, x, y, z), or None for a blank line
+    """
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        if line[0] == '{':
+            value = json.loads(line)
+            source, x, y, z = value['source'], value['x'], value['y'], value['z']
+        else:
+            source, x, y, z = line.rsplit(',' if ',' in line else None, 3)
+        x, y, z = int(x), int(y), int(z)
+    except (ValueError, KeyError, TypeError):
+        raise ValueError(f'Invalid manifest entry {line!r}, expected "source x y z" or JSON')
+    return source.strip(), x, y, z
+
+
+def read_manifest(lines):
+    """Group the entries of a manifest by source.
+    Returns
+    -------
+    dict: source to the list of its (x, y, z) tiles, in the order sources
+    are first listed, duplicate tiles are listed once
+    """
+    groups = {}
+    for line in lines:
+        entry = parse_entry(line)
+        if entry is None:
+            continue
+        source, x, y, z = entry
+        groups.setdefault(source, {})[(x, y, z)] = None
+    return {source: list(tiles) for source, tiles in groups.items()}
+
+
+def output_directory(root, source):
+    """Directory the tiles of a source are written to, under root.
+
+    The source URL without its scheme and extension, e.g. s3://bucket/a/b.tif
+    is written to {root}/bucket/a/b.
+    """
+    parsed = urlparse(source)
+    if parsed.scheme == '':
+        path = source
+    elif parsed.scheme == 'file':
+        path = parsed.path
+    else:
+        path = f'{parsed.netloc}/{parsed.path}'
+    path = os.path.splitext(path)[0]
+    parts = [p for p in re.split(r'[/\\]+', path) if p and p not in ('.', '..')]
+    return os.path.join(root, *parts)
+
+
+class _Worker:
+    """Readers and settings of a worker process."""
+
+    def __init__(self, output, threads, index_dir, max_gap):
+        from cogdumper.catalog import Catalog
+        index_store = None
+        if index_dir:
+            from cogdumper.index import IndexStore
+            index_store = IndexStore(index_dir)
+        self.catalog = Catalog(index_store=index_store)
+        self.output = output
+        self.threads = threads
+        self.max_gap = max_gap
+
+    def extract(self, source, tiles):
+        """Read and write the tiles of one source."""
+        result = {'sources': 1, 'tiles': 0, 'empty': 0, 'bytes': 0, 'errors': 0}
+        try:
+            with self.catalog.open(source) as cog:
+                self._extract(cog, source, tiles, result)
+        except Exception as e:
+            # a source that cannot be read does not stop the others
+            logger.error(f'{source}: {getattr(e, "message", e)}')
+            result['errors'] = len(tiles) - result['tiles'] - result['empty']
+        finally:
+            # each source is read by one task, its header is not needed again
+            self.catalog.discard(source)
+        return result
+
+    def _extract(self, cog, source, tiles, result):
+        located = []
+        for tile in tiles:
+            try:
+                if cog.is_empty(*tile):
+                    result['empty'] += 1
+                else:
+                    located.append(tile)
+            except TIFFError as e:
+                logger.error(f'{source} tile {tile}: {e.message}')
+                result['errors'] += 1
+        writer = DirectoryWriter(output_directory(self.output, source))
+        writer.begin(cog)
+        try:
+            # tiles of a source that are close together share requests
+            results = cog.get_tiles(located, max_gap=self.max_gap)
+            for (x, y, z), (mime_type, tile) in zip(located, results):
+                writer.write(x, y, z, mime_type, tile)
+                result['tiles'] += 1
+                result['bytes'] += len(tile)
+        finally:
+            writer.close()
+
+    def run(self, groups):
+        total = {'sources': 0, 'tiles': 0, 'empty': 0, 'bytes': 0, 'errors': 0}
+        results = bounded_imap(
+            lambda group: self.extract(*group), groups, self.threads, self.threads * 2
+        )
+        for result in results:
+            for key, value in result.items():
+                total[key] += value
+        return total
+
+
+def _init_worker(output, threads, index_dir, max_gap):
+    global _worker
+    _worker = _Worker(output, threads, index_dir, max_gap)
+
+
+def _run_chunk(groups):
+    return _worker.run(groups)
+
+
+def _chunks(groups, chunk_size):
+    chunk = []
+    for source, tiles in groups.items():
+        chunk.append((source, tiles))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def extract_manifest(groups, output, processes=None, threads=8, chunk_size=8,
+                     index_dir=None, max_gap=None, progress=None):
+    """Extract the tiles of many sources to a directory.
+
+    Groups are sent to worker processes chunk_size at a time, with at most
+    two chunks per process in flight, and each process reads threads
+    sources at once. Sparse tiles are not written. Tiles that do not exist
+    and sources that cannot be read are logged and counted as errors.
+    Parameters
+    ----------
+    groups:
+        dict of source to the list of its (x, y, z) tiles, see read_manifest
+    output:
+        root directory, the tiles of a source are written to
+        {output_directory(output, source)}/{z}/{x}/{y}.{ext}
+    processes:
+        number of worker processes, defaults to the number of CPUs
+    threads:
+        number of sources each process reads at once
+    chunk_size:
+        number of sources sent to a process at a time
+    index_dir:
+        Optional directory of cached tile indexes, see cogdumper.index
+    max_gap:
+        see cogdumper.cog_tiles.COGTiff.get_tiles
+    progress:
+        Optional callable, called with the totals so far after each chunk
+    Returns
+    -------
+    dict: number of sources, tiles and bytes written, of sparse tiles and
+    errors, the seconds taken and tiles and bytes per second
+    """
+    processes = processes or os.cpu_count() or 1
+    start = time.monotonic()
+    total = {'sources': 0, 'tiles': 0, 'empty': 0, 'bytes': 0, 'errors': 0}
+
+    def report():
+        elapsed = time.monotonic() - start
+        return dict(
+            total,
+            seconds=elapsed,
+            tiles_per_second=total['tiles'] / elapsed if elapsed else 0.0,
+            bytes_per_second=total['bytes'] / elapsed if elapsed else 0.0
+        )
+
+    # workers are started fresh rather than forked from a process that may
+    # hold threads and open connections
+    with ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(output, threads, index_dir, max_gap)) as executor:
+        pending = set()
+        for chunk in _chunks(groups, chunk_size):
+            pending.add(executor.submit(_run_chunk, chunk))
+            if len(pending) >= processes * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                _add(total, done, progress, report)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            _add(total, done, progress, report)
+
+    result = report()
+    logger.info(f'Extracted {result["tiles"]} tiles from {result["sources"]} sources '
+                f'in {result["seconds"]:.1f}s')
+    return result
+
+
+def _add(total, done, progress, report):
+    # chunks that finish together are still reported one by one
+    for future in done:
+        for key, value in future.result().items():
+            total[key] += value
+        if progress is not None:
+            progress(report())
+
+
+class ProgressReporter:
+    """Prints totals and throughput at most every interval seconds."""
+
+    def __init__(self, sources, echo, interval=1.0):
+        """Init reporter.
+        Parameters
+        ----------
+        sources:
+            number, total sources to extract
+        echo:
+            callable taking a line of text
+        interval:
+            number, least seconds between lines
+        """
+        self.sources = sources
+        self.echo = echo
+        self.interval = interval
+        self._last = 0
+
+    def __call__(self, result, final=False):
+        now = time.monotonic()
+        if not final and now - self._last < self.interval:
+            return
+        self._last = now
+        self.echo(format_progress(result, self.sources))
+
+
+def format_progress(result, sources):
+    """One line of totals and throughput of extract_manifest."""
+    return (f'{result["sources"]}/{sources} sources, {result["tiles"]} tiles, '
+            f'{result["bytes"] / 1e6:.1f} MB, {result["errors"]} errors in '
+            f'{result["seconds"]:.1f}s, {result["tiles_per_second"]:.1f} tiles/s, '
+            f'{result["bytes_per_second"] / 1e6:.2f} MB/s')
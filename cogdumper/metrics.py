@@ -0,0 +1,246 @@
+"""Request metrics for the readers.
+
+Readers report every request they make, with its size and latency, to the
+active Metrics registry, if any. COGTiff marks what its reads are for, the
+header, image tiles or mask tiles, so that the cost of each can be told
+apart. The purpose is held in a context variable that cogdumper.pool
+carries over to its worker threads.
+
+    from cogdumper import metrics
+
+    registry = metrics.enable()
+    cog.get_tile(0, 0, 0)
+    registry.snapshot()
+"""
+
+import contextlib
+import contextvars
+import threading
+import time
+
+KINDS = ('header', 'tile', 'mask', 'other')
+
+# upper bounds of the latency histogram buckets in milliseconds
+LATENCY_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+_purpose = contextvars.ContextVar('cogdumper_purpose', default=None)
+_registry = None
+
+
+class Histogram:
+    """Counts of observations in fixed buckets."""
+
+    def __init__(self, bounds=LATENCY_BOUNDS_MS):
+        self.bounds = bounds
+        # the last bucket counts observations above the last bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.bounds) and value > self.bounds[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th percentile, or None."""
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return '+Inf'
+
+    def snapshot(self):
+        cumulative = []
+        seen = 0
+        for bound, count in zip(self.bounds + ('+Inf',), self.counts):
+            seen += count
+            cumulative.append([bound, seen])
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': cumulative,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99)
+        }
+
+
+class _Stats:
+    __slots__ = ('requests', 'bytes', 'latency_ms')
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes = 0
+        self.latency_ms = Histogram()
+
+    def add(self, nbytes, ms):
+        self.requests += 1
+        self.bytes += nbytes
+        self.latency_ms.observe(ms)
+
+    def merge(self, other):
+        self.requests += other.requests
+        self.bytes += other.bytes
+        histogram = self.latency_ms
+        for i, count in enumerate(other.latency_ms.counts):
+            histogram.counts[i] += count
+        histogram.count += other.latency_ms.count
+        histogram.sum += other.latency_ms.sum
+
+    def snapshot(self):
+        return {
+            'requests': self.requests,
+            'bytes': self.bytes,
+            'latency_ms': self.latency_ms.snapshot()
+        }
+
+
+class Metrics:
+    """Thread safe registry of request counts, bytes and latencies.
+
+    Requests are kept per backend and kind, the purpose of the read.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, backend, offset, length, nbytes, seconds):
+        """Record a request.
+        Parameters
+        ----------
+        backend:
+            name of the reader, e.g. s3, http or file
+        offset, length:
+            numbers, the byte range asked for
+        nbytes:
+            number, bytes received
+        seconds:
+            number, time the request took
+        """
+        kind = purpose_of(offset, length)
+        with self._lock:
+            stats = self._stats.get((backend, kind))
+            if stats is None:
+                stats = self._stats[(backend, kind)] = _Stats()
+            stats.add(nbytes, seconds * 1000)
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def snapshot(self):
+        """Totals, and totals by kind and by backend.
+        Returns
+        -------
+        dict: requests, bytes and latency_ms histogram under total, and by
+        kind and backend name under kinds and backends, histogram buckets
+        are cumulative [upper bound, count] pairs
+        """
+        total = _Stats()
+        kinds = {}
+        backends = {}
+        with self._lock:
+            for (backend, kind), stats in self._stats.items():
+                total.merge(stats)
+                kinds.setdefault(kind, _Stats()).merge(stats)
+                backends.setdefault(backend, _Stats()).merge(stats)
+        return {
+            'total': total.snapshot(),
+            'kinds': {k: v.snapshot() for k, v in kinds.items()},
+            'backends': {k: v.snapshot() for k, v in backends.items()}
+        }
+
+
+def enable(registry=None):
+    """Start recording requests of all readers.
+    Parameters
+    ----------
+    registry:
+        Optional Metrics, a new registry otherwise
+    Returns
+    -------
+    Metrics: the active registry
+    """
+    global _registry
+    _registry = registry or Metrics()
+    return _registry
+
+
+def disable():
+    """Stop recording requests."""
+    global _registry
+    _registry = None
+
+
+def active():
+    """The active registry, or None if metrics are disabled."""
+    return _registry
+
+
+def observe(reader, offset, length, nbytes, started):
+    """Record a request of a reader that started at time.perf_counter() started.
+
+    Uses the reader's metrics attribute if it is set, the active registry
+    otherwise.
+    """
+    registry = getattr(reader, 'metrics', None) or _registry
+    if registry is not None:
+        registry.record(
+            getattr(reader, 'backend', type(reader).__name__),
+            offset,
+            length,
+            nbytes,
+            time.perf_counter() - started
+        )
+
+
+@contextlib.contextmanager
+def purpose(kind, ranges=None):
+    """Attribute the reads made in the block to kind.
+    Parameters
+    ----------
+    kind:
+        one of KINDS
+    ranges:
+        Optional dict of (offset, length) to the kind of reads of exactly
+        that range, e.g. the mask tile read together with an image tile
+    """
+    token = _purpose.set((kind, ranges))
+    try:
+        yield
+    finally:
+        _purpose.reset(token)
+
+
+def purpose_of(offset, length):
+    """The kind of a read of a range in the current context."""
+    current = _purpose.get()
+    if current is None:
+        return 'other'
+    kind, ranges = current
+    if ranges:
+        return ranges.get((offset, length), kind)
+    return kind
+
+
+def format_summary(snapshot):
+    """A human readable summary of a snapshot, one line per kind."""
+    def line(name, stats):
+        latency = stats['latency_ms']
+        mean = latency['sum'] / latency['count'] if latency['count'] else 0
+        return (f'{name:<8} {stats["requests"]:>8} requests {stats["bytes"]:>12} bytes '
+                f'mean {mean:.1f}ms p95 <= {latency["p95"] or 0}ms')
+
+    lines = [line(kind, snapshot['kinds'][kind])
+             for kind in KINDS if kind in snapshot['kinds']]
+    lines.append(line('total', snapshot['total']))
+    return '\n'.join(lines)
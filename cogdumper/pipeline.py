@@ -0,0 +1,40 @@
+"""Bounded, ordered concurrent pipelines."""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def bounded_imap(func, items, workers, queue_size):
+    """Apply func to items on a thread pool, yielding results in order.
+
+    At most queue_size items are in flight or waiting to be consumed, so
+    memory stays bounded however many items there are and however slow the
+    consumer is, while later items are fetched as earlier ones are consumed.
+    Results that are ready are yielded before the next item is taken, so
+    that a slow producer, such as a pipe, does not hold them back.
+    Parameters
+    ----------
+    func:
+        callable taking one item
+    items:
+        iterable of items, consumed lazily
+    workers:
+        number of threads
+    queue_size:
+        number, most results held at once
+    """
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= queue_size:
+                yield pending.popleft().result()
+            while pending and pending[0].done():
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
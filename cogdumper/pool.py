@@ -0,0 +1,61 @@
+"""Thread pool for concurrent range requests.
+
+Only leaf reads run on the pool; they must not submit further work to it.
+"""
+
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_lock = threading.Lock()
+_executor = None
+
+
+def max_workers():
+    """Size of the shared pool, COG_MAX_WORKERS or 16."""
+    return int(os.environ.get('COG_MAX_WORKERS', '16'))
+
+
+def max_connections():
+    """Connections kept per backend, COG_MAX_CONNECTIONS or max_workers()."""
+    return int(os.environ.get('COG_MAX_CONNECTIONS', str(max_workers())))
+
+
+def shared_executor():
+    """The process wide executor, created on first use."""
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max_workers(),
+                thread_name_prefix='cogdumper'
+            )
+        return _executor
+
+
+def read_many(read, ranges, executor=None):
+    """Read byte ranges concurrently.
+    Parameters
+    ----------
+    read:
+        callable with the signature of cogdumper.cog_tiles.AbstractReader.read
+    ranges:
+        sequence of (offset, length) tuples
+    executor:
+        Optional concurrent.futures.Executor, the shared pool otherwise
+    Returns
+    -------
+    list of the data read for each range, in order
+    """
+    if len(ranges) <= 1:
+        return [read(offset, length) for offset, length in ranges]
+    if executor is None:
+        executor = shared_executor()
+    # each read runs in a copy of the caller's context, which holds the
+    # purpose of the reads for cogdumper.metrics
+    futures = [
+        executor.submit(contextvars.copy_context().run, read, offset, length)
+        for offset, length in ranges
+    ]
+    return [f.result() for f in futures]
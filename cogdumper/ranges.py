@@ -0,0 +1,119 @@
+"""Byte range helpers."""
+
+import re
+
+
+def coalesce(ranges, max_gap):
+    """Merge byte ranges that are adjacent or close together.
+    Parameters
+    ----------
+    ranges:
+        sequence of (offset, length) tuples, in any order
+    max_gap:
+        number, largest count of unrequested bytes that may be read between
+        two ranges to merge them into a single read
+    Returns
+    -------
+    list of (offset, length, members) tuples sorted by offset, where members
+    lists the indexes into ranges that the merged range covers
+    """
+    order = sorted(range(len(ranges)), key=lambda i: ranges[i][0])
+    merged = []
+    for i in order:
+        offset, length = ranges[i]
+        if merged:
+            start, end, members = merged[-1]
+            if offset <= end + max_gap:
+                merged[-1] = (start, max(end, offset + length), members)
+                members.append(i)
+                continue
+        merged.append((offset, offset + length, [i]))
+
+    return [(start, end - start, members) for start, end, members in merged]
+
+
+def parse_content_range(value):
+    """Parse a Content-Range header of the form bytes start-stop/size.
+    Returns
+    -------
+    tuple: (start, stop, size), stop is inclusive and size is None when the
+    total size is not known, or None if the header is not a byte range
+    """
+    match = re.fullmatch(r'\s*bytes\s+(\d+)-(\d+)/(\d+|\*)\s*', value or '')
+    if match is None:
+        return None
+    size = match.group(3)
+    return (
+        int(match.group(1)),
+        int(match.group(2)),
+        None if size == '*' else int(size)
+    )
+
+
+def parse_byteranges(content_type, body):
+    """Split a multipart/byteranges response body into its parts.
+    Parameters
+    ----------
+    content_type:
+        the Content-Type header, with the boundary parameter
+    body:
+        the response body
+    Returns
+    -------
+    list of (offset, data) tuples, in the order of the body
+    """
+    match = re.search(r'boundary="?([^";]+)"?', content_type)
+    if match is None:
+        raise ValueError(f'No boundary in {content_type}')
+    delimiter = b'--' + match.group(1).encode('latin-1')
+
+    parts = []
+    pos = body.find(delimiter)
+    while pos != -1:
+        pos += len(delimiter)
+        if body[pos:pos + 2] == b'--':
+            # closing delimiter
+            break
+        headers_end = body.find(b'\r\n\r\n', pos)
+        if headers_end == -1:
+            raise ValueError('Truncated multipart/byteranges body')
+        content_range = None
+        for line in bytes(body[pos:headers_end]).split(b'\r\n'):
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.strip().lower() == 'content-range':
+                content_range = parse_content_range(value)
+        if content_range is None:
+            raise ValueError('multipart/byteranges part without a byte range')
+        start, stop, _ = content_range
+        data_start = headers_end + 4
+        data_end = data_start + stop - start + 1
+        if data_end > len(body):
+            raise ValueError('Truncated multipart/byteranges body')
+        parts.append((start, body[data_start:data_end]))
+        # the part data may contain the delimiter, so search after it
+        pos = body.find(delimiter, data_end)
+    return parts
+
+
+def slice_ranges(ranges, parts):
+    """Cut requested ranges out of the parts of a response.
+    Parameters
+    ----------
+    ranges:
+        sequence of (offset, length) tuples
+    parts:
+        sequence of (offset, data) tuples that were received
+    Returns
+    -------
+    list with the data of each range, or None for a range not fully
+    contained in one of the parts
+    """
+    results = []
+    for offset, length in ranges:
+        data = None
+        for start, part in parts:
+            if start <= offset and offset + length <= start + len(part):
+                data = part[offset - start:offset - start + length]
+                break
+        results.append(data)
+    return results
@@ -1,31 +1,233 @@
 """A utility to dump tiles directly from a tiff file in an S3 bucket."""
 
+import contextlib
+import math
 import os
 import logging
+import threading
+import time
 
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ConnectTimeoutError, ReadTimeoutError
 
-from cogdumper.cog_tiles import AbstractReader
+from cogdumper import hedging, metrics, pool
+from cogdumper.aio import AbstractAsyncReader
+from cogdumper.cog_tiles import AbstractReader, stream_chunk_size
+from cogdumper.errors import DeadlineExceededError
 
 logger = logging.getLogger(__name__)
 
 region = os.environ.get('AWS_REGION', 'us-east-1')
-s3 = boto3.resource('s3', region_name=region)
+
+# seconds left before a deadline are rounded up to one of these timeouts
+TIMEOUTS = (0.25, 0.5, 1, 2, 4, 8, 15, 30)
+
+_lock = threading.Lock()
+_client = None
+_timeout_clients = {}
+
+
+def get_client(timeout=None):
+    """The shared S3 client, created on first use.
+
+    Clients, unlike resources, are safe to share between threads. botocore
+    only takes timeouts per client, so requests bounded by a deadline use
+    one of a few shared clients with short timeouts, which do not retry.
+    Parameters
+    ----------
+    timeout:
+        Optional number, seconds a request may wait to connect or for data,
+        rounded up to the next of TIMEOUTS
+    """
+    global _client
+    with _lock:
+        if timeout is None:
+            if _client is None:
+                _client = boto3.client(
+                    's3',
+                    region_name=region,
+                    config=Config(max_pool_connections=pool.max_connections())
+                )
+            return _client
+        timeout = next((t for t in TIMEOUTS if t >= timeout), math.ceil(timeout))
+        client = _timeout_clients.get(timeout)
+        if client is None:
+            client = _timeout_clients[timeout] = boto3.client(
+                's3',
+                region_name=region,
+                config=Config(
+                    max_pool_connections=pool.max_connections(),
+                    connect_timeout=timeout,
+                    read_timeout=timeout,
+                    retries={'max_attempts': 0}
+                )
+            )
+        return client
+
+
+def _close_body(response):
+    response['Body'].close()
 
 
 class Reader(AbstractReader):
-    """Wraps the remote COG."""
+    """Wraps the remote COG.
+
+    Reads are hedged by the hedger, if any, and raise at the deadline of the
+    context, see cogdumper.hedging. Requests of the shared client time out
+    at the deadline, a client that is given is used as it is configured.
+    """
 
-    def __init__(self, bucket_name, key):
-        """Init reader object."""
+    backend = 's3'
+
+    def __init__(self, bucket_name, key, client=None, executor=None,
+                 hedger=None, deadline=None):
+        """Init reader object.
+        Parameters
+        ----------
+        bucket_name:
+            AWS S3 bucket
+        key:
+            AWS S3 key
+        client:
+            Optional boto3 S3 client, the shared client otherwise
+        executor:
+            Optional concurrent.futures.Executor for read_many, the shared
+            cogdumper.pool executor otherwise
+        hedger:
+            Optional cogdumper.hedging.Hedger duplicating slow reads
+        deadline:
+            Optional number, seconds each read may take before it raises
+            cogdumper.errors.DeadlineExceededError
+        """
         self.bucket = bucket_name
         self.key = key
-        self.source = s3.Object(self.bucket, self.key)
+        self.client = client or get_client()
+        self._shared_client = client is None
+        self.executor = executor
+        self.hedger = hedger
+        self.deadline = deadline
+
+    def stat(self):
+        """Object identity, loading the object metadata with a HEAD request."""
+        r = self.client.head_object(Bucket=self.bucket, Key=self.key)
+        return {
+            'url': f's3://{self.bucket}/{self.key}',
+            'etag': r['ETag'],
+            'mtime': r['LastModified'].isoformat(),
+            'size': r['ContentLength']
+        }
 
     def read(self, offset, length):
         """Read method."""
+        return hedging.call(self.hedger, self._read, offset, length,
+                            timeout=self.deadline)
+
+    def _read(self, offset, length):
         start = offset
         stop = offset + length - 1
         logger.info(f'Reading bytes: {start} to {stop}')
-        r = self.source.get(Range=f'bytes={start}-{stop}')
-        return r['Body'].read()
+        started = time.perf_counter()
+        body = self._get_object(start, stop)['Body']
+        with self._timeouts(start, stop):
+            data = body.read()
+        metrics.observe(self, offset, length, len(data), started)
+        return data
+
+    def _get_object(self, start, stop):
+        client = self.client
+        # a request that outlives its deadline is abandoned, not left to hang
+        timeout = hedging.remaining()
+        if timeout is not None and self._shared_client:
+            client = get_client(max(timeout, 0.001))
+        with self._timeouts(start, stop):
+            return client.get_object(
+                Bucket=self.bucket,
+                Key=self.key,
+                Range=f'bytes={start}-{stop}'
+            )
+
+    @contextlib.contextmanager
+    def _timeouts(self, start, stop):
+        """Raise DeadlineExceededError for requests that time out within a
+        deadline."""
+        try:
+            yield
+        except (ConnectTimeoutError, ReadTimeoutError):
+            if hedging.remaining() is None:
+                raise
+            raise DeadlineExceededError(f'S3 byte range {start}-{stop} '
+                                        f'deadline exceeded')
+
+    def stream(self, offset, length, chunk_size=None):
+        """Read a range as chunks, as they arrive."""
+        start = offset
+        stop = offset + length - 1
+        logger.info(f'Streaming bytes: {start} to {stop}')
+        started = time.perf_counter()
+        # the wait for the first byte is hedged, the body is not
+        r = hedging.call(self.hedger, self._get_object, start, stop,
+                         timeout=self.deadline, discard=_close_body)
+        body = r['Body']
+        nbytes = 0
+        try:
+            for chunk in body.iter_chunks(stream_chunk_size(chunk_size)):
+                nbytes += len(chunk)
+                yield chunk
+        finally:
+            body.close()
+        metrics.observe(self, offset, length, nbytes, started)
+
+    def read_many(self, ranges):
+        """Read (offset, length) ranges concurrently."""
+        return pool.read_many(self.read, ranges, self.executor)
+
+
+class AsyncReader(AbstractAsyncReader):
+    """Wraps the remote COG for asyncio, requires aiobotocore."""
+
+    def __init__(self, bucket_name, key, client=None):
+        """Init reader object.
+        Parameters
+        ----------
+        bucket_name:
+            AWS S3 bucket
+        key:
+            AWS S3 key
+        client:
+            Optional aiobotocore S3 client to share between readers, one is
+            created on first read otherwise
+        """
+        self.bucket = bucket_name
+        self.key = key
+        self._client = client
+        self._exit_stack = None
+
+    async def _get_client(self):
+        if self._client is None:
+            from aiobotocore.session import get_session
+            self._exit_stack = contextlib.AsyncExitStack()
+            self._client = await self._exit_stack.enter_async_context(
+                get_session().create_client('s3', region_name=region)
+            )
+        return self._client
+
+    async def read(self, offset, length):
+        """Read method."""
+        start = offset
+        stop = offset + length - 1
+        logger.info(f'Reading bytes: {start} to {stop}')
+        client = await self._get_client()
+        r = await client.get_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Range=f'bytes={start}-{stop}'
+        )
+        async with r['Body'] as stream:
+            return await stream.read()
+
+    async def close(self):
+        if self._exit_stack is not None:
+            await self._exit_stack.aclose()
+            self._exit_stack = None
+            self._client = None
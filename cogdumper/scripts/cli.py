@@ -1,14 +1,17 @@
-"""cli."""
+"""cli.
+
+Backends, and the server and export modules, are imported by the commands
+that use them, so that starting the CLI does not import boto3 or requests.
+"""
 import logging
-import mimetypes
+import sys
 
 import click
 
 from cogdumper import __version__ as cogdumper_version
+from cogdumper import metrics
 from cogdumper.cog_tiles import COGTiff
-from cogdumper.s3dumper import Reader as S3Reader
-from cogdumper.httpdumper import Reader as HTTPReader
-from cogdumper.filedumper import Reader as FileReader
+from cogdumper.segments import write_segments
 
 
 @click.group(short_help="Command line interface for COGDumper")
@@ -18,6 +21,20 @@ def cogdumper():
     pass
 
 
+def report_stats(registry):
+    """Print a summary of the reads recorded by a registry, if any."""
+    if registry is not None:
+        click.echo(metrics.format_summary(registry.snapshot()), err=True)
+
+
+def open_cog(reader, index_dir):
+    """Open a COG, through a sidecar index directory if one is given."""
+    if index_dir:
+        from cogdumper.index import IndexStore
+        return IndexStore(index_dir).open(reader)
+    return COGTiff(reader.read)
+
+
 @cogdumper.command(help='COGDumper cli for AWS S3 hosted dataset')
 @click.option('--bucket', required=True, help='AWS S3 bucket')
 @click.option('--key', required=True, help='AWS S3 key')
@@ -25,26 +42,32 @@ def cogdumper():
               help='local output directory')
 @click.option('--xyz', type=click.INT, default=[0, 0, 0], nargs=3,
               help='xyz tile coordinates where z is the overview level')
+@click.option('--index-dir', envvar='COG_INDEX_DIR', default=None,
+              type=click.Path(file_okay=False, writable=True),
+              help='directory of cached tile indexes')
+@click.option('--stats', is_flag=True, help='Print the requests, bytes and latency of reads')
 @click.option('--verbose', '-v', is_flag=True, help='Show logs')
 @click.version_option(version=cogdumper_version, message='%(version)s')
-def s3(bucket, key, output, xyz, verbose):
+def s3(bucket, key, output, xyz, index_dir, stats, verbose):
     """Read AWS S3 hosted dataset."""
     if verbose:
         logging.basicConfig(level=logging.INFO)
+    registry = metrics.enable() if stats else None
+
+    from cogdumper.export import tile_extension
+    from cogdumper.s3dumper import Reader as S3Reader
 
     reader = S3Reader(bucket, key)
-    cog = COGTiff(reader.read)
-    mime_type, tile = cog.get_tile(*xyz)
+    cog = open_cog(reader, index_dir)
+    mime_type, segments = cog.get_tile(*xyz, segments=True)
     if output is None:
-        ext = mimetypes.guess_extension(mime_type)
-        # work around a bug with mimetypes
-        if ext == '.jpe':
-            ext = '.jpg'
+        ext = tile_extension(mime_type)
 
         output = f's3_{xyz[0]}_{xyz[1]}_{xyz[2]}{ext}'
 
-    with open(output, 'wb') as dst:
-        dst.write(tile)
+    with open(output, 'wb', buffering=0) as dst:
+        write_segments(dst.fileno(), segments)
+    report_stats(registry)
 
 
 @cogdumper.command(help='COGDumper cli for web hosted dataset.')
@@ -55,26 +78,32 @@ def s3(bucket, key, output, xyz, verbose):
               help='local output directory')
 @click.option('--xyz', type=click.INT, default=[0, 0, 0], nargs=3,
               help='xyz tile coordinates where z is the overview level')
+@click.option('--index-dir', envvar='COG_INDEX_DIR', default=None,
+              type=click.Path(file_okay=False, writable=True),
+              help='directory of cached tile indexes')
+@click.option('--stats', is_flag=True, help='Print the requests, bytes and latency of reads')
 @click.option('--verbose', '-v', is_flag=True, help='Show logs')
 @click.version_option(version=cogdumper_version, message='%(version)s')
-def http(server, path, resource, output, xyz, verbose):
+def http(server, path, resource, output, xyz, index_dir, stats, verbose):
     """Read web hosted dataset."""
     if verbose:
         logging.basicConfig(level=logging.INFO)
+    registry = metrics.enable() if stats else None
+
+    from cogdumper.export import tile_extension
+    from cogdumper.httpdumper import Reader as HTTPReader
 
     reader = HTTPReader(server, path, resource)
-    cog = COGTiff(reader.read)
-    mime_type, tile = cog.get_tile(*xyz)
+    cog = open_cog(reader, index_dir)
+    mime_type, segments = cog.get_tile(*xyz, segments=True)
     if output is None:
-        ext = mimetypes.guess_extension(mime_type)
-        # work around a bug with mimetypes
-        if ext == '.jpe':
-            ext = '.jpg'
+        ext = tile_extension(mime_type)
 
         output = f'http_{xyz[0]}_{xyz[1]}_{xyz[2]}{ext}'
 
-    with open(output, 'wb') as dst:
-        dst.write(tile)
+    with open(output, 'wb', buffering=0) as dst:
+        write_segments(dst.fileno(), segments)
+    report_stats(registry)
 
 
 @cogdumper.command(help='COGDumper cli for local dataset.')
@@ -83,24 +112,202 @@ def http(server, path, resource, output, xyz, verbose):
               help='local output directory')
 @click.option('--xyz', type=click.INT, default=[0, 0, 0], nargs=3,
               help='xyz tile coordinate where z is the overview level')
+@click.option('--index-dir', envvar='COG_INDEX_DIR', default=None,
+              type=click.Path(file_okay=False, writable=True),
+              help='directory of cached tile indexes')
+@click.option('--stats', is_flag=True, help='Print the requests, bytes and latency of reads')
 @click.option('--verbose', '-v', is_flag=True, help='Show logs')
 @click.version_option(version=cogdumper_version, message='%(version)s')
-def file(file, output, xyz, verbose):
+def file(file, output, xyz, index_dir, stats, verbose):
     """Read local dataset."""
     if verbose:
         logging.basicConfig(level=logging.INFO)
+    registry = metrics.enable() if stats else None
+
+    from cogdumper.export import tile_extension
+    from cogdumper.filedumper import Reader as FileReader
 
     with open(file, 'rb') as src:
         reader = FileReader(src)
-        cog = COGTiff(reader.read)
-        mime_type, tile = cog.get_tile(*xyz)
+        cog = open_cog(reader, index_dir)
+        mime_type, segments = cog.get_tile(*xyz, segments=True)
         if output is None:
-            ext = mimetypes.guess_extension(mime_type)
-            # work around a bug with mimetypes
-            if ext == '.jpe':
-                ext = '.jpg'
+            ext = tile_extension(mime_type)
 
             output = f'file_{xyz[0]}_{xyz[1]}_{xyz[2]}{ext}'
 
-        with open(output, 'wb') as dst:
-            dst.write(tile)
+        with open(output, 'wb', buffering=0) as dst:
+            write_segments(dst.fileno(), segments)
+    report_stats(registry)
+
+
+@cogdumper.command(help='Serve tiles of datasets over HTTP.')
+@click.option('--dataset', 'datasets', required=True, multiple=True,
+              help='NAME=URL where URL is s3://bucket/key, http(s)://... or a local path')
+@click.option('--host', default='127.0.0.1', help='address to bind')
+@click.option('--port', default=8080, type=click.INT, help='port to bind')
+@click.option('--workers', default=16, type=click.INT,
+              help='number of tiles read and sent concurrently')
+@click.option('--max-connections', default=256, type=click.INT,
+              help='number of client connections kept open, more are refused with 503')
+@click.option('--deadline', default=None, type=click.FLOAT,
+              help='seconds a tile may take to read before a 504, unbounded by default')
+@click.option('--max-open', default=None, type=click.INT,
+              help='number of datasets kept open, unlimited by default')
+@click.option('--max-bytes', envvar='COG_CATALOG_MAX_BYTES', default=None, type=click.INT,
+              help='memory budget in bytes of the open datasets\' headers, 256 MB by default')
+@click.option('--index-dir', envvar='COG_INDEX_DIR', default=None,
+              type=click.Path(file_okay=False, writable=True),
+              help='directory of cached tile indexes')
+@click.option('--stats', is_flag=True, help='Print the requests, bytes and latency of reads')
+@click.option('--verbose', '-v', is_flag=True, help='Show logs')
+@click.version_option(version=cogdumper_version, message='%(version)s')
+def serve(datasets, host, port, workers, max_connections, deadline, max_open, max_bytes,
+          index_dir, stats, verbose):
+    """Serve tiles at /{dataset}/{z}/{x}/{y}."""
+    if verbose:
+        logging.basicConfig(level=logging.INFO)
+    registry = metrics.enable() if stats else None
+
+    from cogdumper.catalog import Catalog
+    from cogdumper.index import IndexStore
+    from cogdumper.server import TileServer
+
+    sources = {}
+    for dataset in datasets:
+        name, sep, url = dataset.partition('=')
+        if not sep or not name or not url:
+            raise click.BadParameter(f'{dataset} is not NAME=URL',
+                                     param_hint='--dataset')
+        sources[name] = url
+
+    index_store = IndexStore(index_dir) if index_dir else None
+    catalog = Catalog(sources, max_bytes=max_bytes, max_open=max_open,
+                      index_store=index_store)
+    server = TileServer((host, port), catalog, workers=workers,
+                        max_connections=max_connections, deadline=deadline)
+    click.echo(f'Serving {", ".join(sources)} on http://{host}:{server.server_port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        report_stats(registry)
+
+
+@cogdumper.command(help='Export the tiles of a dataset to a directory or MBTiles file.')
+@click.argument('source')
+@click.argument('output', type=click.Path(writable=True))
+@click.option('--level', 'levels', type=click.INT, multiple=True,
+              help='overview level to export, may be repeated, all levels by default')
+@click.option('--bbox', type=click.INT, nargs=4, default=None,
+              help='xmin ymin xmax ymax in pixels of the full resolution image')
+@click.option('--workers', default=8, type=click.INT, help='number of reading threads')
+@click.option('--index-dir', envvar='COG_INDEX_DIR', default=None,
+              type=click.Path(file_okay=False, writable=True),
+              help='directory of cached tile indexes')
+@click.option('--stats', is_flag=True, help='Print the requests, bytes and latency of reads')
+@click.option('--verbose', '-v', is_flag=True, help='Show logs')
+@click.version_option(version=cogdumper_version, message='%(version)s')
+def export(source, output, levels, bbox, workers, index_dir, stats, verbose):
+    """Export tiles to OUTPUT, an MBTiles file if it ends in .mbtiles or a z/x/y directory tree."""
+    if verbose:
+        logging.basicConfig(level=logging.INFO)
+    registry = metrics.enable() if stats else None
+
+    from cogdumper.export import DirectoryWriter, MBTilesWriter, export_tiles
+    from cogdumper.sources import open_reader
+
+    reader = open_reader(source)
+    cog = open_cog(reader, index_dir)
+    if output.endswith('.mbtiles'):
+        writer = MBTilesWriter(output)
+    else:
+        writer = DirectoryWriter(output)
+    result = export_tiles(cog, writer, levels=levels or None, bbox=bbox or None,
+                          workers=workers)
+    click.echo(f'{result["tiles"]} tiles, {result["bytes"]} bytes '
+               f'in {result["seconds"]:.1f}s')
+    report_stats(registry)
+
+
+@cogdumper.command(help='Read many tiles listed on stdin.')
+@click.argument('source')
+@click.option('--output', default=None, type=click.Path(file_okay=False, writable=True),
+              help='write tiles to a z/x/y directory tree instead of frames on stdout')
+@click.option('--workers', default=8, type=click.INT, help='number of reading threads')
+@click.option('--queue-size', default=64, type=click.INT,
+              help='number of tiles read ahead of the output')
+@click.option('--index-dir', envvar='COG_INDEX_DIR', default=None,
+              type=click.Path(file_okay=False, writable=True),
+              help='directory of cached tile indexes')
+@click.option('--stats', is_flag=True, help='Print the requests, bytes and latency of reads')
+@click.option('--verbose', '-v', is_flag=True, help='Show logs')
+@click.version_option(version=cogdumper_version, message='%(version)s')
+def batch(source, output, workers, queue_size, index_dir, stats, verbose):
+    """Read the tiles listed on stdin, one "x y z" or JSON line each.
+
+    Tiles are written in order to OUTPUT, or to stdout as frames of the
+    x, y and z as uint32, the mime type length as uint16 and mime type, and
+    the tile length as uint64 and tile, in network byte order.
+    """
+    if verbose:
+        logging.basicConfig(level=logging.INFO)
+    registry = metrics.enable() if stats else None
+
+    from cogdumper.batch import FrameWriter, parse_tiles, run_batch
+    from cogdumper.export import DirectoryWriter
+    from cogdumper.sources import open_reader
+
+    reader = open_reader(source)
+    cog = open_cog(reader, index_dir)
+    if output is None:
+        writer = FrameWriter(sys.stdout.buffer)
+    else:
+        writer = DirectoryWriter(output)
+    result = run_batch(cog, parse_tiles(sys.stdin), writer,
+                       workers=workers, queue_size=queue_size)
+    click.echo(f'{result["tiles"]} tiles, {result["bytes"]} bytes, '
+               f'{result["errors"]} errors in {result["seconds"]:.1f}s', err=True)
+    report_stats(registry)
+    if result['errors']:
+        raise SystemExit(1)
+
+
+@cogdumper.command(help='Extract the tiles of many datasets listed in a manifest.')
+@click.argument('manifest', type=click.File('r'))
+@click.argument('output', type=click.Path(file_okay=False, writable=True))
+@click.option('--processes', default=None, type=click.INT,
+              help='number of worker processes, the number of CPUs by default')
+@click.option('--threads', default=8, type=click.INT,
+              help='number of datasets each process reads at once')
+@click.option('--chunk-size', default=8, type=click.INT,
+              help='number of datasets sent to a process at a time')
+@click.option('--index-dir', envvar='COG_INDEX_DIR', default=None,
+              type=click.Path(file_okay=False, writable=True),
+              help='directory of cached tile indexes')
+@click.option('--verbose', '-v', is_flag=True, help='Show logs')
+@click.version_option(version=cogdumper_version, message='%(version)s')
+def extract(manifest, output, processes, threads, chunk_size, index_dir, verbose):
+    """Extract the tiles listed in MANIFEST, or - for stdin, to OUTPUT.
+
+    Each line is "source x y z", "source,x,y,z" or JSON with source, x, y
+    and z, the tiles of a source are written to OUTPUT/{source path}/{z}/{x}/{y}.
+    """
+    if verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    from cogdumper.manifest import ProgressReporter, extract_manifest, read_manifest
+
+    try:
+        groups = read_manifest(manifest)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    reporter = ProgressReporter(len(groups), lambda line: click.echo(line, err=True))
+    result = extract_manifest(groups, output, processes=processes, threads=threads,
+                              chunk_size=chunk_size, index_dir=index_dir,
+                              progress=reporter)
+    reporter(result, final=True)
+    if result['errors']:
+        raise SystemExit(1)
@@ -0,0 +1,54 @@
+"""Vectored output of tiles held as several buffer segments.
+
+A JPEG tile with its tables inserted and its mask appended is made of up to
+four buffers. Writing them with one writev or sendmsg call avoids joining
+them into a new bytes object first.
+"""
+
+import os
+
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):  # pragma: no cover
+    IOV_MAX = 16
+
+
+def _views(segments):
+    return [memoryview(s).cast('B') for s in segments if len(s)]
+
+
+def _advance(views, count):
+    """Drop count bytes from the front of a list of views."""
+    while views and count >= len(views[0]):
+        count -= len(views.pop(0))
+    if count:
+        views[0] = views[0][count:]
+    return views
+
+
+def nbytes(segments):
+    """Total size of segments."""
+    return sum(memoryview(s).nbytes for s in segments)
+
+
+def write_segments(fd, segments):
+    """Write all segments to a file descriptor, with os.writev where available."""
+    views = _views(segments)
+    if not hasattr(os, 'writev'):  # pragma: no cover
+        for view in views:
+            while view:
+                view = view[os.write(fd, view):]
+        return
+    while views:
+        views = _advance(views, os.writev(fd, views[:IOV_MAX]))
+
+
+def send_segments(sock, segments):
+    """Send all segments on a socket, with sendmsg where available."""
+    views = _views(segments)
+    if not hasattr(sock, 'sendmsg'):  # pragma: no cover
+        for view in views:
+            sock.sendall(view)
+        return
+    while views:
+        views = _advance(views, sock.sendmsg(views[:IOV_MAX]))
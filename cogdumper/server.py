@@ -0,0 +1,224 @@
+"""A long running HTTP tile server."""
+
+import contextlib
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cogdumper import hedging, metrics
+from cogdumper.errors import DeadlineExceededError, TIFFError, TileNotFoundError
+from cogdumper.segments import nbytes, send_segments
+
+logger = logging.getLogger(__name__)
+
+
+def stream_threshold():
+    """Tiles of at least this size are streamed, COG_STREAM_MIN_BYTES or 1 MB."""
+    return int(os.environ.get('COG_STREAM_MIN_BYTES', str(1024 * 1024)))
+
+
+TILE_PATH = re.compile(r'^/(?P<dataset>[^/]+)/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)(\.\w+)?$')
+
+
+class TileRequestHandler(BaseHTTPRequestHandler):
+    """Serves GET /{dataset}/{z}/{x}/{y} with the raw tile data.
+
+    Sparse tiles are answered with 204 No Content.
+
+    GET /_stats returns a cogdumper.metrics snapshot as JSON when metrics
+    are enabled.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, do not hold the body back
+    disable_nagle_algorithm = True
+    # idle keep-alive connections are closed after this
+    timeout = 5
+
+    def log_message(self, format, *args):
+        logger.info(format % args)
+
+    def _send(self, status, body, content_type='text/plain', headers=None):
+        self._send_segments(status, [body], content_type, headers=headers)
+
+    def _send_segments(self, status, segments, content_type, size=None, headers=None):
+        """Send a response whose body is the concatenation of segments.
+
+        segments may be an iterator when size is given, each segment is
+        then sent as it arrives.
+        """
+        if size is None:
+            size = nbytes(segments)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(size))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        if isinstance(segments, list):
+            # the tile is sent straight from the buffers it was read into
+            send_segments(self.connection, segments)
+            sent = nbytes(segments)
+        else:
+            sent = self._send_chunks(segments)
+        if sent != size:
+            # the client can only tell from the connection closing early
+            logger.error(f'Sent {sent} of {size} bytes of {self.path}')
+            self.close_connection = True
+
+    def _send_chunks(self, segments):
+        """Send segments as they arrive, the number of bytes sent."""
+        sent = 0
+        try:
+            for segment in segments:
+                send_segments(self.connection, [segment])
+                sent += len(segment)
+        except Exception as e:
+            # the status is sent, the read may still fail
+            logger.error(f'Failed to stream {self.path}: {getattr(e, "message", e)}')
+        return sent
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        registry = metrics.active()
+        if path == '/_stats' and registry is not None:
+            body = json.dumps(registry.snapshot()).encode('utf-8')
+            self._send(200, body, 'application/json')
+            return
+        match = TILE_PATH.match(path)
+        if match is None:
+            self._send(404, b'Not found')
+            return
+        catalog = self.server.catalog
+        dataset = match.group('dataset')
+        try:
+            catalog.url(dataset)
+        except KeyError:
+            self._send(404, b'Unknown dataset')
+            return
+        # the reader is not closed until the tile has been sent
+        with self.server.worker(), contextlib.ExitStack() as stack:
+            try:
+                cog = stack.enter_context(catalog.open(dataset))
+                mime_type, size, chunks = self._read_tile(cog, match)
+            except Exception as e:
+                self._send_failure(e)
+                return
+            if size == 0:
+                self._send_empty()
+                return
+            self._send_segments(200, chunks, mime_type, size)
+
+    def _send_empty(self):
+        """204 for a sparse tile, an empty body is not a valid image."""
+        self.send_response(204)
+        self.end_headers()
+
+    def _read_tile(self, cog, match):
+        mime_type, size, chunks = cog.stream_tile(
+            int(match.group('x')),
+            int(match.group('y')),
+            int(match.group('z'))
+        )
+        # reads are bounded by the deadline up to the first chunk, which is
+        # read before the status is sent so that a late tile gets a 504
+        with hedging.deadline(self.server.deadline):
+            if size < self.server.stream_min_bytes:
+                # small tiles are read whole, to be sent with one call, and
+                # answered with 502 if the read came up short
+                chunks = list(chunks)
+                if nbytes(chunks) != size:
+                    raise TIFFError(f'Read {nbytes(chunks)} of {size} bytes of the tile')
+            else:
+                first = next(chunks, None)
+                if first is not None:
+                    chunks = itertools.chain([first], chunks)
+        if '/' not in mime_type:
+            # compression that is not a media type, e.g. deflate
+            mime_type = 'application/octet-stream'
+        return mime_type, size, chunks
+
+    def _send_failure(self, e):
+        """404 for tiles outside of the image, 504 for reads past their
+        deadline and 502 for sources that cannot be read."""
+        message = getattr(e, 'message', None) or str(e)
+        if isinstance(e, TileNotFoundError):
+            self._send(404, message.encode('utf-8'))
+            return
+        status = 504 if isinstance(e, DeadlineExceededError) else 502
+        logger.error(f'{self.path}: {message}')
+        # the failure is not a property of the tile, do not let it be cached
+        self._send(status, message.encode('utf-8'), headers={'Cache-Control': 'no-store'})
+
+    do_HEAD = do_GET
+
+
+class TileServer(ThreadingHTTPServer):
+    """HTTP server with a thread per connection and a bounded number of
+    requests handled at once."""
+
+    daemon_threads = True
+
+    def __init__(self, address, catalog, workers=16, stream_min_bytes=None,
+                 max_connections=256, deadline=None):
+        """Init server.
+        Parameters
+        ----------
+        address:
+            (host, port) tuple
+        catalog:
+            cogdumper.catalog.Catalog serving the datasets
+        workers:
+            number, tiles read and sent concurrently, idle keep-alive
+            connections do not hold a worker
+        stream_min_bytes:
+            number, tiles of at least this size are forwarded as they are
+            read instead of being read whole, defaults to
+            COG_STREAM_MIN_BYTES or 1 MB
+        max_connections:
+            number, connections kept open at once, more are answered with
+            503 and closed
+        deadline:
+            Optional number, seconds a tile may take to read, up to its
+            first chunk for streamed tiles, answered with 504 past it, see
+            cogdumper.hedging
+        """
+        super().__init__(address, TileRequestHandler)
+        self.catalog = catalog
+        if stream_min_bytes is None:
+            stream_min_bytes = stream_threshold()
+        self.stream_min_bytes = stream_min_bytes
+        self.deadline = deadline
+        self._workers = threading.BoundedSemaphore(workers)
+        self._connections = threading.BoundedSemaphore(max_connections)
+
+    def worker(self):
+        """Context manager holding one of the workers."""
+        return self._workers
+
+    def process_request(self, request, client_address):
+        if not self._connections.acquire(blocking=False):
+            try:
+                request.sendall(b'HTTP/1.1 503 Service Unavailable\r\n'
+                                b'Content-Length: 0\r\nConnection: close\r\n\r\n')
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        super().process_request(request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self._connections.release()
+
+    def server_close(self):
+        super().server_close()
+        self.catalog.close()
@@ -0,0 +1,60 @@
+"""Readers for source URLs.
+
+Readers of the same backend share their connections: HTTP readers share one
+requests session and S3 readers the client of cogdumper.s3dumper.get_client.
+"""
+
+import os
+import threading
+from urllib.parse import urlparse
+
+from cogdumper.hedging import backend_hedger
+
+_lock = threading.Lock()
+_http_session = None
+
+
+def http_session():
+    """The session shared by HTTP readers, created on first use."""
+    global _http_session
+    with _lock:
+        if _http_session is None:
+            from cogdumper.httpdumper import create_session
+            _http_session = create_session()
+        return _http_session
+
+
+def open_reader(url):
+    """Create a reader for a source URL.
+    Parameters
+    ----------
+    url:
+        s3://bucket/key, http(s)://server/path/resource, or a local path
+        with or without the file:// scheme
+    Returns
+    -------
+    A reader that implements the cogdumper.cog_tiles.AbstractReader methods,
+    local files are memory mapped, remote reads are hedged when
+    COG_HEDGE=YES, see cogdumper.hedging
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == 's3':
+        from cogdumper.s3dumper import Reader as S3Reader
+        return S3Reader(parsed.netloc, parsed.path.lstrip('/'),
+                        hedger=backend_hedger('s3'))
+    elif parsed.scheme in ('http', 'https'):
+        from cogdumper.httpdumper import Reader as HTTPReader
+        path, _, resource = parsed.path.strip('/').rpartition('/')
+        return HTTPReader(
+            f'{parsed.scheme}://{parsed.netloc}',
+            path or None,
+            resource,
+            session=http_session(),
+            hedger=backend_hedger('http')
+        )
+    elif parsed.scheme in ('', 'file'):
+        from cogdumper.filedumper import MMapReader
+        path = parsed.path if parsed.scheme else url
+        return MMapReader.open(os.path.expanduser(path))
+    else:
+        raise ValueError(f'Unsupported source {url}')
@@ -12,6 +12,15 @@ tags = {
     347: 'JPEGTables'
 }
 
+# tags describing the pixel layout of tiles, kept apart from tags for decoding
+layout = {
+    258: 'bits_per_sample',
+    277: 'samples_per_pixel',
+    284: 'planar_configuration',
+    317: 'predictor',
+    339: 'sample_format'
+}
+
 compression = {
     6: 'image/jpeg',
     7: 'image/jpeg',
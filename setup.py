@@ -11,7 +11,11 @@ with open('cogdumper/__init__.py') as f:
             continue
 
 inst_reqs = ['boto3>=1.6.2', 'click>=6.7', 'requests>=2.18.4']
-extra_reqs = {'test': ['pytest', 'pytest-cov', 'codecov']}
+extra_reqs = {
+    'test': ['pytest', 'pytest-cov', 'codecov'],
+    'async': ['aiohttp', 'aiobotocore'],
+    'decode': ['numpy', 'Pillow']
+}
 
 setup(
     name='cogdumper',
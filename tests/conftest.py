@@ -0,0 +1,14 @@
+"""Shared test fixtures, the helpers they use are in tests/synthetic.py."""
+
+import pytest
+
+from synthetic import serve_files
+
+
+@pytest.fixture
+def http_server():
+    """Local HTTP server, see synthetic.serve_files."""
+    server = serve_files()
+    yield server
+    server.shutdown()
+    server.server_close()
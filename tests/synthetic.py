@@ -0,0 +1,445 @@
+"""Synthetic COGs and local stand-ins for remote backends.
+
+Test helpers, also used by benchmarks/run.py, to exercise the readers
+without network access or fixture files.
+"""
+
+import io
+import random
+import re
+import struct
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def tile_payload(x, y, z, size=64):
+    """Deterministic, distinguishable payload for a tile."""
+    stamp = f'{x},{y},{z};'.encode('ascii')
+    return (stamp * (size // len(stamp) + 1))[:size + x + y]
+
+
+def overview_levels(width, height, overviews):
+    """Image sizes of a full resolution image and its overviews.
+    Parameters
+    ----------
+    width, height:
+        numbers, size of the full resolution image
+    overviews:
+        number of overviews, each half the size of the previous level
+    Returns
+    -------
+    tuple of (width, height) tuples, as taken by make_cog
+    """
+    levels = [(width, height)]
+    for _ in range(overviews):
+        width, height = max(1, -(-width // 2)), max(1, -(-height // 2))
+        levels.append((width, height))
+    return tuple(levels)
+
+
+def make_cog(levels=((512, 512), (256, 256)), tile_size=256, endian='<',
+             bigtiff=False, compression=1, empty=(), tile_bytes=64, ghost=False,
+             tags=None, tile_data=None):
+    """Build a tiled (Big)TIFF laid out as a COG.
+
+    The IFDs and their out of line tag values come first, followed by the
+    tile data of the last overview through to the full resolution image,
+    tiles in row major order. Tiles hold tile_payload rather than image
+    data, unless tile_data is given.
+    Parameters
+    ----------
+    levels:
+        sequence of (width, height) of each level, see overview_levels
+    tile_size:
+        number, width and height of the tiles in pixels
+    endian:
+        '<' for a little endian (II) file, '>' for big endian (MM)
+    bigtiff:
+        bool, write a BigTIFF
+    compression:
+        number, TIFF compression code of the levels, or a sequence of
+        codes per level, e.g. 7 (JPEG) for the image levels and 8
+        (deflate) for their masks
+    empty:
+        sequence of (x, y, z) of sparse tiles, with an offset and byte
+        count of 0
+    tile_bytes:
+        number, approximate size of each tile payload
+    ghost:
+        bool, write the GDAL structural metadata after the file header and
+        lay tiles out as GDAL does, each with a size leader and a trailer
+        repeating its last 4 bytes, and the tiles of a deflate level that
+        follows a level of another compression, its mask, interleaved with
+        that level's tiles
+    tags:
+        Optional dict of tag code to (TIFF type, values) added to each
+        level, e.g. {317: (3, [2])} for the horizontal predictor, or a
+        sequence of such dicts per level
+    tile_data:
+        Optional callable taking (x, y, z) and returning the data of a tile
+    Returns
+    -------
+    bytes
+    """
+    if bigtiff:
+        header_size, count_fmt, entry_size, value_fmt, value_size = 16, 'Q', 20, 'Q', 8
+        offset_type, offset_fmt = 16, 'Q'
+    else:
+        header_size, count_fmt, entry_size, value_fmt, value_size = 8, 'H', 12, 'L', 4
+        offset_type, offset_fmt = 4, 'L'
+    count_size = struct.calcsize(f'<{count_fmt}')
+    if isinstance(compression, int):
+        compression = [compression] * len(levels)
+    compressions = list(compression)
+    if tags is None or isinstance(tags, dict):
+        tags = [tags or {}] * len(levels)
+    value_formats = {1: 'B', 3: 'H', 4: 'L', 16: 'Q'}
+    extra_tags = [
+        [(code, dtype, struct.pack(f'{endian}{len(values)}{value_formats[dtype]}', *values),
+          len(values))
+         for code, (dtype, values) in sorted(level_tags.items())]
+        for level_tags in tags
+    ]
+    if tile_data is None:
+        def tile_data(x, y, z):
+            return tile_payload(x, y, z, tile_bytes)
+
+    payloads = []
+    for z, (width, height) in enumerate(levels):
+        nx = -(-width // tile_size)
+        ny = -(-height // tile_size)
+        payloads.append(
+            [b'' if (x, y, z) in empty else tile_data(x, y, z)
+             for y in range(ny) for x in range(nx)]
+        )
+
+    masks = {}
+    ghost_area = b''
+    if ghost:
+        # image level to its mask level
+        masks = {
+            z - 1: z for z in range(1, len(levels))
+            if compressions[z] == 8 and compressions[z - 1] != 8
+        }
+        metadata = (
+            'LAYOUT=IFDS_BEFORE_DATA\n'
+            'BLOCK_ORDER=ROW_MAJOR\n'
+            'BLOCK_LEADER=SIZE_AS_UINT4\n'
+            'BLOCK_TRAILER=LAST_4_BYTES_REPEATED\n'
+            'KNOWN_INCOMPATIBLE_EDITION=NO\n'
+        )
+        if masks:
+            metadata += 'MASK_INTERLEAVED_WITH_IMAGERY=YES\n'
+        metadata += ' '
+        ghost_area = (
+            f'GDAL_STRUCTURAL_METADATA_SIZE={len(metadata):06d} bytes\n{metadata}'
+        ).encode('ascii')
+    margin = 4 if ghost else 0
+
+    def block(tile):
+        if not ghost or not tile:
+            return tile
+        return struct.pack('<I', len(tile)) + tile + tile[-4:]
+
+    # tile data in file order, as (level, tile index), masks follow their image
+    order = []
+    for z in reversed(range(len(levels))):
+        if z in masks.values():
+            continue
+        for i in range(len(payloads[z])):
+            order.append((z, i))
+            if z in masks:
+                order.append((masks[z], i))
+
+    # size of each IFD including its out of line arrays and values
+    ifd_sizes = []
+    for tiles, extra in zip(payloads, extra_tags):
+        array_size = len(tiles) * struct.calcsize(f'<{offset_fmt}')
+        out_of_line = array_size if array_size > value_size else 0
+        out_of_line_values = sum(len(v) for _, _, v, _ in extra if len(v) > value_size)
+        ifd_sizes.append(
+            count_size + (7 + len(extra)) * entry_size + value_size +
+            2 * out_of_line + out_of_line_values
+        )
+
+    ifd_offsets = []
+    pos = header_size + len(ghost_area)
+    for size in ifd_sizes:
+        ifd_offsets.append(pos)
+        pos += size
+
+    tile_offsets = [[0] * len(tiles) for tiles in payloads]
+    for z, i in order:
+        tile = payloads[z][i]
+        if tile:
+            tile_offsets[z][i] = pos + margin
+            pos += len(block(tile))
+
+    out = bytearray()
+    if bigtiff:
+        out += (b'II' if endian == '<' else b'MM')
+        out += struct.pack(f'{endian}HHHQ', 43, 8, 0, ifd_offsets[0])
+    else:
+        out += (b'II' if endian == '<' else b'MM')
+        out += struct.pack(f'{endian}HL', 42, ifd_offsets[0])
+    out += ghost_area
+
+    for z, (width, height) in enumerate(levels):
+        start = ifd_offsets[z]
+        assert len(out) == start
+        n = len(payloads[z])
+        array_fmt = f'{endian}{n}{offset_fmt}'
+        arrays = [
+            struct.pack(array_fmt, *tile_offsets[z]),
+            struct.pack(array_fmt, *[len(t) for t in payloads[z]])
+        ]
+        inline = len(arrays[0]) <= value_size
+        num_tags = 7 + len(extra_tags[z])
+        array_pos = start + count_size + num_tags * entry_size + value_size
+        values_pos = array_pos + (0 if inline else 2 * len(arrays[0]))
+
+        def entry(code, dtype, count, value):
+            if isinstance(value, bytes):
+                value = value.ljust(value_size, b'\0')
+            else:
+                value = struct.pack(f'{endian}{value_fmt}', value)
+            return struct.pack(f'{endian}HH{value_fmt}', code, dtype, count) + value
+
+        entries = {
+            256: entry(256, 4, 1, struct.pack(f'{endian}L', width)),
+            257: entry(257, 4, 1, struct.pack(f'{endian}L', height)),
+            259: entry(259, 3, 1, struct.pack(f'{endian}H', compressions[z])),
+            322: entry(322, 3, 1, struct.pack(f'{endian}H', tile_size)),
+            323: entry(323, 3, 1, struct.pack(f'{endian}H', tile_size)),
+        }
+        for i, (code, array) in enumerate(zip((324, 325), arrays)):
+            if inline:
+                entries[code] = entry(code, offset_type, n, array)
+            else:
+                entries[code] = entry(code, offset_type, n, array_pos + i * len(array))
+        values = []
+        for code, dtype, value, count in extra_tags[z]:
+            if len(value) <= value_size:
+                entries[code] = entry(code, dtype, count, value)
+            else:
+                entries[code] = entry(code, dtype, count, values_pos)
+                values.append(value)
+                values_pos += len(value)
+
+        next_offset = ifd_offsets[z + 1] if z + 1 < len(levels) else 0
+        out += struct.pack(f'{endian}{count_fmt}', num_tags)
+        # entries are sorted by tag code
+        out += b''.join(entries[code] for code in sorted(entries))
+        out += struct.pack(f'{endian}{value_fmt}', next_offset)
+        if not inline:
+            out += b''.join(arrays)
+        out += b''.join(values)
+
+    for z, i in order:
+        out += block(payloads[z][i])
+
+    return bytes(out)
+
+
+class BytesReader:
+    """In memory reader that records every read."""
+
+    def __init__(self, data):
+        self.data = data
+        self.reads = []
+
+    def read(self, offset, length):
+        self.reads.append((offset, length))
+        return self.data[offset:offset + length]
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    """Serves the server's files with byte range support.
+
+    See serve_files for the server attributes it uses.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, do not hold the body back
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _resource(self):
+        data = self.server.files.get(self.path)
+        if data is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        return data
+
+    def do_HEAD(self):
+        time.sleep(_delay(self.server.latency))
+        data = self._resource()
+        if data is not None:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.send_header('ETag', f'"{hash(data)}"')
+            self.end_headers()
+
+    def do_GET(self):
+        time.sleep(_delay(self.server.latency))
+        self.server.requests.append((self.path, self.headers.get('Range')))
+        data = self._resource()
+        if data is None:
+            return
+        match = re.fullmatch(r'bytes=(\d+-\d+(,\d+-\d+)*)', self.headers.get('Range', ''))
+        whole = self.server.range_mode == 'none' or (
+            self.server.range_mode == 'whole' and match is not None and ',' in match.group(1))
+        if match is None or whole:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        ranges = []
+        for spec in match.group(1).split(','):
+            start, stop = spec.split('-')
+            ranges.append((int(start), min(int(stop), len(data) - 1)))
+        if len(ranges) == 1 or self.server.range_mode == 'single':
+            start, stop = ranges[0]
+            body = data[start:stop + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{stop}/{len(data)}')
+        else:
+            boundary = 'RANGE_BOUNDARY'
+            body = b''
+            for start, stop in ranges:
+                body += (
+                    f'--{boundary}\r\n'
+                    'Content-Type: application/octet-stream\r\n'
+                    f'Content-Range: bytes {start}-{stop}/{len(data)}\r\n\r\n'
+                ).encode('ascii')
+                body += data[start:stop + 1] + b'\r\n'
+            body += f'--{boundary}--\r\n'.encode('ascii')
+            self.send_response(206)
+            self.send_header('Content-Type', f'multipart/byteranges; boundary={boundary}')
+        self.send_header('ETag', f'"{hash(data)}"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _delay(latency):
+    return latency() if callable(latency) else latency
+
+
+def stragglers(latency, slow, fraction, seed=None):
+    """A random latency for serve_files or FakeS3Client.
+    Parameters
+    ----------
+    latency:
+        number, seconds most requests are delayed by
+    slow:
+        number, seconds stragglers are delayed by
+    fraction:
+        number, share of requests that are stragglers
+    seed:
+        Optional seed of the random choices
+    """
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    def delay():
+        with lock:
+            straggler = rng.random() < fraction
+        return slow if straggler else latency
+
+    return delay
+
+
+def serve_files(files=None, latency=0):
+    """Start a local HTTP server for files, in a daemon thread.
+
+    The server serves single and multi-range requests, records each GET as
+    (path, Range header) in its requests list and has a url attribute. Set
+    its range_mode to 'single' to serve only the first of several ranges,
+    to 'whole' to answer several ranges with the whole file, as S3 does,
+    or to 'none' to ignore Range headers. Stop it with shutdown and
+    server_close.
+    Parameters
+    ----------
+    files:
+        Optional dict of path, e.g. '/data/cog.tif', to bytes, more can be
+        added to the server's files attribute
+    latency:
+        number, seconds each request is delayed by, or a callable returning
+        the delay of each request, e.g. to inject random stragglers
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RangeRequestHandler)
+    server.daemon_threads = True
+    server.files = dict(files or {})
+    server.latency = latency
+    server.range_mode = 'multi'
+    server.requests = []
+    server.url = f'http://127.0.0.1:{server.server_address[1]}'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+class _Body(io.BytesIO):
+    """Stand-in for a botocore StreamingBody."""
+
+    def iter_chunks(self, chunk_size=1024):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+class FakeS3Client:
+    """In memory stand-in for the boto3 S3 client methods the readers use.
+
+    Pass it as the client of cogdumper.s3dumper.Reader.
+    """
+
+    def __init__(self, objects=None, latency=0):
+        """Init client.
+        Parameters
+        ----------
+        objects:
+            Optional dict of (bucket, key) to bytes
+        latency:
+            number, seconds each request is delayed by, or a callable, see
+            serve_files
+        """
+        self.objects = dict(objects or {})
+        self.latency = latency
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def _object(self, Bucket, Key):
+        time.sleep(_delay(self.latency))
+        try:
+            return self.objects[(Bucket, Key)]
+        except KeyError:
+            raise KeyError(f'No such key s3://{Bucket}/{Key}')
+
+    def head_object(self, Bucket, Key):
+        data = self._object(Bucket, Key)
+        return {
+            'ETag': f'"{hash(data)}"',
+            'LastModified': _EPOCH,
+            'ContentLength': len(data)
+        }
+
+    def get_object(self, Bucket, Key, Range=None):
+        data = self._object(Bucket, Key)
+        with self._lock:
+            self.requests.append((Bucket, Key, Range))
+        if Range is not None:
+            match = re.fullmatch(r'bytes=(\d+)-(\d+)', Range)
+            data = data[int(match.group(1)):int(match.group(2)) + 1]
+        return {'Body': _Body(data), 'ContentLength': len(data)}
@@ -0,0 +1,95 @@
+"""Tests the asyncio readers and AsyncCOGTiff."""
+
+import asyncio
+import os
+
+import pytest
+
+from cogdumper.aio import AsyncCOGTiff
+from cogdumper.cog_tiles import COGTiff
+from cogdumper.filedumper import AsyncReader as AsyncFileReader
+from cogdumper.filedumper import Reader as FileReader
+
+from synthetic import make_cog, tile_payload
+
+
+@pytest.fixture
+def data_dir():
+    return os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data')
+
+
+@pytest.mark.parametrize('name', ['cog.tif', 'be_cog.tif', 'BigTIFF.tif'])
+def test_async_file(data_dir, name):
+    with open(os.path.join(data_dir, name), 'rb') as src:
+        expected = COGTiff(FileReader(src).read).get_tile(0, 0, 0)
+
+        async def run():
+            cog = await AsyncCOGTiff.open(AsyncFileReader(src).read)
+            return await cog.get_tile(0, 0, 0)
+
+        assert asyncio.run(run()) == expected
+
+
+def test_async_concurrent_tiles():
+    data = make_cog(levels=((1024, 1024), (512, 512)))
+    reads = []
+
+    async def read(offset, length):
+        reads.append((offset, length))
+        await asyncio.sleep(0)
+        return data[offset:offset + length]
+
+    async def run():
+        cog = await AsyncCOGTiff.open(read)
+        tiles = [(x, y, 0) for y in range(4) for x in range(4)]
+        results = await asyncio.gather(*[cog.get_tile(*t) for t in tiles])
+        assert [t for _, t in results] == [tile_payload(*t) for t in tiles]
+        batch = await cog.get_tiles(tiles + [(1, 1, 1)])
+        assert [t for _, t in batch][-1] == tile_payload(1, 1, 1)
+
+        # the ranges fetched to parse the header and overviews are not kept
+        assert cog._fetched == {}
+
+    asyncio.run(run())
+
+
+def test_async_http(http_server):
+    pytest.importorskip('aiohttp')
+    pytest.importorskip('requests')
+    from cogdumper.httpdumper import AsyncReader as AsyncHTTPReader
+
+    data = make_cog(levels=((512, 512), (256, 256)))
+    http_server.files['/data/cog.tif'] = data
+
+    async def run():
+        reader = AsyncHTTPReader(http_server.url, 'data', 'cog.tif')
+        try:
+            cog = await AsyncCOGTiff.open(reader.read)
+            tiles = [(x, y, 0) for y in range(2) for x in range(2)]
+            return await asyncio.gather(*[cog.get_tile(*t) for t in tiles])
+        finally:
+            await reader.close()
+
+    results = asyncio.run(run())
+    assert [t for _, t in results] == \
+        [tile_payload(x, y, 0) for y in range(2) for x in range(2)]
+
+
+def test_async_ghost_area():
+    data = make_cog(levels=((512, 512), (512, 512)), compression=(7, 8), ghost=True)
+    reads = []
+
+    async def read(offset, length):
+        reads.append((offset, length))
+        return data[offset:offset + length]
+
+    async def run():
+        cog = await AsyncCOGTiff.open(read)
+        reads.clear()
+        _, tile = await cog.get_tile(1, 1, 0)
+        assert tile == tile_payload(1, 1, 0) + tile_payload(1, 1, 1)
+        assert len(reads) == 1
+        batch = await cog.get_tiles([(0, 0, 0), (1, 0, 0)])
+        assert [t for _, t in batch][1] == tile_payload(1, 0, 0) + tile_payload(1, 0, 1)
+
+    asyncio.run(run())
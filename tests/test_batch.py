@@ -0,0 +1,98 @@
+"""Tests the batch mode."""
+
+import io
+
+import pytest
+
+from cogdumper.batch import FrameWriter, parse_tile, parse_tiles, read_frames, run_batch
+from cogdumper.cog_tiles import COGTiff
+from cogdumper.export import DirectoryWriter
+
+from synthetic import BytesReader, make_cog, tile_payload
+
+
+def cog():
+    return COGTiff(BytesReader(make_cog(levels=((512, 512), (256, 256)))).read)
+
+
+def test_parse_tile():
+    assert parse_tile('1 2 0\n') == (1, 2, 0)
+    assert parse_tile('1,2,0') == (1, 2, 0)
+    assert parse_tile('[1, 2, 0]') == (1, 2, 0)
+    assert parse_tile('{"x": 1, "y": 2, "z": 0}') == (1, 2, 0)
+    assert parse_tile('  \n') is None
+    for line in ('1 2', 'a b c', '{"x": 1}', '-1 0 0', '[0, -1, 0]'):
+        with pytest.raises(ValueError):
+            parse_tile(line)
+
+
+def test_frames():
+    stream = io.BytesIO()
+    lines = ['1 1 0', '', '[0, 0, 1]', '5 5 0', '0 1 0']
+    result = run_batch(cog(), parse_tiles(lines), FrameWriter(stream), workers=2, queue_size=2)
+    assert result['tiles'] == 3
+    assert result['errors'] == 1
+    stream.seek(0)
+    assert list(read_frames(stream)) == [
+        (x, y, z, 'application/octet-stream', tile_payload(x, y, z))
+        for x, y, z in [(1, 1, 0), (0, 0, 1), (0, 1, 0)]
+    ]
+
+
+def test_invalid_lines():
+    stream = io.BytesIO()
+    lines = ['1 1 0', '-1 0 0', 'a b c', '0 1 0']
+    result = run_batch(cog(), parse_tiles(lines), FrameWriter(stream), workers=2, queue_size=2)
+    assert result['tiles'] == 2
+    assert result['errors'] == 2
+    stream.seek(0)
+    assert [frame[:3] for frame in read_frames(stream)] == [(1, 1, 0), (0, 1, 0)]
+
+
+class FailingReader(BytesReader):
+    """Reader whose reads at some offsets fail, as a lost connection would."""
+
+    fail = ()
+
+    def read(self, offset, length):
+        if offset in self.fail:
+            raise OSError('Connection reset by peer')
+        return super().read(offset, length)
+
+
+def test_failing_reads():
+    reader = FailingReader(make_cog(levels=((512, 512), (256, 256))))
+    cog = COGTiff(reader.read)
+    _, ranges = cog._tile_ranges(1, 1, 0)
+    reader.fail = {ranges[0][0]}
+    stream = io.BytesIO()
+    lines = ['0 0 0', '1 1 0', 'a b c', '0 1 0']
+    result = run_batch(cog, parse_tiles(lines), FrameWriter(stream), workers=2, queue_size=2)
+    assert result['tiles'] == 2
+    assert result['errors'] == 2
+    stream.seek(0)
+    assert [frame[:3] for frame in read_frames(stream)] == [(0, 0, 0), (0, 1, 0)]
+
+
+def test_directory(tmpdir):
+    result = run_batch(cog(), [(1, 0, 0)], DirectoryWriter(str(tmpdir)))
+    assert result['tiles'] == 1
+    assert tmpdir.join('0', '1', '0.bin').read_binary() == tile_payload(1, 0, 0)
+
+
+def test_cli(tmpdir):
+    click_testing = pytest.importorskip('click.testing')
+    from cogdumper.scripts.cli import cogdumper
+
+    path = str(tmpdir.join('cog.tif'))
+    with open(path, 'wb') as dst:
+        dst.write(make_cog(levels=((512, 512), (256, 256))))
+    runner = click_testing.CliRunner()
+    result = runner.invoke(cogdumper, ['batch', path], input='0 0 0\n1 1 0\n')
+    assert result.exit_code == 0
+    frames = list(read_frames(io.BytesIO(result.stdout_bytes)))
+    assert [f[4] for f in frames] == [tile_payload(0, 0, 0), tile_payload(1, 1, 0)]
+
+    result = runner.invoke(cogdumper, ['batch', path], input='0 0 0\n-1 0 0\n')
+    assert result.exit_code == 1
+    assert len(list(read_frames(io.BytesIO(result.stdout_bytes)))) == 1
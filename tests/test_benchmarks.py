@@ -0,0 +1,38 @@
+"""Runs the benchmark suite with a small configuration."""
+
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def test_benchmarks(tmpdir):
+    output = str(tmpdir.join('results.json'))
+    args = [
+        sys.executable, os.path.join(ROOT, 'benchmarks', 'run.py'),
+        '--backend', 'mmap', '--width', '2048', '--height', '1024',
+        '--overviews', '2', '--bigtiff', '--endian', '>',
+        '--repeat', '2', '--tiles', '10', '--output', output
+    ]
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    subprocess.run(args, check=True, env=env)
+    with open(output) as src:
+        results = json.load(src)
+    assert results['levels'] == 3
+    result, = results['results']
+    assert result['backend'] == 'mmap'
+    assert result['open']['count'] == 2
+    assert result['open']['requests'] >= 1
+    assert result['get_tile']['count'] == 10
+
+    # a baseline that is far faster fails the comparison
+    for section in ('open', 'get_tile'):
+        result[section]['p50_ms'] /= 1000
+    with open(output, 'w') as dst:
+        json.dump(results, dst)
+    r = subprocess.run(args[:-2] + ['--compare', output], env=env,
+                       capture_output=True, text=True)
+    assert r.returncode == 1
+    assert 'Regression: mmap open p50_ms' in r.stderr
@@ -0,0 +1,56 @@
+"""Tests the block cache."""
+
+from cogdumper.cache import BlockCache
+from cogdumper.cog_tiles import COGTiff
+
+from synthetic import BytesReader, make_cog, tile_payload
+
+
+def test_block_alignment():
+    reader = BytesReader(bytes(range(256)) * 4)
+    cache = BlockCache(reader.read, block_size=100, max_bytes=1000)
+    assert cache.read(150, 100) == (bytes(range(256)) * 4)[150:250]
+    assert reader.reads == [(100, 200)]
+    assert cache.read(120, 10) == (bytes(range(256)) * 4)[120:130]
+    assert reader.reads == [(100, 200)]
+    assert cache.stats['hits'] == 1
+    assert cache.stats['misses'] == 2
+
+
+def test_eof():
+    data = b'0123456789'
+    reader = BytesReader(data)
+    cache = BlockCache(reader.read, block_size=4, max_bytes=100)
+    assert cache.read(6, 100) == data[6:]
+    assert cache.read(0, 10) == data
+    assert cache.read(5, 0) == b''
+
+
+def test_eviction():
+    reader = BytesReader(bytes(1000))
+    cache = BlockCache(reader.read, block_size=100, max_bytes=300)
+    for offset in range(0, 1000, 100):
+        cache.read(offset, 100)
+    stats = cache.stats
+    assert stats['blocks'] == 3
+    assert stats['bytes'] == 300
+    assert stats['evictions'] == 7
+    cache.read(900, 100)
+    assert cache.stats['hits'] == 1
+    cache.read(0, 100)
+    assert cache.stats['misses'] == 11
+
+
+def test_cached_cog():
+    data = make_cog(levels=((512, 512), (256, 256)))
+    reader = BytesReader(data)
+    cache = BlockCache(reader.read, block_size=64)
+    cog = COGTiff(cache.read)
+    assert cog.read_many == cache.read_many
+    reads = len(reader.reads)
+    assert cog.get_tile(1, 1, 0)[1] == tile_payload(1, 1, 0)
+    # the whole file was read with the header
+    assert len(reader.reads) == reads
+    for offset, length in reader.reads:
+        assert offset % 64 == 0
+        assert length % 64 == 0
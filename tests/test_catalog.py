@@ -0,0 +1,179 @@
+"""Tests the dataset catalog."""
+
+import threading
+import time
+
+import pytest
+
+from cogdumper.catalog import Catalog
+from cogdumper.errors import TIFFError
+
+from synthetic import BytesReader, make_cog, tile_payload
+
+
+class Opener:
+    """Opens in memory COGs by URL and records the readers it creates."""
+
+    def __init__(self, delay=0):
+        self.data = {
+            f'mem://{name}': make_cog(levels=((512, 512), (256, 256)))
+            for name in 'abcd'
+        }
+        self.data['mem://bad'] = b'not a tiff'
+        self.delay = delay
+        self.readers = []
+        self.closed = []
+
+    def __call__(self, url):
+        time.sleep(self.delay)
+        reader = BytesReader(self.data[url])
+        reader.close = lambda: self.closed.append(url)
+        self.readers.append(url)
+        return reader
+
+
+def test_lazy_open_and_hits():
+    opener = Opener()
+    catalog = Catalog(opener=opener)
+    assert len(catalog) == 0
+    cog = catalog.get('mem://a')
+    assert cog.get_tile(1, 1, 0)[1] == tile_payload(1, 1, 0)
+    assert catalog.get('mem://a') is cog
+    assert opener.readers == ['mem://a']
+    assert 'mem://a' in catalog
+    stats = catalog.stats
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['bytes'] == cog.nbytes > 0
+
+
+def test_datasets():
+    opener = Opener()
+    catalog = Catalog({'scene': 'mem://b'}, opener=opener)
+    catalog.get('scene')
+    assert opener.readers == ['mem://b']
+    with pytest.raises(KeyError):
+        catalog.get('mem://b')
+
+    catalog.register('scene', 'mem://c')
+    assert 'scene' not in catalog
+    assert opener.closed == ['mem://b']
+    catalog.get('scene')
+    assert opener.readers == ['mem://b', 'mem://c']
+
+
+def test_evicts_least_recently_used_over_budget():
+    opener = Opener()
+    size = Catalog(opener=opener).get('mem://a').nbytes
+    opener = Opener()
+    catalog = Catalog(max_bytes=size * 2, opener=opener)
+    catalog.get('mem://a')
+    catalog.get('mem://b')
+    catalog.get('mem://a')
+    catalog.get('mem://c')
+    assert 'mem://b' not in catalog
+    assert 'mem://a' in catalog and 'mem://c' in catalog
+    assert opener.closed == ['mem://b']
+    assert catalog.stats['evictions'] == 1
+    assert catalog.nbytes <= size * 2
+
+    # a COG larger than the budget is still kept while it is the newest
+    catalog.max_bytes = 1
+    catalog.get('mem://d')
+    assert len(catalog) == 1
+
+
+def test_max_open():
+    opener = Opener()
+    with Catalog(max_open=2, opener=opener) as catalog:
+        for url in ('mem://a', 'mem://b', 'mem://c'):
+            catalog.get(url)
+        assert len(catalog) == 2
+    assert sorted(opener.closed) == ['mem://a', 'mem://b', 'mem://c']
+
+
+def test_growing_headers_are_measured():
+    opener = Opener()
+    catalog = Catalog(opener=opener)
+    cog = catalog.get('mem://a')
+    before = catalog.nbytes
+    cog.get_tile(0, 0, 1)
+    catalog.get('mem://a')
+    assert catalog.nbytes == cog.nbytes >= before
+
+
+def test_concurrent_open_parses_once():
+    opener = Opener(delay=0.05)
+    catalog = Catalog(opener=opener)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(catalog.get('mem://a')))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert opener.readers == ['mem://a']
+    assert len(results) == 8 and all(cog is results[0] for cog in results)
+
+
+def test_failed_open():
+    opener = Opener()
+    catalog = Catalog(opener=opener)
+    with pytest.raises(TIFFError):
+        catalog.get('mem://bad')
+    assert opener.closed == ['mem://bad']
+    assert len(catalog) == 0
+    # the next request tries again
+    with pytest.raises(TIFFError):
+        catalog.get('mem://bad')
+    assert opener.readers == ['mem://bad', 'mem://bad']
+
+
+def test_eviction_waits_for_leases():
+    opener = Opener()
+    catalog = Catalog(max_open=1, opener=opener)
+    reading = threading.Event()
+    proceed = threading.Event()
+    results = []
+
+    def read_tile():
+        with catalog.open('mem://a') as cog:
+            read = cog.read
+
+            def blocking_read(offset, length):
+                reading.set()
+                proceed.wait(5)
+                return read(offset, length)
+
+            cog.read = blocking_read
+            results.append(cog.get_tile(1, 1, 0)[1])
+            # the reader is still open at the end of the lease
+            assert opener.closed == []
+
+    thread = threading.Thread(target=read_tile)
+    thread.start()
+    assert reading.wait(5)
+    # evicts mem://a while its tile is being read
+    catalog.get('mem://b')
+    assert 'mem://a' not in catalog
+    assert opener.closed == []
+    proceed.set()
+    thread.join()
+    assert results == [tile_payload(1, 1, 0)]
+    assert opener.closed == ['mem://a']
+
+
+def test_evicted_file_stays_readable(tmpdir):
+    datasets = {}
+    for name in 'ab':
+        path = tmpdir.join(f'{name}.tif')
+        path.write_binary(make_cog(levels=((512, 512), (256, 256))))
+        datasets[name] = str(path)
+    catalog = Catalog(datasets, max_open=1)
+    with catalog.open('a') as cog:
+        with catalog.open('b'):
+            assert 'a' not in catalog
+        assert bytes(cog.get_tile(0, 0, 1)[1]) == tile_payload(0, 0, 1)
+    catalog.close()
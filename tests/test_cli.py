@@ -0,0 +1,69 @@
+"""Tests the start up cost of the command line interface."""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('click')
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data')
+
+# modules that only the commands of their backend may import
+BACKEND_MODULES = ('boto3', 'botocore', 'requests', 'asyncio', 'sqlite3')
+
+# microseconds, the CLI itself takes a few tens of milliseconds to import
+IMPORT_BUDGET = 250000
+
+
+def import_times(code):
+    """Cumulative import time of each module imported by running code."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_import_budget():
+    times = import_times('import cogdumper.scripts.cli')
+    assert not [m for m in BACKEND_MODULES if m in times]
+    assert times['cogdumper.scripts.cli'] < IMPORT_BUDGET
+
+
+def test_file_command_imports(tmpdir):
+    output = str(tmpdir.join('tile.jpg'))
+    times = import_times(
+        'from cogdumper.scripts.cli import cogdumper\n'
+        f'cogdumper(["file", "--file", {os.path.join(DATA_DIR, "cog.tif")!r}, '
+        f'"--output", {output!r}], standalone_mode=False)'
+    )
+    assert os.path.getsize(output) > 0
+    assert not [m for m in BACKEND_MODULES if m in times]
+
+
+def test_stats(tmpdir):
+    from click.testing import CliRunner
+    from cogdumper import metrics
+    from cogdumper.scripts.cli import cogdumper
+
+    output = str(tmpdir.join('tile.jpg'))
+    try:
+        result = CliRunner().invoke(cogdumper, [
+            'file', '--file', os.path.join(DATA_DIR, 'cog.tif'),
+            '--output', output, '--stats'
+        ])
+    finally:
+        metrics.disable()
+    assert result.exit_code == 0
+    assert 'header' in result.output
+    assert 'total' in result.output
@@ -0,0 +1,359 @@
+"""Tests COGTiff against synthetic COGs."""
+
+import threading
+import time
+
+import pytest
+
+from cogdumper import metrics
+from cogdumper.cog_tiles import IFD, COGTiff
+from cogdumper.errors import TIFFError, TileNotFoundError
+
+from synthetic import BytesReader, make_cog, tile_payload
+
+
+@pytest.fixture(params=[('<', False), ('>', False), ('<', True), ('>', True)],
+                ids=['tiff', 'be_tiff', 'bigtiff', 'be_bigtiff'])
+def cog_data(request):
+    endian, bigtiff = request.param
+    return make_cog(levels=((1024, 768), (512, 384), (256, 192)),
+                    endian=endian, bigtiff=bigtiff)
+
+
+def test_get_tile(cog_data):
+    cog = COGTiff(BytesReader(cog_data).read)
+    assert cog._image_ifds[0]['nx_tiles'] == 4
+    assert cog._image_ifds[0]['ny_tiles'] == 3
+    for x, y in [(0, 0), (3, 0), (1, 2), (3, 2)]:
+        mime_type, tile = cog.get_tile(x, y, 0)
+        assert mime_type == 'application/octet-stream'
+        assert tile == tile_payload(x, y, 0)
+    with pytest.raises(TIFFError):
+        cog.get_tile(4, 0, 0)
+    with pytest.raises(TIFFError):
+        cog.get_tile(0, 3, 0)
+
+
+@pytest.mark.parametrize('x,y,z', [(-1, 0, 0), (0, -1, 0), (0, 0, -1), (4, 0, 0),
+                                   (0, 3, 0), (0, 0, 3)])
+def test_tile_out_of_bounds(cog_data, x, y, z):
+    cog = COGTiff(BytesReader(cog_data).read)
+    with pytest.raises(TileNotFoundError):
+        cog.get_tile(x, y, z)
+    with pytest.raises(TileNotFoundError):
+        cog.get_tiles([(0, 0, 0), (x, y, z)])
+    with pytest.raises(TileNotFoundError):
+        cog.is_empty(x, y, z)
+
+
+def test_get_tiles(cog_data):
+    reader = BytesReader(cog_data)
+    cog = COGTiff(reader.read)
+    tiles = [(x, y, 0) for y in range(3) for x in range(4)]
+    tiles += [(1, 1, 1), (0, 0, 2)]
+    reader.reads = []
+    results = cog.get_tiles(list(reversed(tiles)))
+    assert len(reader.reads) == 1
+    assert [t for _, t in results] == \
+        [tile_payload(x, y, z) for x, y, z in reversed(tiles)]
+
+
+def test_get_tiles_gap(cog_data):
+    reader = BytesReader(cog_data)
+    cog = COGTiff(reader.read)
+    reader.reads = []
+    results = cog.get_tiles([(0, 0, 0), (2, 0, 0), (0, 2, 0)], max_gap=0)
+    assert len(reader.reads) == 3
+    assert [t for _, t in results] == \
+        [tile_payload(0, 0, 0), tile_payload(2, 0, 0), tile_payload(0, 2, 0)]
+
+    reader.reads = []
+    cog.get_tiles([(0, 0, 0), (2, 0, 0), (0, 2, 0)], max_gap=100)
+    assert len(reader.reads) == 2
+
+
+class ReadManyReader(BytesReader):
+    def __init__(self, data):
+        super().__init__(data)
+        self.batches = []
+
+    def read_many(self, ranges):
+        self.batches.append(list(ranges))
+        return [self.read(offset, length) for offset, length in ranges]
+
+
+def test_read_many(cog_data):
+    reader = ReadManyReader(cog_data)
+    cog = COGTiff(reader.read)
+    assert cog.read_many == reader.read_many
+    cog.get_tiles([(0, 0, 0), (0, 2, 0)], max_gap=0)
+    assert len(reader.batches) == 1
+    assert len(reader.batches[0]) == 2
+
+
+@pytest.mark.parametrize('bigtiff', [False, True])
+def test_lazy_overviews(bigtiff, monkeypatch):
+    monkeypatch.setenv('COG_INGESTED_BYTES_AT_OPEN', '16')
+    monkeypatch.setenv('COG_MAX_HEADER_PREFETCH_BYTES', '0')
+    cog_data = make_cog(levels=((8192, 8192), (4096, 4096), (2048, 2048)),
+                        bigtiff=bigtiff)
+    reader = BytesReader(cog_data)
+    cog = COGTiff(reader.read)
+    assert len(cog._image_ifds) == 3
+    # the arrays of the last overview came with the read of its directory
+    assert 'offsets' not in cog._image_ifds[0]
+    assert 'offsets' not in cog._image_ifds[1]
+    assert 'offsets' in cog._image_ifds[2]
+
+    reader.reads = []
+    assert cog.get_tile(1, 1, 1)[1] == tile_payload(1, 1, 1)
+    assert 'offsets' in cog._image_ifds[1]
+    assert 'offsets' not in cog._image_ifds[0]
+    # the arrays of the full resolution image lie before the IFD of the
+    # first overview
+    next_offset = cog._image_ifds[0]['next_offset']
+    assert all(offset >= next_offset for offset, _ in reader.reads)
+
+    # the raw tags read on first use are not kept next to the arrays
+    cog.get_tile(0, 0, 0)
+    assert cog._buffer.nbytes == 0
+    assert cog.nbytes == sum(ifd.nbytes for ifd in cog._image_ifds)
+
+
+def test_concurrent_lazy_overviews(monkeypatch):
+    monkeypatch.setenv('COG_INGESTED_BYTES_AT_OPEN', '16')
+    monkeypatch.setenv('COG_MAX_HEADER_PREFETCH_BYTES', '0')
+    cog_data = make_cog(levels=((8192, 8192), (4096, 4096), (2048, 2048)), bigtiff=True)
+
+    class SlowReader(BytesReader):
+        def read(self, offset, length):
+            time.sleep(0.001)
+            return super().read(offset, length)
+
+    cog = COGTiff(SlowReader(cog_data).read)
+    loads = []
+    load = IFD._load
+
+    def counting_load(ifd, pending, owner):
+        loads.append(ifd)
+        return load(ifd, pending, owner)
+
+    monkeypatch.setattr(IFD, '_load', counting_load)
+    start = threading.Barrier(8)
+    results = {}
+
+    def read(n):
+        start.wait()
+        for z in (0, 1):
+            results[(n, z)] = bytes(cog.get_tile(n % 4, 1, z)[1])
+
+    threads = [threading.Thread(target=read, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {(n, z): tile_payload(n % 4, 1, z) for n in range(8) for z in (0, 1)}
+    # each pending IFD is decoded once
+    assert sorted(map(id, loads)) == sorted(set(map(id, loads)))
+    assert len(loads) == 2
+
+
+def test_compact_ifds(cog_data):
+    cog = COGTiff(BytesReader(cog_data).read)
+    ifd = cog._image_ifds[0]
+    assert not hasattr(ifd, '__dict__')
+    assert ifd['tags'] == (256, 257, 259, 322, 323, 324, 325)
+    assert ifd.offsets.typecode in ('I', 'L', 'Q')
+    assert ifd.offsets.itemsize == (8 if cog._big_tiff else 4)
+    assert list(ifd.byte_counts) == \
+        [len(tile_payload(x, y, 0)) for y in range(3) for x in range(4)]
+    assert ifd._pending is None
+    assert ifd._cog is None
+
+
+@pytest.mark.parametrize('bigtiff', [False, True])
+def test_header_prefetch(bigtiff):
+    cog_data = make_cog(
+        levels=((16384, 16384), (8192, 8192), (4096, 4096), (2048, 2048)),
+        bigtiff=bigtiff
+    )
+    reader = BytesReader(cog_data)
+    cog = COGTiff(reader.read)
+    for ifd in cog._image_ifds:
+        ifd.load()
+    assert cog.header_stats['requests'] == 2
+    assert cog.header_stats['bytes'] == sum(length for _, length in reader.reads)
+    # the header ends where the tile data of the last overview starts
+    assert cog.header_size == min(cog._image_ifds[3].offsets)
+
+    reader = BytesReader(cog_data)
+    cog = COGTiff(reader.read, header_size=cog.header_size)
+    for ifd in cog._image_ifds:
+        ifd.load()
+    assert cog.header_stats['requests'] == 1
+
+
+@pytest.mark.parametrize('bigtiff', [False, True])
+def test_sparse_tiles(bigtiff):
+    empty = [(1, 0, 0), (3, 2, 0), (0, 0, 2)]
+    data = make_cog(levels=((1024, 768), (512, 384), (256, 192)),
+                    bigtiff=bigtiff, empty=empty)
+    reader = BytesReader(data)
+    cog = COGTiff(reader.read, empty_tile=b'nodata')
+    assert cog.level_summary(0) == {
+        'tiles': 12,
+        'empty_tiles': 2,
+        'bytes': sum(len(tile_payload(x, y, 0)) for y in range(3) for x in range(4)
+                     if (x, y, 0) not in empty)
+    }
+    assert cog.level_summary(1)['empty_tiles'] == 0
+    assert cog.is_empty(1, 0, 0) and not cog.is_empty(0, 0, 0)
+    assert list(cog.iter_tiles(2)) == []
+    assert len(list(cog.iter_tiles(0))) == 10
+    assert (1, 0, 0) not in cog.iter_tiles(0)
+
+    reader.reads = []
+    assert cog.get_tile(3, 2, 0) == ('application/octet-stream', b'nodata')
+    assert cog.get_tiles([(1, 0, 0), (0, 0, 2)]) == \
+        [('application/octet-stream', b'nodata')] * 2
+    assert reader.reads == []
+
+    results = cog.get_tiles([(0, 0, 0), (1, 0, 0), (2, 0, 0)])
+    assert [t for _, t in results] == \
+        [tile_payload(0, 0, 0), b'nodata', tile_payload(2, 0, 0)]
+
+    index_cog = COGTiff(reader.read, index=cog.to_index())
+    assert index_cog.level_summary(0)['empty_tiles'] == 2
+
+
+class StreamingReader(BytesReader):
+    def stream(self, offset, length, chunk_size):
+        for start in range(offset, offset + length, chunk_size):
+            yield self.read(start, min(chunk_size, offset + length - start))
+
+
+def test_stream_tile(cog_data):
+    reader = StreamingReader(cog_data)
+    cog = COGTiff(reader.read, empty_tile=b'nodata')
+    reader.reads = []
+    mime_type, size, chunks = cog.stream_tile(1, 2, 0, chunk_size=10)
+    assert reader.reads == []
+    assert mime_type == 'application/octet-stream'
+    chunks = list(chunks)
+    assert len(chunks) == len(reader.reads) > 1
+    assert b''.join(chunks) == tile_payload(1, 2, 0)
+    assert size == len(tile_payload(1, 2, 0))
+
+    # readers without a stream method yield whole ranges
+    cog = COGTiff(BytesReader(cog_data).read)
+    _, _, chunks = cog.stream_tile(1, 2, 0)
+    assert list(chunks) == [tile_payload(1, 2, 0)]
+
+
+def jpeg_cog():
+    tables = b'\xff\xd8\xff\xdbTABLES\xff\xd9'
+    return make_cog(levels=((512, 512),), compression=7, tags={347: (1, list(tables))},
+                    tile_data=lambda x, y, z: b'\xff\xd8' + tile_payload(x, y, z) + b'\xff\xd9')
+
+
+class PurposeReader(StreamingReader):
+    """Reader recording the purpose of each read."""
+
+    purposes = ()
+
+    def read(self, offset, length):
+        self.purposes += (metrics.purpose_of(offset, length),)
+        return super().read(offset, length)
+
+
+def test_stream_tile_purpose():
+    reader = PurposeReader(jpeg_cog())
+    cog = COGTiff(reader.read)
+    reader.purposes = ()
+    _, _, chunks = cog.stream_tile(1, 1, 0, chunk_size=10)
+    for chunk in chunks:
+        # the purpose is not left set while the chunks are used
+        assert metrics.purpose_of(0, 1) == 'other'
+    assert reader.purposes and set(reader.purposes) == {'tile'}
+
+
+def test_stream_truncated_jpeg_tile():
+    reader = StreamingReader(jpeg_cog())
+    cog = COGTiff(reader.read)
+    _, _, chunks = cog.stream_tile(1, 1, 0)
+    assert b''.join(chunks) == b'\xff\xd8\xff\xdbTABLES' + tile_payload(1, 1, 0) + b'\xff\xd9'
+
+    cog.stream = lambda offset, length, chunk_size: iter([b'\xff'])
+    _, _, chunks = cog.stream_tile(1, 1, 0)
+    # nothing is yielded for a tile that is cut short before its tables
+    with pytest.raises(TIFFError):
+        next(chunks)
+
+
+def ghost_cog(bigtiff=False):
+    # JPEG levels, each followed by its deflate mask
+    return make_cog(levels=((512, 512), (512, 512), (256, 256), (256, 256)),
+                    compression=(7, 8, 7, 8), bigtiff=bigtiff, ghost=True)
+
+
+@pytest.mark.parametrize('bigtiff', [False, True])
+def test_ghost_area_interleaved_mask(bigtiff):
+    reader = BytesReader(ghost_cog(bigtiff))
+    cog = COGTiff(reader.read)
+    assert cog.structural_metadata['BLOCK_LEADER'] == 'SIZE_AS_UINT4'
+    assert cog.structural_metadata['MASK_INTERLEAVED_WITH_IMAGERY'] == 'YES'
+    assert cog.levels == 2
+
+    reader.reads = []
+    mime_type, tile = cog.get_tile(1, 0, 0)
+    assert mime_type == 'image/jpeg'
+    assert tile == tile_payload(1, 0, 0) + tile_payload(1, 0, 1)
+    # image and mask with their leaders and trailers in one read
+    assert len(reader.reads) == 1
+    assert reader.reads[0][1] == len(tile) + 16
+
+    results = cog.get_tiles([(0, 0, 0), (1, 1, 0), (0, 0, 1)])
+    assert [t for _, t in results] == [
+        tile_payload(0, 0, 0) + tile_payload(0, 0, 1),
+        tile_payload(1, 1, 0) + tile_payload(1, 1, 1),
+        tile_payload(0, 0, 2) + tile_payload(0, 0, 3)
+    ]
+
+    index_cog = COGTiff(reader.read, index=cog.to_index())
+    assert index_cog.get_tile(1, 0, 0) == (mime_type, tile)
+
+
+def test_ghost_area_integrity():
+    data = ghost_cog()
+    cog = COGTiff(BytesReader(data).read)
+    offset = cog._image_ifds[0].offsets[1]
+
+    corrupt = bytearray(data)
+    corrupt[offset - 4] ^= 0xff
+    cog = COGTiff(BytesReader(bytes(corrupt)).read)
+    with pytest.raises(TIFFError):
+        cog.get_tile(1, 0, 0)
+    with pytest.raises(TIFFError):
+        cog.get_tiles([(0, 0, 0), (1, 0, 0)])
+    assert cog.get_tile(0, 0, 0)[1].startswith(tile_payload(0, 0, 0))
+
+    # tile data that does not end with its trailer
+    end = offset + len(tile_payload(1, 0, 0))
+    corrupt = bytearray(data)
+    corrupt[end - 1] ^= 0xff
+    cog = COGTiff(BytesReader(bytes(corrupt)).read)
+    cog.get_tile(0, 0, 0)
+    with pytest.raises(TIFFError):
+        cog.get_tile(1, 0, 0)
+
+
+def test_incompatible_edition():
+    # same length, so that offsets do not move
+    data = ghost_cog().replace(b'EDITION=NO\nMASK_INTERLEAVED_WITH_IMAGERY=YES\n ',
+                               b'EDITION=YES\nMASK_INTERLEAVED_WITH_IMAGERY=YES\n')
+    reader = BytesReader(data)
+    cog = COGTiff(reader.read)
+    assert cog.structural_metadata['KNOWN_INCOMPATIBLE_EDITION'] == 'YES'
+    reader.reads = []
+    assert cog.get_tile(1, 0, 0)[1] == tile_payload(1, 0, 0) + tile_payload(1, 0, 1)
+    assert len(reader.reads) == 2
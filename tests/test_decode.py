@@ -0,0 +1,162 @@
+"""Tests decoding tiles to arrays."""
+
+import io
+import zlib
+
+import pytest
+
+from cogdumper.cog_tiles import COGTiff
+from cogdumper.decode import decompress, lzw_decode
+from cogdumper.errors import TIFFError
+
+from synthetic import BytesReader, make_cog
+
+numpy = pytest.importorskip('numpy')
+
+TILE = 32
+
+
+def lzw_encode(data):
+    """TIFF LZW, as libtiff writes it."""
+    table = {bytes((i,)): i for i in range(256)}
+    next_code = 258
+    bits = 9
+    codes = [(256, bits)]
+    word = b''
+    for byte in data:
+        candidate = word + bytes((byte,))
+        if candidate in table:
+            word = candidate
+            continue
+        codes.append((table[word], bits))
+        table[candidate] = next_code
+        next_code += 1
+        if next_code > (1 << bits) - 1:
+            bits += 1
+        word = bytes((byte,))
+    if word:
+        codes.append((table[word], bits))
+    codes.append((257, bits))
+
+    value = 0
+    size = 0
+    for code, width in codes:
+        value = (value << width) | code
+        size += width
+    padding = -size % 8
+    return (value << padding).to_bytes((size + padding) // 8, 'big')
+
+
+def pixels(x, y, z, dtype, samples=1):
+    count = TILE * TILE * samples
+    values = (numpy.arange(count) * (x + 3) + y * 7 + z * 13) % 251
+    return values.astype(dtype).reshape(TILE, TILE, samples)
+
+
+def deflate_cog(dtype, predictor=1, endian='<', compression=8):
+    dtype = numpy.dtype(dtype).newbyteorder(endian)
+    sample_format = {'u': 1, 'i': 2, 'f': 3}[dtype.kind]
+
+    def tile_data(x, y, z):
+        array = pixels(x, y, z, dtype, 2)
+        if predictor == 2:
+            array = array.copy()
+            array[:, 1:] = numpy.diff(array, axis=1)
+        elif predictor == 3:
+            planes = array.astype(dtype.newbyteorder('>')).view(numpy.uint8) \
+                .reshape(TILE, TILE * 2, dtype.itemsize).transpose(0, 2, 1).reshape(TILE, -1)
+            array = planes.copy()
+            array[:, 1:] = numpy.diff(planes, axis=1)
+        data = array.tobytes()
+        return lzw_encode(data) if compression == 5 else zlib.compress(data)
+
+    return make_cog(
+        levels=((64, 64), (32, 32)), tile_size=TILE, endian=endian,
+        compression=compression, tile_data=tile_data,
+        tags={
+            258: (3, [dtype.itemsize * 8] * 2),
+            277: (3, [2]),
+            317: (3, [predictor]),
+            339: (3, [sample_format] * 2)
+        }
+    ), dtype
+
+
+def test_lzw_round_trip():
+    data = bytes(range(256)) * 20 + b'abababababab' * 100 + bytes(3000)
+    assert lzw_decode(lzw_encode(data)) == data
+    assert lzw_decode(lzw_encode(b'')) == b''
+
+
+def test_corrupt_lzw():
+    data = lzw_encode(bytes(range(256)) * 4)
+    # clear then a code that is not in the table yet
+    for corrupt in (b'\x80\x4b\x00', b'\x80\x40\x80', data[:40] + b'\xff' * 8):
+        with pytest.raises(TIFFError):
+            lzw_decode(corrupt)
+    # data cut short decodes to a prefix, which decode_tile rejects
+    assert (bytes(range(256)) * 4).startswith(lzw_decode(data[:100]))
+    with pytest.raises(TIFFError):
+        decompress(8, b'not deflate')
+
+
+@pytest.mark.parametrize('dtype,predictor,endian,compression', [
+    ('uint8', 1, '<', 8),
+    ('uint16', 2, '<', 8),
+    ('int16', 2, '>', 8),
+    ('float32', 3, '<', 8),
+    ('float64', 3, '>', 8),
+    ('uint16', 2, '>', 5),
+    ('float32', 1, '<', 5),
+])
+def test_decode(dtype, predictor, endian, compression):
+    data, dtype = deflate_cog(dtype, predictor, endian, compression)
+    cog = COGTiff(BytesReader(data).read)
+    mime_type, tile = cog.get_tile(1, 0, 0, decode=True)
+    assert tile.shape == (TILE, TILE, 2)
+    assert tile.dtype == dtype.newbyteorder('=')
+    numpy.testing.assert_array_equal(tile, pixels(1, 0, 0, dtype, 2))
+
+    tiles = [(x, y, 0) for y in range(2) for x in range(2)] + [(0, 0, 1)]
+    results = cog.get_tiles(tiles, decode=True)
+    for (x, y, z), (_, tile) in zip(tiles, results):
+        numpy.testing.assert_array_equal(tile, pixels(x, y, z, dtype, 2))
+
+
+def test_decode_jpeg_with_mask():
+    Image = pytest.importorskip('PIL.Image')
+
+    def tile_data(x, y, z):
+        if z == 0:
+            image = Image.new('L', (TILE, TILE), 100 + x)
+            out = io.BytesIO()
+            image.save(out, 'JPEG')
+            return out.getvalue()
+        # the left half of each row is valid
+        mask = numpy.zeros((TILE, TILE), bool)
+        mask[:, :TILE // 2] = True
+        return zlib.compress(numpy.packbits(mask, axis=1).tobytes())
+
+    data = make_cog(
+        levels=((64, 64), (64, 64)), tile_size=TILE, compression=(7, 8),
+        tile_data=tile_data, empty=[(1, 1, 0), (1, 1, 1)],
+        tags=[{258: (3, [8])}, {258: (3, [1])}]
+    )
+    cog = COGTiff(BytesReader(data).read)
+    mime_type, tile = cog.get_tile(1, 0, 0, decode=True)
+    assert mime_type == 'image/jpeg'
+    assert tile.shape == (TILE, TILE, 1)
+    assert isinstance(tile, numpy.ma.MaskedArray)
+    assert tile.mask[:, :TILE // 2].sum() == 0
+    assert tile.mask[:, TILE // 2:].all()
+    assert abs(int(tile[0, 0, 0]) - 101) <= 2
+
+    _, sparse = cog.get_tile(1, 1, 0, decode=True)
+    assert sparse.mask.all() and sparse.shape == (TILE, TILE, 1)
+
+
+def test_decode_unsupported():
+    data = make_cog(levels=((64, 64),), tile_size=TILE, compression=34712)
+    cog = COGTiff(BytesReader(data).read)
+    with pytest.raises(TIFFError):
+        cog.get_tile(0, 0, 0, decode=True)
@@ -0,0 +1,69 @@
+"""Tests the bulk tile export."""
+
+import os
+import sqlite3
+
+from cogdumper.cog_tiles import COGTiff
+from cogdumper.export import DirectoryWriter, MBTilesWriter, export_tiles, level_tiles
+from cogdumper.pipeline import bounded_imap
+
+from synthetic import BytesReader, make_cog, tile_payload
+
+
+def cog():
+    data = make_cog(levels=((1024, 768), (512, 384), (256, 192)))
+    return COGTiff(BytesReader(data).read)
+
+
+def test_level_tiles():
+    c = cog()
+    assert len(list(level_tiles(c, 0))) == 12
+    assert list(level_tiles(c, 0, bbox=(300, 0, 600, 256))) == [(1, 0, 0), (2, 0, 0)]
+    assert list(level_tiles(c, 1, bbox=(300, 0, 600, 256))) == [(0, 0, 1), (1, 0, 1)]
+    assert list(level_tiles(c, 2, bbox=(300, 0, 600, 256))) == [(0, 0, 2)]
+
+
+def test_export_directory(tmpdir):
+    result = export_tiles(cog(), DirectoryWriter(str(tmpdir)), workers=2, batch_size=5)
+    assert result['tiles'] == 12 + 4 + 1
+    with open(os.path.join(str(tmpdir), '0', '3', '2.bin'), 'rb') as src:
+        assert src.read() == tile_payload(3, 2, 0)
+
+
+def test_export_mbtiles(tmpdir):
+    path = str(tmpdir.join('out.mbtiles'))
+    writer = MBTilesWriter(path, batch_size=3)
+    result = export_tiles(cog(), writer, levels=[0, 2], workers=2, queue_size=2)
+    assert result['tiles'] == 13
+    db = sqlite3.connect(path)
+    rows = db.execute('SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles').fetchall()
+    assert len(rows) == 13
+    tiles = {(z, x, y): bytes(data) for z, x, y, data in rows}
+    # level 0 is the highest zoom and rows are flipped
+    assert tiles[(2, 3, 0)] == tile_payload(3, 2, 0)
+    assert tiles[(0, 0, 0)] == tile_payload(0, 0, 2)
+    metadata = dict(db.execute('SELECT name, value FROM metadata'))
+    assert metadata['minzoom'] == '0'
+    assert metadata['maxzoom'] == '2'
+    assert metadata['name'] == 'out'
+
+
+def test_bounded_imap():
+    consumed = []
+
+    def items():
+        for i in range(20):
+            consumed.append(i)
+            yield i
+
+    results = bounded_imap(lambda i: i * 2, items(), workers=4, queue_size=3)
+    assert next(results) == 0
+    assert len(consumed) <= 4
+    assert list(results) == [i * 2 for i in range(1, 20)]
+
+
+def test_export_skips_empty(tmpdir):
+    data = make_cog(levels=((1024, 768), (512, 384)), empty=[(0, 0, 0), (1, 1, 1)])
+    result = export_tiles(COGTiff(BytesReader(data).read), DirectoryWriter(str(tmpdir)))
+    assert result['tiles'] == 12 + 4 - 2
+    assert not os.path.exists(os.path.join(str(tmpdir), '0', '0', '0.bin'))
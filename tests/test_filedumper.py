@@ -6,7 +6,7 @@ import pytest
 
 from cogdumper.cog_tiles import COGTiff
 from cogdumper.errors import TIFFError
-from cogdumper.filedumper import Reader as FileReader
+from cogdumper.filedumper import MMapReader, Reader as FileReader
 
 
 @pytest.fixture
@@ -129,3 +129,40 @@ def test_bigtiff_tile(bigtiff):
     assert 'jpeg_tables' in cog._image_ifds[0]
     assert cog._image_ifds[0]['jpeg_tables'] is None
     assert mime_type == 'application/octet-stream'
+
+
+def test_mmap_reader(tiff, bigtiff, be_tiff):
+    for src in (tiff, bigtiff, be_tiff):
+        expected = COGTiff(FileReader(src).read).get_tile(0, 0, 0)
+        reader = MMapReader(src)
+        cog = COGTiff(reader.read)
+        mime_type, tile = cog.get_tile(0, 0, 0)
+        assert (mime_type, bytes(tile)) == expected
+        assert isinstance(reader.read(0, 4), memoryview)
+
+
+def test_tile_segments(data_dir):
+    with MMapReader.open(os.path.join(data_dir, 'cog.tif')) as reader:
+        cog = COGTiff(reader.read)
+        mime_type, tile = cog.get_tile(0, 0, 0)
+        _, segments = cog.get_tile(0, 0, 0, segments=True)
+        assert mime_type == 'image/jpeg'
+        assert len(segments) == 3
+        # the tables are sliced once per IFD
+        assert segments[1] is cog._image_ifds[0].table_body
+        assert b''.join(segments) == tile
+
+    # the segments outlive the reader, which still closes its file
+    assert reader._handle.closed
+    assert b''.join(segments) == tile
+
+
+@pytest.mark.parametrize('chunk_size', [1, 100, 1 << 20])
+def test_stream_tile(tiff, chunk_size):
+    reader = FileReader(tiff)
+    cog = COGTiff(reader.read)
+    _, tile = cog.get_tile(0, 0, 0)
+    mime_type, size, chunks = cog.stream_tile(0, 0, 0, chunk_size=chunk_size)
+    assert mime_type == 'image/jpeg'
+    assert size == len(tile)
+    assert b''.join(chunks) == tile
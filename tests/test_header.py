@@ -0,0 +1,98 @@
+"""Tests header buffering and prefetch sizing."""
+
+import threading
+import time
+
+from cogdumper.header import HeaderBuffer, HeaderSizeHints
+
+from synthetic import BytesReader, make_cog
+
+
+def test_header_buffer():
+    reader = BytesReader(bytes(range(256)) * 16)
+    buffer = HeaderBuffer(reader.read)
+    buffer.prefetch(100)
+    assert buffer.get(10, 10) == bytes(range(10, 20))
+    buffer.extend(200)
+    assert len(buffer.data) == 200
+    assert buffer.get(1000, 10, lookahead=100) == (bytes(range(256)) * 16)[1000:1010]
+    assert buffer.get(1050, 10) == (bytes(range(256)) * 16)[1050:1060]
+    assert buffer.requests == 3
+    assert buffer.bytes == 300
+
+
+def test_header_buffer_eof():
+    reader = BytesReader(b'0123456789')
+    buffer = HeaderBuffer(reader.read)
+    buffer.prefetch(100)
+    assert buffer.eof
+    assert buffer.get(5, 100) == b'56789'
+    assert buffer.requests == 1
+
+
+def test_size_hints():
+    data = make_cog(levels=((8192, 8192), (4096, 4096), (2048, 2048)))
+    hints = HeaderSizeHints()
+    assert hints.size_for('s3://bucket/scenes/a.tif') is None
+    cog = hints.open(BytesReader(data), 's3://bucket/scenes/a.tif')
+    size = hints.size_for('s3://bucket/scenes/b.tif')
+    assert size >= cog.header_size
+    assert hints.size_for('s3://bucket/other/b.tif') is None
+
+    cog = hints.open(BytesReader(data), 's3://bucket/scenes/b.tif')
+    assert cog.header_stats['requests'] == 1
+
+
+def test_header_buffer_segments():
+    data = bytes(range(256)) * 16
+    reader = BytesReader(data)
+    buffer = HeaderBuffer(reader.read)
+    buffer.prefetch(100)
+    assert buffer.get(200, 50) == data[200:250]
+    assert buffer.has(200, 50)
+    assert not buffer.has(90, 20)
+    # only the gaps are read
+    assert buffer.get(50, 250) == data[50:300]
+    assert reader.reads == [(0, 100), (200, 50), (100, 100), (250, 50)]
+    assert buffer.prefix_size == 300
+    assert buffer.nbytes == 300
+
+    # lookahead stops at the next segment
+    buffer.get(1000, 10)
+    buffer.get(900, 10, lookahead=500)
+    assert reader.reads[-1] == (900, 100)
+
+    buffer.release()
+    assert buffer.nbytes == 0
+    assert buffer.get(0, 10) == data[:10]
+    assert buffer.nbytes == 0
+    assert buffer.requests == 7
+
+
+def test_header_buffer_threads():
+    data = bytes(range(256)) * 64
+
+    class SlowReader(BytesReader):
+        def read(self, offset, length):
+            time.sleep(0.001)
+            return super().read(offset, length)
+
+    buffer = HeaderBuffer(SlowReader(data).read)
+    buffer.prefetch(64)
+    ranges = [(offset, 100 + offset % 300) for offset in range(0, 15000, 137)]
+    errors = []
+
+    def get(chunk):
+        for offset, length in chunk:
+            if bytes(buffer.get(offset, length, lookahead=200)) != data[offset:offset + length]:
+                errors.append((offset, length))
+
+    threads = [threading.Thread(target=get, args=(ranges[n::6],)) for n in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    # segments stay sorted and apart
+    ends = [start + len(segment) for start, segment in zip(buffer._starts, buffer._segments)]
+    assert all(end <= start for end, start in zip(ends, buffer._starts[1:]))
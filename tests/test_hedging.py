@@ -0,0 +1,177 @@
+"""Tests hedged and deadline-aware reads."""
+
+import itertools
+import threading
+import time
+
+import pytest
+
+from cogdumper import hedging
+from cogdumper.cog_tiles import COGTiff
+from cogdumper.errors import DeadlineExceededError, TIFFError
+
+from synthetic import FakeS3Client, make_cog, serve_files, stragglers, tile_payload
+
+
+class Slow:
+    """Read whose n-th call takes delays[n] seconds, then fails or returns n."""
+
+    def __init__(self, *delays, fail=()):
+        self.delays = delays
+        self.fail = fail
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            n = next(self.counter)
+        time.sleep(self.delays[n])
+        if n in self.fail:
+            raise TIFFError(f'attempt {n} failed')
+        return n
+
+
+def timed(func, *args):
+    started = time.monotonic()
+    result = func(*args)
+    return result, time.monotonic() - started
+
+
+def test_hedge_wins():
+    hedger = hedging.Hedger(delay=0.02, min_delay=0)
+    result, elapsed = timed(hedger.call, Slow(1.0, 0))
+    assert result == 1
+    assert elapsed < 0.5
+    assert hedger.stats['fired'] == 1 and hedger.stats['won'] == 1
+
+    # the first attempt still returning first is not a win
+    assert hedger.call(Slow(0.05, 1.0)) == 0
+    assert hedger.stats['fired'] == 2 and hedger.stats['won'] == 1
+
+
+def test_fast_reads_are_not_hedged():
+    # the least delay is far above the latency, so that scheduling jitter
+    # does not fire hedges
+    hedger = hedging.Hedger(delay=0.5, percentile=99, min_delay=0.05, min_samples=10)
+    for _ in range(20):
+        assert hedger.call(Slow(0.002)) == 0
+    assert hedger.stats['calls'] == 20
+    assert hedger.stats['fired'] == 0
+    # the delay follows the observed latencies, down to the least delay
+    assert hedger.stats['delay_ms'] < 50
+    assert hedger.delay() == 0.05
+
+
+def test_failed_attempt_waits_for_hedge():
+    hedger = hedging.Hedger(delay=0.02, min_delay=0)
+    assert hedger.call(Slow(0.1, 0.2, fail={0})) == 1
+    with pytest.raises(TIFFError) as e:
+        hedger.call(Slow(0.1, 0.05, fail={0, 1}))
+    assert e.value.message == 'attempt 0 failed'
+
+
+def test_deadline():
+    with pytest.raises(DeadlineExceededError):
+        hedging.call(None, Slow(1.0), timeout=0.05)
+    hedger = hedging.Hedger(delay=0.02, min_delay=0)
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceededError):
+        with hedging.deadline(0.1):
+            # an inner deadline does not extend the outer one
+            with hedging.deadline(10):
+                hedger.call(Slow(1.0, 1.0))
+    assert time.monotonic() - started < 0.5
+    assert hedging.remaining() is None
+    # without a hedger the read runs in the caller's thread
+    assert hedging.call(None, threading.get_ident) == threading.get_ident()
+    assert hedging.call(None, threading.get_ident, timeout=1) == threading.get_ident()
+
+
+def test_s3_get_tile_deadline():
+    pytest.importorskip('boto3')
+    from cogdumper.s3dumper import Reader
+    client = FakeS3Client({('bucket', 'cog.tif'): make_cog(levels=((512, 512),))})
+    cog = COGTiff(Reader('bucket', 'cog.tif', client=client).read)
+    client.latency = 0.5
+    with pytest.raises(DeadlineExceededError):
+        cog.get_tile(1, 1, 0, deadline=0.05)
+    client.latency = 0
+    assert cog.get_tile(1, 1, 0, deadline=1)[1] == tile_payload(1, 1, 0)
+
+
+def test_http_stragglers():
+    pytest.importorskip('requests')
+    from cogdumper.httpdumper import Reader
+    data = make_cog(levels=((1024, 1024), (512, 512)))
+    server = serve_files({'/data/cog.tif': data})
+    try:
+        hedger = hedging.Hedger(delay=0.05, min_delay=0.02, percentile=90)
+        reader = Reader(server.url, 'data', 'cog.tif', hedger=hedger)
+        cog = COGTiff(reader.read)
+        server.latency = stragglers(0.001, 1.0, 0.1, seed=4)
+        started = time.monotonic()
+        for n in range(40):
+            x, y = n % 4, n // 4 % 4
+            assert cog.get_tile(x, y, 0)[1] == tile_payload(x, y, 0)
+        elapsed = time.monotonic() - started
+        stats = hedger.stats
+        assert stats['won'] >= 1
+        assert stats['fired'] >= stats['won']
+        # without hedging the stragglers alone would take seconds
+        assert elapsed < 3
+
+        server.latency = 1.0
+        with pytest.raises(DeadlineExceededError):
+            cog.get_tile(0, 0, 0, deadline=0.1)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_http_stream_hedged():
+    pytest.importorskip('requests')
+    from cogdumper.httpdumper import Reader
+    data = make_cog(levels=((1024, 1024),))
+    server = serve_files({'/data/cog.tif': data})
+    try:
+        delays = iter([1.0])
+        server.latency = lambda: next(delays, 0)
+        hedger = hedging.Hedger(delay=0.05, min_delay=0)
+        reader = Reader(server.url, 'data', 'cog.tif', hedger=hedger)
+        chunks, elapsed = timed(lambda: list(reader.stream(100, 1000, chunk_size=64)))
+        assert b''.join(chunks) == data[100:1100]
+        assert elapsed < 0.5
+        assert hedger.stats['won'] == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize('stream_min_bytes', [0, 1024 * 1024])
+def test_server_deadline(stream_min_bytes):
+    pytest.importorskip('requests')
+    import http.client
+    from cogdumper.catalog import Catalog
+    from cogdumper.server import TileServer
+    files = serve_files({'/data/cog.tif': make_cog(levels=((1024, 1024),))})
+    catalog = Catalog({'a': f'{files.url}/data/cog.tif'})
+    server = TileServer(('127.0.0.1', 0), catalog, stream_min_bytes=stream_min_bytes,
+                        deadline=0.2)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        conn = http.client.HTTPConnection('127.0.0.1', server.server_port)
+        conn.request('GET', '/a/0/1/1')
+        r = conn.getresponse()
+        assert r.status == 200
+        assert r.read() == tile_payload(1, 1, 0)
+        files.latency = 1.0
+        conn.request('GET', '/a/0/1/0')
+        r = conn.getresponse()
+        assert r.status == 504
+        r.read()
+        conn.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        files.shutdown()
+        files.server_close()
@@ -0,0 +1,105 @@
+"""Tests the HTTP reader against a local server."""
+
+import time
+
+import pytest
+
+from cogdumper.cog_tiles import COGTiff
+from cogdumper.errors import TIFFError
+
+from synthetic import make_cog, tile_payload
+
+pytest.importorskip('requests')
+
+from cogdumper.httpdumper import Reader  # noqa: E402
+
+
+@pytest.fixture
+def cog_server(http_server):
+    http_server.files['/data/cog.tif'] = make_cog(levels=((1024, 1024), (512, 512)))
+    return http_server
+
+
+def test_no_head_request(cog_server):
+    reader = Reader(cog_server.url, 'data', 'cog.tif')
+    assert cog_server.requests == []
+    data = reader.read(0, 8)
+    assert data == cog_server.files['/data/cog.tif'][:8]
+    assert len(cog_server.requests) == 1
+    assert reader.resource_exists
+    stat = reader.stat()
+    assert stat['size'] == len(cog_server.files['/data/cog.tif'])
+    assert stat['etag'] is not None
+    assert len(cog_server.requests) == 1
+
+
+def test_missing_resource(cog_server):
+    reader = Reader(cog_server.url, 'data', 'missing.tif')
+    assert not reader.resource_exists
+
+
+@pytest.mark.parametrize('range_mode', ['multi', 'single', 'whole'])
+def test_read_many(cog_server, range_mode):
+    cog_server.range_mode = range_mode
+    data = cog_server.files['/data/cog.tif']
+    reader = Reader(cog_server.url, 'data', 'cog.tif')
+    ranges = [(100, 10), (0, 4), (500, 0), (len(data) - 5, 5)]
+    expected = [data[o:o + n] for o, n in ranges]
+    assert reader.read_many(ranges) == expected
+    if range_mode == 'multi':
+        assert len(cog_server.requests) == 1
+        assert cog_server.requests[0][1] == \
+            f'bytes=100-109,0-3,{len(data) - 5}-{len(data) - 1}'
+
+    elif range_mode == 'whole':
+        # the multi-range request, then each range again
+        assert len(cog_server.requests) == 4
+        assert not reader._multi_range
+
+    # servers that only serve single ranges get single range requests
+    cog_server.requests.clear()
+    assert reader.read_many(ranges) == expected
+    expected_requests = {'multi': 1, 'single': 3, 'whole': 3}[range_mode]
+    assert len(cog_server.requests) == expected_requests
+
+
+@pytest.mark.parametrize('range_mode', ['single', 'whole'])
+def test_unserved_ranges_read_concurrently(cog_server, range_mode):
+    cog_server.range_mode = range_mode
+    cog_server.latency = 0.3
+    data = cog_server.files['/data/cog.tif']
+    reader = Reader(cog_server.url, 'data', 'cog.tif')
+    ranges = [(0, 4), (100, 10), (200, 10), (300, 10)]
+    started = time.monotonic()
+    assert reader.read_many(ranges) == [data[o:o + n] for o, n in ranges]
+    # the multi-range request, then the ranges it did not return at once
+    assert time.monotonic() - started < 1.0
+
+
+def test_ranges_ignored(cog_server):
+    cog_server.range_mode = 'none'
+    reader = Reader(cog_server.url, 'data', 'cog.tif')
+    with pytest.raises(TIFFError):
+        reader.read(100, 10)
+    with pytest.raises(TIFFError):
+        reader.read_many([(100, 10), (0, 4)])
+    with pytest.raises(TIFFError):
+        list(reader.stream(100, 1000))
+
+
+def test_get_tiles(cog_server):
+    reader = Reader(cog_server.url, 'data', 'cog.tif')
+    cog = COGTiff(reader.read)
+    cog_server.requests.clear()
+    tiles = [(0, 0, 0), (3, 3, 0), (1, 1, 1)]
+    results = cog.get_tiles(tiles, max_gap=0)
+    assert [t for _, t in results] == [tile_payload(*t) for t in tiles]
+    assert len(cog_server.requests) == 1
+
+
+def test_stream(cog_server):
+    data = cog_server.files['/data/cog.tif']
+    reader = Reader(cog_server.url, 'data', 'cog.tif')
+    chunks = list(reader.stream(100, 1000, chunk_size=64))
+    assert b''.join(chunks) == data[100:1100]
+    assert max(len(c) for c in chunks) <= 64
@@ -0,0 +1,78 @@
+"""Tests the sidecar tile index."""
+
+import json
+import os
+
+import pytest
+
+from cogdumper.cog_tiles import COGTiff
+from cogdumper.filedumper import Reader as FileReader
+from cogdumper.index import IndexStore, INDEX_VERSION
+
+
+class CountingReader(FileReader):
+    def __init__(self, handle):
+        super().__init__(handle)
+        self.reads = 0
+
+    def read(self, offset, length):
+        self.reads += 1
+        return super().read(offset, length)
+
+
+@pytest.fixture
+def data_dir():
+    return os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data')
+
+
+@pytest.fixture(params=['cog.tif', 'be_cog.tif', 'BigTIFF.tif'])
+def tiff(request, data_dir):
+    with open(os.path.join(data_dir, request.param), 'rb') as src:
+        yield src
+
+
+def test_index_roundtrip(tiff, tmpdir):
+    store = IndexStore(str(tmpdir))
+    reader = CountingReader(tiff)
+    cog = store.open(reader)
+    assert reader.reads > 0
+    assert os.path.exists(store.path(reader.stat()['url']))
+
+    reader = CountingReader(tiff)
+    indexed = store.open(reader)
+    assert reader.reads == 0
+    assert indexed.version == cog.version
+    assert indexed.get_tile(0, 0, 0) == cog.get_tile(0, 0, 0)
+    assert indexed.get_tile(0, 0, 4) == cog.get_tile(0, 0, 4)
+    assert reader.reads == 2
+
+
+def test_index_stale(tiff, tmpdir):
+    store = IndexStore(str(tmpdir))
+    reader = FileReader(tiff)
+    store.open(reader)
+    stat = reader.stat()
+    assert store.load(stat) is not None
+    assert store.load(dict(stat, mtime=stat['mtime'] + 1)) is None
+    assert store.load(dict(stat, size=stat['size'] + 1)) is None
+
+
+def test_index_version(tiff, tmpdir):
+    store = IndexStore(str(tmpdir))
+    reader = FileReader(tiff)
+    store.open(reader)
+    path = store.path(reader.stat()['url'])
+    with open(path) as src:
+        index = json.load(src)
+    index['version'] = INDEX_VERSION + 1
+    with open(path, 'w') as dst:
+        json.dump(index, dst)
+    assert store.load(reader.stat()) is None
+
+
+def test_index_constructor(tiff):
+    cog = COGTiff(FileReader(tiff).read)
+    indexed = COGTiff(None, index=json.loads(json.dumps(cog.to_index())))
+    assert len(indexed._image_ifds) == len(cog._image_ifds)
+    assert indexed._image_ifds[0]['jpeg_tables'] == \
+        cog._image_ifds[0]['jpeg_tables']
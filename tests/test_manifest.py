@@ -0,0 +1,87 @@
+"""Tests extracting tiles listed in a manifest."""
+
+import os
+
+import pytest
+
+from cogdumper.manifest import (
+    extract_manifest, format_progress, output_directory, parse_entry, read_manifest
+)
+
+from synthetic import make_cog, tile_payload
+
+
+def test_parse_entry():
+    assert parse_entry('s3://bucket/a.tif 1 2 0\n') == ('s3://bucket/a.tif', 1, 2, 0)
+    assert parse_entry('/data/my scene.tif,1,2,0') == ('/data/my scene.tif', 1, 2, 0)
+    assert parse_entry('{"source": "a.tif", "x": 1, "y": 2, "z": 0}') == ('a.tif', 1, 2, 0)
+    assert parse_entry(' ') is None
+    for line in ('a.tif 1 2', 'a.tif x y z', '{"source": "a.tif"}'):
+        with pytest.raises(ValueError):
+            parse_entry(line)
+
+
+def test_read_manifest():
+    lines = ['a.tif 0 0 0', 'b.tif 1 0 0', '', 'a.tif 1 1 0', 'a.tif 0 0 0']
+    assert read_manifest(lines) == {
+        'a.tif': [(0, 0, 0), (1, 1, 0)],
+        'b.tif': [(1, 0, 0)]
+    }
+
+
+def test_output_directory():
+    assert output_directory('out', 's3://bucket/a/b.tif') == 'out/bucket/a/b'
+    assert output_directory('out', 'https://host/data/c.tif') == 'out/host/data/c'
+    assert output_directory('out', '/data/../d.tif') == 'out/data/d'
+    assert output_directory('out', 'file:///data/e.tif') == 'out/data/e'
+
+
+def test_extract_manifest(tmpdir):
+    groups = {}
+    for name in ('a', 'b', 'c'):
+        path = tmpdir.join(f'{name}.tif')
+        path.write_binary(make_cog(levels=((512, 512), (256, 256)), empty=[(0, 1, 0)]))
+        groups[str(path)] = [(0, 0, 0), (1, 1, 0), (0, 0, 1), (0, 1, 0)]
+    # a tile that does not exist and a source that cannot be read
+    groups[str(tmpdir.join('a.tif'))].append((5, 5, 0))
+    groups[str(tmpdir.join('missing.tif'))] = [(0, 0, 0), (1, 0, 0)]
+
+    progress = []
+    output = str(tmpdir.join('out'))
+    result = extract_manifest(groups, output, processes=2, threads=2, chunk_size=1,
+                              progress=progress.append)
+    assert result['sources'] == 4
+    assert result['tiles'] == 9
+    assert result['empty'] == 3
+    assert result['errors'] == 3
+    assert result['bytes'] == 3 * sum(
+        len(tile_payload(*t)) for t in [(0, 0, 0), (1, 1, 0), (0, 0, 1)])
+    # one report per chunk, even for chunks that finish together
+    assert len(progress) == 4 and progress[-1]['tiles'] == 9
+    assert 'tiles/s' in format_progress(result, 4)
+
+    for name in ('a', 'b', 'c'):
+        directory = output_directory(output, str(tmpdir.join(f'{name}.tif')))
+        with open(os.path.join(directory, '0', '1', '1.bin'), 'rb') as src:
+            assert src.read() == tile_payload(1, 1, 0)
+        with open(os.path.join(directory, '1', '0', '0.bin'), 'rb') as src:
+            assert src.read() == tile_payload(0, 0, 1)
+        # sparse tiles are not written
+        assert not os.path.exists(os.path.join(directory, '0', '0', '1.bin'))
+
+
+def test_cli(tmpdir):
+    click_testing = pytest.importorskip('click.testing')
+    from cogdumper.scripts.cli import cogdumper
+
+    path = tmpdir.join('scene.tif')
+    path.write_binary(make_cog(levels=((512, 512), (256, 256))))
+    manifest = f'{path} 0 0 0\n{path} 1 0 0\n'
+    output = tmpdir.join('out')
+    result = click_testing.CliRunner().invoke(
+        cogdumper, ['extract', '-', str(output), '--processes', '1'], input=manifest)
+    assert result.exit_code == 0, result.output
+    assert '1/1 sources, 2 tiles' in result.output
+    directory = output_directory(str(output), str(path))
+    with open(os.path.join(directory, '0', '1', '0.bin'), 'rb') as src:
+        assert src.read() == tile_payload(1, 0, 0)
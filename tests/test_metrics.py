@@ -0,0 +1,69 @@
+"""Tests the request metrics."""
+
+import pytest
+
+from cogdumper import metrics
+from cogdumper.cog_tiles import COGTiff
+from cogdumper.filedumper import MMapReader
+
+from synthetic import make_cog
+
+
+@pytest.fixture
+def registry():
+    registry = metrics.enable()
+    yield registry
+    metrics.disable()
+
+
+def test_histogram():
+    histogram = metrics.Histogram((1, 10, 100))
+    for value in (0.5, 2, 3, 50, 500):
+        histogram.observe(value)
+    assert histogram.counts == [1, 2, 1, 1]
+    assert histogram.percentile(50) == 10
+    assert histogram.percentile(99) == '+Inf'
+    assert histogram.snapshot()['buckets'] == [[1, 1], [10, 3], [100, 4], ['+Inf', 5]]
+
+
+def test_attribution(tmpdir, registry):
+    # JPEG image levels with deflate masks
+    path = str(tmpdir.join('cog.tif'))
+    with open(path, 'wb') as dst:
+        dst.write(make_cog(levels=((512, 512), (512, 512)), compression=(7, 8)))
+
+    with MMapReader.open(path) as reader:
+        cog = COGTiff(reader.read)
+        header = registry.snapshot()
+        assert list(header['kinds']) == ['header']
+        assert header['backends']['mmap']['requests'] == header['total']['requests']
+
+        cog.get_tile(1, 1, 0)
+        cog.get_tiles([(0, 0, 0), (0, 1, 0)], max_gap=0)
+        del cog
+
+    snapshot = registry.snapshot()
+    assert snapshot['kinds']['tile']['requests'] == 3
+    assert snapshot['kinds']['mask']['requests'] == 3
+    assert snapshot['total']['requests'] == header['total']['requests'] + 6
+    assert snapshot['total']['latency_ms']['count'] == snapshot['total']['requests']
+    assert 'mask' in metrics.format_summary(snapshot)
+
+    metrics.disable()
+    registry.reset()
+    assert registry.snapshot()['total']['requests'] == 0
+
+
+def test_reader_registry(tmpdir):
+    path = str(tmpdir.join('cog.tif'))
+    with open(path, 'wb') as dst:
+        dst.write(make_cog())
+    registry = metrics.Metrics()
+    with MMapReader.open(path) as reader:
+        reader.metrics = registry
+        cog = COGTiff(reader.read)
+        _, _, chunks = cog.stream_tile(0, 0, 0, chunk_size=16)
+        list(chunks)
+        del cog, chunks
+    assert registry.snapshot()['kinds']['tile']['requests'] == 1
+    assert metrics.active() is None
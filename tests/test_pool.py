@@ -0,0 +1,33 @@
+"""Tests concurrent range reads."""
+
+import threading
+import time
+
+from cogdumper import pool
+
+
+def test_read_many_concurrent():
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def read(offset, length):
+        with lock:
+            active.append(offset)
+            peak.append(len(active))
+        time.sleep(0.05)
+        with lock:
+            active.remove(offset)
+        return bytes([offset]) * length
+
+    ranges = [(i, i + 1) for i in range(8)]
+    start = time.monotonic()
+    results = pool.read_many(read, ranges)
+    assert time.monotonic() - start < 0.05 * 4
+    assert max(peak) > 1
+    assert results == [bytes([i]) * (i + 1) for i in range(8)]
+
+
+def test_read_many_single():
+    assert pool.read_many(lambda o, l: b'x' * l, [(0, 3)]) == [b'xxx']
+    assert pool.read_many(lambda o, l: b'', []) == []
@@ -0,0 +1,54 @@
+"""Tests the byte range helpers."""
+
+import pytest
+
+from cogdumper.ranges import coalesce, parse_byteranges, parse_content_range, slice_ranges
+
+
+def test_coalesce():
+    ranges = [(100, 10), (0, 10), (10, 5), (120, 5), (500, 1)]
+    assert coalesce(ranges, 0) == [
+        (0, 15, [1, 2]),
+        (100, 10, [0]),
+        (120, 5, [3]),
+        (500, 1, [4])
+    ]
+    assert coalesce(ranges, 10) == [
+        (0, 15, [1, 2]),
+        (100, 25, [0, 3]),
+        (500, 1, [4])
+    ]
+
+
+def test_coalesce_overlap():
+    assert coalesce([(0, 100), (10, 5)], 0) == [(0, 100, [0, 1])]
+    assert coalesce([], 0) == []
+
+
+def test_parse_content_range():
+    assert parse_content_range('bytes 10-19/100') == (10, 19, 100)
+    assert parse_content_range('bytes 10-19/*') == (10, 19, None)
+    assert parse_content_range('items 1-2/3') is None
+    assert parse_content_range(None) is None
+
+
+def test_parse_byteranges():
+    # part data that contains the boundary is not split
+    body = (
+        b'--XYZ\r\nContent-Type: image/tiff\r\n'
+        b'Content-Range: bytes 0-10/100\r\n\r\n--XYZ\r\n0123\r\n'
+        b'--XYZ\r\ncontent-range: bytes 50-52/100\r\n\r\nabc\r\n'
+        b'--XYZ--\r\n'
+    )
+    parts = parse_byteranges('multipart/byteranges; boundary="XYZ"', body)
+    assert parts == [(0, b'--XYZ\r\n0123'), (50, b'abc')]
+    with pytest.raises(ValueError):
+        parse_byteranges('multipart/byteranges', body)
+    with pytest.raises(ValueError):
+        parse_byteranges('multipart/byteranges; boundary=XYZ', body[:60])
+
+
+def test_slice_ranges():
+    parts = [(0, b'0123456789'), (50, b'abc')]
+    assert slice_ranges([(2, 3), (51, 2), (8, 4), (20, 1)], parts) == \
+        [b'234', b'bc', None, None]
@@ -0,0 +1,79 @@
+"""Tests the S3 reader against an in memory stand-in."""
+
+import pytest
+
+from cogdumper import hedging
+from cogdumper.cog_tiles import COGTiff
+from cogdumper.errors import DeadlineExceededError
+
+from synthetic import FakeS3Client, make_cog, tile_payload
+
+pytest.importorskip('boto3')
+
+from botocore.exceptions import ReadTimeoutError  # noqa: E402
+
+from cogdumper import s3dumper  # noqa: E402
+from cogdumper.s3dumper import Reader  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    return FakeS3Client({('bucket', 'cog.tif'): make_cog(levels=((512, 512), (256, 256)))})
+
+
+def test_get_tile(client):
+    reader = Reader('bucket', 'cog.tif', client=client)
+    cog = COGTiff(reader.read)
+    assert cog.get_tiles([(1, 1, 0), (0, 0, 1)], max_gap=0) == [
+        ('application/octet-stream', tile_payload(1, 1, 0)),
+        ('application/octet-stream', tile_payload(0, 0, 1))
+    ]
+    _, size, chunks = cog.stream_tile(1, 0, 0, chunk_size=8)
+    chunks = list(chunks)
+    assert len(chunks) > 1
+    assert b''.join(chunks) == tile_payload(1, 0, 0)
+    assert size == len(tile_payload(1, 0, 0))
+
+
+def test_stat(client):
+    stat = Reader('bucket', 'cog.tif', client=client).stat()
+    assert stat['url'] == 's3://bucket/cog.tif'
+    assert stat['size'] == len(client.objects[('bucket', 'cog.tif')])
+
+
+def test_timeout_clients():
+    client = s3dumper.get_client(0.3)
+    assert client.meta.config.read_timeout == 0.5
+    assert client.meta.config.connect_timeout == 0.5
+    assert s3dumper.get_client(0.4) is client
+    assert s3dumper.get_client(100).meta.config.read_timeout == 100
+    assert s3dumper.get_client() is not client
+
+
+def test_deadline_bounds_requests(client, monkeypatch):
+    timeouts = []
+
+    def get_client(timeout=None):
+        timeouts.append(timeout)
+        return client
+
+    monkeypatch.setattr(s3dumper, 'get_client', get_client)
+    reader = Reader('bucket', 'cog.tif')
+    assert reader.read(0, 4) == client.objects[('bucket', 'cog.tif')][:4]
+    with hedging.deadline(2):
+        reader.read(0, 4)
+    assert timeouts[0] is None
+    assert 0 < timeouts[-1] <= 2
+
+
+class TimingOutClient(FakeS3Client):
+    def get_object(self, Bucket, Key, Range=None):
+        raise ReadTimeoutError(endpoint_url=f's3://{Bucket}/{Key}')
+
+
+def test_timeouts_exceed_deadline():
+    reader = Reader('bucket', 'cog.tif', client=TimingOutClient())
+    with pytest.raises(ReadTimeoutError):
+        reader.read(0, 4)
+    with hedging.deadline(2), pytest.raises(DeadlineExceededError):
+        reader.read(0, 4)
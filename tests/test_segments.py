@@ -0,0 +1,45 @@
+"""Tests vectored output."""
+
+import os
+import socket
+import threading
+
+from cogdumper import segments as vectored
+
+
+def test_advance():
+    views = [memoryview(b'abc'), memoryview(b'de'), memoryview(b'fgh')]
+    assert [bytes(v) for v in vectored._advance(views, 4)] == [b'e', b'fgh']
+
+
+def test_write_segments(tmpdir, monkeypatch):
+    monkeypatch.setattr(vectored, 'IOV_MAX', 2)
+    parts = [b'ab', memoryview(b'xcdx')[1:3], b'', bytearray(b'ef'), b'g']
+    path = str(tmpdir.join('out'))
+    with open(path, 'wb', buffering=0) as dst:
+        vectored.write_segments(dst.fileno(), parts)
+    with open(path, 'rb') as src:
+        assert src.read() == b'abcdefg'
+    assert vectored.nbytes(parts) == 7
+
+
+def test_send_segments():
+    # large enough for sendmsg to send part of it at a time
+    parts = [os.urandom(1 << 20), b'x', os.urandom(1 << 20)]
+    a, b = socket.socketpair()
+    received = []
+
+    def receive():
+        while True:
+            data = b.recv(65536)
+            if not data:
+                break
+            received.append(data)
+
+    thread = threading.Thread(target=receive)
+    thread.start()
+    vectored.send_segments(a, parts)
+    a.close()
+    thread.join()
+    b.close()
+    assert b''.join(received) == b''.join(parts)
@@ -0,0 +1,229 @@
+"""Tests the tile server."""
+
+import http.client
+import threading
+
+import pytest
+
+from cogdumper.catalog import Catalog
+from cogdumper.errors import DeadlineExceededError, TIFFError
+from cogdumper.server import TileServer
+
+from synthetic import BytesReader, make_cog, tile_payload
+
+
+@pytest.fixture
+def tile_server(tmpdir):
+    datasets = {}
+    for name in ('a', 'b', 'c'):
+        path = tmpdir.join(f'{name}.tif')
+        path.write_binary(make_cog(levels=((512, 512), (256, 256))))
+        datasets[name] = str(path)
+    catalog = Catalog(datasets, max_open=2)
+    server = TileServer(('127.0.0.1', 0), catalog, workers=4)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_serve_tiles(tile_server):
+    conn = http.client.HTTPConnection('127.0.0.1', tile_server.server_port)
+    # several requests on one keep-alive connection
+    for name, z, x, y in [('a', 0, 1, 1), ('b', 1, 0, 0), ('c', 0, 0, 1), ('a', 0, 1, 0)]:
+        conn.request('GET', f'/{name}/{z}/{x}/{y}')
+        r = conn.getresponse()
+        assert r.status == 200
+        assert r.getheader('Content-Type') == 'application/octet-stream'
+        assert r.read() == tile_payload(x, y, z)
+    assert len(tile_server.catalog) == 2
+
+    conn.request('GET', '/a/0/5/5')
+    r = conn.getresponse()
+    assert r.status == 404
+    r.read()
+    conn.request('GET', '/missing/0/0/0')
+    r = conn.getresponse()
+    assert r.status == 404
+    r.read()
+    conn.close()
+
+
+@pytest.mark.parametrize('stream_min_bytes', [0, 1024 * 1024])
+def test_sparse_tile(tmpdir, stream_min_bytes):
+    path = tmpdir.join('sparse.tif')
+    path.write_binary(make_cog(levels=((512, 512),), empty=[(1, 1, 0)]))
+    server = TileServer(('127.0.0.1', 0), Catalog({'sparse': str(path)}),
+                        stream_min_bytes=stream_min_bytes)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        conn = http.client.HTTPConnection('127.0.0.1', server.server_port)
+        conn.request('GET', '/sparse/0/1/1')
+        r = conn.getresponse()
+        assert r.status == 204
+        assert r.getheader('Content-Type') is None
+        assert r.read() == b''
+        # the connection is kept alive
+        conn.request('GET', '/sparse/0/0/0')
+        r = conn.getresponse()
+        assert r.status == 200
+        assert r.read() == tile_payload(0, 0, 0)
+        conn.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_stream_tiles(tile_server):
+    tile_server.stream_min_bytes = 0
+    conn = http.client.HTTPConnection('127.0.0.1', tile_server.server_port)
+    for x, y in [(0, 0), (1, 1)]:
+        conn.request('GET', f'/a/0/{x}/{y}')
+        r = conn.getresponse()
+        assert r.status == 200
+        assert r.read() == tile_payload(x, y, 0)
+    conn.close()
+
+
+@pytest.mark.parametrize('stream_min_bytes', [0, 1024 * 1024])
+def test_concurrent_requests_while_evicting(tile_server, stream_min_bytes):
+    # three datasets over two open slots, every request may evict a COG
+    # that another thread is sending a tile from
+    tile_server.stream_min_bytes = stream_min_bytes
+    errors = []
+
+    def client(n):
+        conn = http.client.HTTPConnection('127.0.0.1', tile_server.server_port)
+        try:
+            for i in range(30):
+                name = 'abc'[(n + i) % 3]
+                x, y = i % 2, (i // 2) % 2
+                conn.request('GET', f'/{name}/0/{x}/{y}')
+                r = conn.getresponse()
+                body = r.read()
+                if r.status != 200 or body != tile_payload(x, y, 0):
+                    errors.append((name, x, y, r.status))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert tile_server.catalog.stats['evictions'] > 0
+
+
+class FailingReader(BytesReader):
+    """Reader whose reads raise failure once it is set."""
+
+    failure = None
+    short = False
+
+    def read(self, offset, length):
+        if self.failure is not None:
+            raise self.failure
+        data = super().read(offset, length)
+        # the end of the file cut off
+        return data[:length // 2] if self.short else data
+
+
+@pytest.fixture
+def failing_server():
+    readers = {}
+
+    def opener(url):
+        if url == 'corrupt':
+            return BytesReader(b'not a tiff')
+        readers[url] = FailingReader(make_cog(levels=((512, 512),)))
+        return readers[url]
+
+    catalog = Catalog({'a': 'a', 'corrupt': 'corrupt'}, opener=opener)
+    server = TileServer(('127.0.0.1', 0), catalog, workers=2)
+    server.readers = readers
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize('path,failure,status', [
+    ('/missing/0/0/0', None, 404),
+    ('/a/0/5/5', None, 404),
+    ('/a/3/0/0', None, 404),
+    ('/a/0/0/0', DeadlineExceededError('Read deadline exceeded'), 504),
+    ('/a/0/0/0', TIFFError('HTTP byte range 0-10 not available. HTTP code 503'), 502),
+    ('/a/0/0/0', ConnectionError('Connection reset'), 502),
+    ('/corrupt/0/0/0', None, 502),
+])
+def test_error_status(failing_server, path, failure, status):
+    conn = http.client.HTTPConnection('127.0.0.1', failing_server.server_port)
+    conn.request('GET', '/a/0/1/1')
+    r = conn.getresponse()
+    assert r.status == 200
+    r.read()
+    failing_server.readers['a'].failure = failure
+    conn.request('GET', path)
+    r = conn.getresponse()
+    assert r.status == status
+    r.read()
+    if status >= 500:
+        assert r.getheader('Cache-Control') == 'no-store'
+    conn.close()
+
+
+def test_short_read(failing_server):
+    conn = http.client.HTTPConnection('127.0.0.1', failing_server.server_port)
+    conn.request('GET', '/a/0/1/1')
+    conn.getresponse().read()
+    failing_server.readers['a'].short = True
+    conn.request('GET', '/a/0/0/0')
+    r = conn.getresponse()
+    assert r.status == 502
+    r.read()
+    # the connection is kept alive, its next response is complete
+    failing_server.readers['a'].short = False
+    conn.request('GET', '/a/0/0/0')
+    r = conn.getresponse()
+    assert r.status == 200
+    assert r.read() == tile_payload(0, 0, 0)
+    conn.close()
+
+
+def test_idle_connections_do_not_hold_workers(tmpdir):
+    path = tmpdir.join('a.tif')
+    path.write_binary(make_cog(levels=((512, 512),)))
+    server = TileServer(('127.0.0.1', 0), Catalog({'a': str(path)}), workers=2,
+                        max_connections=4)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        idle = []
+        for _ in range(3):
+            conn = http.client.HTTPConnection('127.0.0.1', server.server_port, timeout=2)
+            conn.request('GET', '/a/0/0/0')
+            r = conn.getresponse()
+            assert r.status == 200
+            r.read()
+            # the connection is kept alive, and idle
+            idle.append(conn)
+        conn = http.client.HTTPConnection('127.0.0.1', server.server_port, timeout=2)
+        conn.request('GET', '/a/0/1/1')
+        r = conn.getresponse()
+        assert r.status == 200
+        assert r.read() == tile_payload(1, 1, 0)
+
+        # a connection over the cap is refused
+        refused = http.client.HTTPConnection('127.0.0.1', server.server_port, timeout=2)
+        refused.request('GET', '/a/0/0/0')
+        assert refused.getresponse().status == 503
+        for c in idle + [conn, refused]:
+            c.close()
+    finally:
+        server.shutdown()
+        server.server_close()